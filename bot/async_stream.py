@@ -0,0 +1,382 @@
+""" asyncio run mode.
+
+An alternative to the threaded tweepy listener, where every stream connection and every tweet is a task on one event
+loop:
+
+    * AsyncTwitterStream reads the Twitter API v1.1 filter stream over asyncio streams, signing the request with
+      OAuth 1.0a. Each shard of the followed users gets its own connection, all on the same loop.
+    * AsyncTweetPipeline hands each tweet to the same TweetHandler as the threaded mode. The text of each tweet is
+      matched and its alerts dispatched in a thread, as sending an alert and marking it in the seen store commits to
+      SQLite, limited by a semaphore to "tweet_workers" tweets at a time. Image analysis follows as a task, limited
+      by a semaphore so only "image_workers" requests are in flight with the image analysis backend at a time. At
+      most "image_queue_size" tweets wait for their turn, the images of any more are skipped.
+    * Alerts and logs go through the background Discord senders (the "discord_async" setting is always enabled in
+      this mode), which post to each webhook in turn and wait out rate limits without blocking the loop.
+
+Reconnects back off in the same way as the StreamSupervisor.
+
+"""
+
+import asyncio
+import json
+import ssl
+import time
+from urllib.parse import urlencode, urlsplit
+
+import tweepy
+from oauthlib.oauth1 import Client
+
+from config import config, logger
+from metrics import counter, histogram, timed
+from supervisor import Backoff
+
+STREAM_PATH = "/1.1/statuses/filter.json"
+STREAM_URL = "https://stream.twitter.com" + STREAM_PATH
+
+TWEETS_SEEN = counter("tweets_seen_total", "Statuses received from the stream", ["followed"])
+DUPLICATE_TWEETS = counter("duplicate_tweets_total", "Followed tweets skipped because they were seen before", ["key"])
+PROCESS_SECONDS = histogram("process_tweet_seconds", "Time spent processing a tweet on a worker, excluding images")
+STATUS_ERRORS = counter("stream_status_errors_total", "Statuses whose handler raised an error")
+
+
+class StreamHTTPError(Exception):
+    """ Raised when the stream responds with an HTTP error.
+
+    Attributes:
+        status (int): HTTP status code.
+    """
+
+    def __init__(self, status, reason):
+        super().__init__(f"{status} {reason}")
+        self.status = status
+
+
+class AsyncTwitterStream:
+    """ Connection to the Twitter API v1.1 filter stream, kept connected forever.
+
+    Attributes:
+        follow (list of str): User ids to follow.
+        on_status (callable): Called with the raw JSON of each status.
+        url (str): Stream endpoint.
+        stall_timeout (float): Seconds without any data, including keep-alives, before reconnecting.
+        connect_timeout (float): Seconds to wait for the connection, including the TLS handshake, to be made.
+    """
+
+    def __init__(self, follow, on_status, url=STREAM_URL, stall_timeout=90, ssl_context=None, connect_timeout=10):
+        """ Initialises the stream, it is not connected until run() is awaited.
+
+        Args:
+            follow (list of str): User ids to follow.
+            on_status (callable): Called with the raw JSON of each status.
+            url (str): Stream endpoint.
+            stall_timeout (float): Seconds without any data, including keep-alives, before reconnecting.
+            ssl_context (SSLContext): Context for https connections, defaults to verifying against the system
+                certificates.
+            connect_timeout (float): Seconds to wait for the connection, including the TLS handshake, to be made.
+        """
+        self.follow = follow
+        self.on_status = on_status
+        self.url = url
+        self.stall_timeout = stall_timeout
+        self.connect_timeout = connect_timeout
+        self._ssl_context = ssl_context or ssl.create_default_context()
+        self._oauth = Client(
+            config["twitter_api_key"],
+            client_secret=config["twitter_api_secret"],
+            resource_owner_key=config["twitter_access_token"],
+            resource_owner_secret=config["twitter_access_token_secret"]
+        )
+        self._backoffs = {
+            "network": Backoff(0.25, 16),
+            "http": Backoff(5, 320),
+            "rate_limit": Backoff(60, 15 * 60)
+        }
+
+    async def _connect(self):
+        """ Opens the connection and sends the signed request.
+
+        Returns:
+            (StreamReader, StreamWriter, bool): Connection, and whether the body uses chunked transfer encoding.
+
+        Raises:
+            StreamHTTPError: If the stream responds with an error.
+        """
+        parts = urlsplit(self.url)
+        secure = parts.scheme == "https"
+        port = parts.port or (443 if secure else 80)
+        body = urlencode({"follow": ",".join(self.follow), "delimited": "length", "stall_warnings": "true"})
+        _, headers, body = self._oauth.sign(
+            self.url, http_method="POST", body=body, headers={"Content-Type": "application/x-www-form-urlencoded"}
+        )
+
+        reader, writer = await asyncio.wait_for(
+            asyncio.open_connection(parts.hostname, port, ssl=self._ssl_context if secure else None),
+            self.connect_timeout
+        )
+        request = [
+            f"POST {parts.path or '/'} HTTP/1.1",
+            f"Host: {parts.netloc}",
+            "User-Agent: crypto-tweet-bot",
+            "Accept-Encoding: identity",
+            f"Content-Length: {len(body)}"
+        ]
+        request.extend(f"{name}: {value}" for name, value in headers.items())
+        writer.write(("\r\n".join(request) + "\r\n\r\n" + body).encode())
+        await writer.drain()
+
+        status_line = await asyncio.wait_for(reader.readline(), self.stall_timeout)
+        _, status, reason = status_line.decode().rstrip("\r\n").split(" ", 2)
+        response_headers = {}
+        while True:
+            line = (await asyncio.wait_for(reader.readline(), self.stall_timeout)).decode().rstrip("\r\n")
+            if not line:
+                break
+            name, _, value = line.partition(":")
+            response_headers[name.strip().lower()] = value.strip()
+        if status != "200":
+            writer.close()
+            raise StreamHTTPError(int(status), reason)
+        return reader, writer, response_headers.get("transfer-encoding", "").lower() == "chunked"
+
+    async def _body(self, reader, chunked):
+        """ Reads the body of the response as it arrives.
+
+        Args:
+            reader (StreamReader): Connection.
+            chunked (bool): Whether the body uses chunked transfer encoding.
+
+        Yields:
+            bytes: Parts of the body.
+        """
+        while True:
+            if not chunked:
+                data = await reader.read(65536)
+                if not data:
+                    return
+                yield data
+                continue
+            size = int((await reader.readline()).split(b";")[0].strip() or b"0", 16)
+            if size == 0:
+                return
+            yield await reader.readexactly(size)
+            await reader.readexactly(2)
+
+    async def _read(self, reader, chunked):
+        """ Reads statuses until the stream ends or stalls.
+
+        Messages are length delimited, each is preceded by its length in bytes on a line of its own. Blank lines are
+        keep-alives.
+
+        Args:
+            reader (StreamReader): Connection.
+            chunked (bool): Whether the body uses chunked transfer encoding.
+        """
+        buffer = bytearray()
+        body = self._body(reader, chunked)
+        while True:
+            try:
+                data = await asyncio.wait_for(body.__anext__(), self.stall_timeout)
+            except StopAsyncIteration:
+                raise ConnectionError("Stream closed by the server")
+            except asyncio.TimeoutError:
+                raise ConnectionError(f"Stream stalled for {self.stall_timeout}s")
+            buffer += data
+
+            while True:
+                newline = buffer.find(b"\r\n")
+                if newline < 0:
+                    break
+                line = bytes(buffer[:newline]).strip()
+                if not line:
+                    del buffer[:newline + 2]
+                    continue
+                length = int(line)
+                if len(buffer) < newline + 2 + length:
+                    break
+                message = json.loads(bytes(buffer[newline + 2:newline + 2 + length]))
+                del buffer[:newline + 2 + length]
+                self._dispatch(message)
+
+    def _dispatch(self, message):
+        """ Hands statuses to the callback, and logs any notices from the stream.
+
+        An error raised by the callback is logged and the stream carries on with the next status, rather than the
+        connection being dropped.
+
+        Args:
+            message (dict): Message from the stream.
+        """
+        if "warning" in message:
+            logger.warning(f"Stream warning: {message['warning'].get('message')}")
+        elif "disconnect" in message:
+            logger.warning(f"Stream disconnect notice: {message['disconnect'].get('reason')}")
+        elif "text" in message and "user" in message:
+            try:
+                self.on_status(message)
+            except Exception as e:
+                STATUS_ERRORS.inc()
+                logger.error(f"Error handling status {message.get('id_str')}: {e!r}")
+
+    def _reason(self, error):
+        """ Classifies why the stream stopped.
+
+        Args:
+            error (Exception): Error which stopped the stream.
+
+        Returns:
+            str: Name of the backoff to use, "network", "http" or "rate_limit".
+        """
+        if isinstance(error, StreamHTTPError):
+            return "rate_limit" if error.status in (420, 429) else "http"
+        return "network"
+
+    async def run(self, stable_after=60):
+        """ Runs the stream forever, reconnecting with backoff whenever it stops.
+
+        Args:
+            stable_after (float): Seconds a connection has to stay up before the backoff is reset.
+        """
+        while True:
+            connected_at = None
+            writer = None
+            try:
+                reader, writer, chunked = await self._connect()
+                connected_at = time.monotonic()
+                logger.info(f"Connected to API stream following {len(self.follow)} user(s)")
+                await self._read(reader, chunked)
+            except (OSError, EOFError, StreamHTTPError, ValueError, asyncio.TimeoutError) as e:
+                # EOFError covers asyncio.IncompleteReadError, raised when the connection ends part way through a chunk
+                error = e
+            finally:
+                if writer is not None:
+                    writer.close()
+
+            if connected_at is not None and time.monotonic() - connected_at >= stable_after:
+                for backoff in self._backoffs.values():
+                    backoff.reset()
+            reason = self._reason(error)
+            delay = self._backoffs[reason].next()
+            logger.info(f"Restarting API stream in {delay:.1f}s ({reason}: {error})")
+            await asyncio.sleep(delay)
+
+
+class AsyncTweetPipeline:
+    """ Processes tweets from the streams as tasks on the event loop.
+
+    Attributes:
+        tweet_handler (TweetHandler): Tweet handler instance, shared by every stream.
+        following_ids (frozenset of int): Ids of the users whose tweets are processed.
+    """
+
+    def __init__(self, tweet_handler, following_ids, image_concurrency=4, text_concurrency=2):
+        """ Initialises the pipeline.
+
+        Args:
+            tweet_handler (TweetHandler): Tweet handler instance.
+            following_ids (list of str): Ids of the users whose tweets are processed.
+            image_concurrency (int): Maximum number of tweets having their images analysed at once.
+            text_concurrency (int): Maximum number of tweets having their text matched and alerts dispatched at once.
+        """
+        self.tweet_handler = tweet_handler
+        self.following_ids = frozenset(int(user_id) for user_id in following_ids)
+        self._process_text = timed(PROCESS_SECONDS)(tweet_handler.process_text)
+        self._text_semaphore = asyncio.Semaphore(text_concurrency)
+        self._image_semaphore = asyncio.Semaphore(image_concurrency)
+        self._in_flight = set()
+        self._tasks = set()
+
+    def on_status(self, data):
+        """ Handles a status from a stream.
+
+        Tweets which have already been processed, or are being processed, are skipped, as are retweets of tweets
+        which have already been processed.
+
+        Args:
+            data (dict): Raw JSON of the status.
+        """
+        followed = data["user"]["id"] in self.following_ids
+        TWEETS_SEEN.inc("true" if followed else "false")
+        if not followed:
+            return
+
+        tweet = tweepy.Status.parse(None, data)
+        seen_store = self.tweet_handler.seen_store
+        if tweet.id in self._in_flight or seen_store.seen_tweet(tweet.id):
+            DUPLICATE_TWEETS.inc("id")
+            return
+        # A retweet has no text or photos of its own, a quote tweet does and is always processed
+        retweeted = getattr(tweet, "retweeted_status", None)
+        if retweeted is not None and seen_store.seen_tweet(retweeted.id):
+            DUPLICATE_TWEETS.inc("retweet")
+            return
+
+        logger.info(f"Processing tweet id {tweet.id} from {tweet.user.screen_name}")
+        self._in_flight.add(tweet.id)
+        self._start(self._process(tweet))
+
+    def _start(self, coroutine):
+        """ Runs a coroutine as a task, keeping a reference to it until it finishes.
+
+        Args:
+            coroutine: Coroutine to run.
+
+        Returns:
+            Task: The task.
+        """
+        task = asyncio.get_running_loop().create_task(coroutine)
+        self._tasks.add(task)
+        task.add_done_callback(self._finished)
+        return task
+
+    async def _process(self, tweet):
+        """ Matches the text of a tweet and dispatches its alerts, then starts the analysis of its images.
+
+        Args:
+            tweet (tweet): Tweet object.
+        """
+        try:
+            async with self._text_semaphore:
+                result = await asyncio.to_thread(self._process_text, tweet)
+            if result.image_urls and self.tweet_handler.reserve_image_slot(tweet):
+                task = self._start(self._process_images(tweet, result))
+                task.add_done_callback(self.tweet_handler.release_image_slot)
+        finally:
+            self._in_flight.discard(tweet.id)
+
+    async def _process_images(self, tweet, result):
+        """ Analyses the images of a tweet, waiting for a turn with the image analysis backend.
+
+        Args:
+            tweet (tweet): Tweet object.
+            result (ScanResult): Matches found in the tweet text, with the URLs of its photos.
+        """
+        async with self._image_semaphore:
+            await asyncio.to_thread(self.tweet_handler.process_images, tweet, result)
+
+    def _finished(self, task):
+        """ Forgets a finished task, logging any unexpected error.
+
+        Args:
+            task (Task): Finished task.
+        """
+        self._tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            logger.error(f"Error processing tweet: {task.exception()!r}")
+
+
+async def run_async(tweet_handler, shards):
+    """ Runs a stream connection for each shard on one event loop.
+
+    Args:
+        tweet_handler (TweetHandler): Tweet handler instance.
+        shards (list of list of str): Ids followed by each stream.
+    """
+    pipeline = AsyncTweetPipeline(
+        tweet_handler,
+        [user_id for shard in shards for user_id in shard],
+        image_concurrency=config["image_workers"],
+        text_concurrency=config["tweet_workers"]
+    )
+    url = f"https://{config['twitter_stream_host']}{STREAM_PATH}"
+    streams = [AsyncTwitterStream(following_ids, pipeline.on_status, url) for following_ids in shards]
+    await asyncio.gather(*(stream.run() for stream in streams))
@@ -0,0 +1,508 @@
+""" Benchmarks for the matching engine.
+
+Runs offline, without connecting to Twitter, Google or Discord.
+
+Usage:
+
+    python benchmark.py overlaps --keywords 1000 2000 5000
+    python benchmark.py replay --corpus benchmark_tweets.jsonl --keyword-sizes 33 300 1000 --output results.json
+    python benchmark.py imports --budget brain=250 main=400
+
+The replay benchmark feeds a JSONL file of archived tweets (Twitter API v1.1 format) through
+TweetHandler.process_tweet, with a stubbed Google Vision client and loggers which discard everything. Photos may have
+a "vision" field giving the stub's answer, e.g. {"text": "BUY DOGE", "labels": ["Dog"]}, otherwise no text or labels
+are found.
+
+The imports benchmark measures the time taken to import modules in a fresh interpreter, and lists the slowest imports
+and any heavy client libraries pulled in. With --budget it exits with an error if a module takes longer than its
+budget in milliseconds, so slow imports can be caught before they reach container restarts and batch jobs.
+
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import string
+import subprocess
+import sys
+import time
+import tracemalloc
+
+from fuzzysearch.common import Match
+from matcher import resolve_overlaps
+
+
+def legacy_remove_duplicates(matches):
+    """ Pairwise duplicate removal, as used by TweetHandler before resolve_overlaps.
+
+    Kept here so the two approaches can be compared.
+
+    Args:
+        matches (list of Match): List of keyword Matches.
+
+    Returns:
+        list of Match: Filtered list of keyword Matches.
+    """
+    for match_1 in matches:
+        for match_2 in matches:
+            if match_1.start == match_2.start and match_1 != match_2:
+                if match_2.end >= match_1.end:
+                    matches.remove(match_1)
+                else:
+                    matches.remove(match_2)
+            if match_1.end == match_2.end and match_1 != match_2:
+                if match_2.start <= match_1.start:
+                    matches.remove(match_1)
+                else:
+                    matches.remove(match_2)
+    return matches
+
+
+def random_matches(count, text_length, seed=0):
+    """ Generates random keyword Matches spread across a text.
+
+    Args:
+        count (int): Number of matches, roughly one per keyword.
+        text_length (int): Length of the text the matches are placed in.
+        seed (int): Random seed, so runs are repeatable.
+
+    Returns:
+        list of Match: Randomly placed Matches, some of which overlap.
+    """
+    generator = random.Random(seed)
+    matches = []
+    for _ in range(count):
+        length = generator.randint(3, 15)
+        start = generator.randrange(text_length - length)
+        matched = "".join(generator.choice(string.ascii_lowercase) for _ in range(length))
+        matches.append(Match(start, start + length, 0, matched))
+    return matches
+
+
+def time_call(function, matches, repeats):
+    """ Times a duplicate removal function.
+
+    Args:
+        function (callable): Function taking a list of Matches.
+        matches (list of Match): Matches to be resolved, a copy is passed on each run.
+        repeats (int): Number of runs, the fastest is reported.
+
+    Returns:
+        dict: Fastest run time in seconds and the number of matches kept, or the error raised.
+    """
+    best = None
+    kept = None
+    for _ in range(repeats):
+        candidate = list(matches)
+        start = time.perf_counter()
+        try:
+            kept = len(function(candidate))
+        except ValueError as e:
+            # The pairwise removal can try to remove a match that has already gone
+            return {"seconds": None, "kept": None, "error": str(e)}
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return {"seconds": best, "kept": kept}
+
+
+def benchmark_overlaps(keyword_counts, repeats=3):
+    """ Compares resolve_overlaps with the legacy pairwise duplicate removal.
+
+    Args:
+        keyword_counts (list of int): Keyword list sizes to benchmark, one match per keyword.
+        repeats (int): Number of runs for each size.
+
+    Returns:
+        list of dict: One result per keyword list size.
+    """
+    results = []
+    for count in keyword_counts:
+        matches = random_matches(count, text_length=count * 10)
+        results.append({
+            "keywords": count,
+            "legacy": time_call(legacy_remove_duplicates, matches, repeats),
+            "resolve_overlaps": time_call(resolve_overlaps, matches, repeats)
+        })
+    return results
+
+
+class NullLogger:
+    """ Logger which discards every message. """
+
+    def info(self, message):
+        pass
+
+    def warning(self, message):
+        pass
+
+    def error(self, message):
+        pass
+
+    def debug(self, message):
+        pass
+
+
+class StubVisionClient:
+    """ Stand-in for the Google Vision API client.
+
+    Answers from the "vision" field of each photo in the corpus, keyed by image URL.
+
+    Attributes:
+        answers (dict): Image URL -> {"text": str, "labels": list of str}.
+        latency (float): Seconds to wait before answering each request, to simulate the network.
+        calls (int): Number of requests made.
+    """
+
+    def __init__(self, answers, latency=0):
+        """ Initialises the stub.
+
+        Args:
+            answers (dict): Image URL -> {"text": str, "labels": list of str}.
+            latency (float): Seconds to wait before answering each request.
+        """
+        self.answers = answers
+        self.latency = latency
+        self.calls = 0
+
+    def _response(self, image_url):
+        """ Builds the response for an image.
+
+        Args:
+            image_url (str): URL of the image.
+
+        Returns:
+            AnnotateImageResponse: Canned text and label annotations.
+        """
+        from google.cloud import vision
+
+        answer = self.answers.get(image_url, {})
+        text = answer.get("text", "")
+        return vision.AnnotateImageResponse(
+            text_annotations=[{"description": text}] if text else [],
+            label_annotations=[{"description": label} for label in answer.get("labels", [])]
+        )
+
+    def batch_annotate_images(self, requests, retry=None, timeout=None):
+        from google.cloud import vision
+
+        self.calls += 1
+        time.sleep(self.latency)
+        return vision.BatchAnnotateImagesResponse(
+            responses=[self._response(request.image.source.image_uri) for request in requests]
+        )
+
+    def text_detection(self, image, retry=None, timeout=None):
+        self.calls += 1
+        time.sleep(self.latency)
+        return self._response(image.source.image_uri)
+
+    def label_detection(self, image, retry=None, timeout=None):
+        self.calls += 1
+        time.sleep(self.latency)
+        return self._response(image.source.image_uri)
+
+
+def load_corpus(path):
+    """ Loads archived tweets from a JSONL file.
+
+    Args:
+        path (str): Path of the JSONL file, one tweet per line.
+
+    Returns:
+        (list of Status, dict): Tweets and the stub Vision answers for their photos, keyed by image URL.
+    """
+    import tweepy
+
+    tweets = []
+    answers = {}
+    with open(path) as file:
+        for line in file:
+            if not line.strip():
+                continue
+            data = json.loads(line)
+            for media in data.get("entities", {}).get("media", []):
+                if "vision" in media:
+                    answers[media["media_url_https"]] = media["vision"]
+            tweets.append(tweepy.Status.parse(None, data))
+    return tweets, answers
+
+
+def pad_keywords(keywords, size, seed=0):
+    """ Pads a keyword list with random ticker-like keywords.
+
+    Args:
+        keywords (list of str): Real keywords, always kept.
+        size (int): Size of the padded list.
+        seed (int): Random seed, so runs are repeatable.
+
+    Returns:
+        list of str: Keyword list of the requested size, or the real keywords if there are already enough.
+    """
+    generator = random.Random(seed)
+    padded = list(keywords)
+    while len(padded) < size:
+        length = generator.randint(3, 8)
+        padded.append("".join(generator.choice(string.ascii_lowercase) for _ in range(length)))
+    return padded
+
+
+def percentile(values, fraction):
+    """ Gets a percentile using the nearest rank method.
+
+    Args:
+        values (list of float): Sorted values.
+        fraction (float): Percentile as a fraction, e.g. 0.95.
+
+    Returns:
+        float: Value at the percentile.
+    """
+    index = max(0, min(len(values) - 1, int(round(fraction * len(values) + 0.5)) - 1))
+    return values[index]
+
+
+def replay(handler, tweets):
+    """ Processes every tweet, waiting for any image analysis to finish.
+
+    Args:
+        handler (TweetHandler): Tweet handler.
+        tweets (list of Status): Tweets to process.
+
+    Returns:
+        list of float: Time taken for each tweet in seconds.
+    """
+    latencies = []
+    for tweet in tweets:
+        start = time.perf_counter()
+        handler.process_tweet(tweet).wait()
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+def share_sizes(sizes, total):
+    """ Shares a total between lists in proportion to their sizes, never shrinking a list.
+
+    Args:
+        sizes (list of int): Current size of each list.
+        total (int): Total size wanted.
+
+    Returns:
+        list of int: New size of each list, adding up to the total unless the lists are already bigger.
+    """
+    current = sum(sizes)
+    shares = [max(size, total * size // current) for size in sizes]
+    # Rounding down leaves a few over, they go to the largest lists
+    for index in sorted(range(len(sizes)), key=lambda index: -sizes[index])[:max(0, total - sum(shares))]:
+        shares[index] += 1
+    return shares
+
+
+def benchmark_replay(corpus, keyword_sizes, repeats=5, vision_latency=0):
+    """ Replays a corpus of tweets through TweetHandler.process_tweet for several keyword list sizes.
+
+    The corpus is replayed once before timing, so one-off costs such as lazy imports are not counted, and every replay
+    starts with an empty seen store, so each does the same work.
+
+    Args:
+        corpus (str): Path of the JSONL corpus.
+        keyword_sizes (list of int): Total keyword list sizes to benchmark, the real keywords are padded to size.
+        repeats (int): Number of times the corpus is replayed for each size.
+        vision_latency (float): Seconds the stub Vision client waits before answering.
+
+    Returns:
+        list of dict: One result per keyword list size, with per tweet latency percentiles in milliseconds,
+            throughput in tweets per second and peak memory in bytes.
+    """
+    import brain
+    from config import config
+    from dedup import SeenStore
+    from image_analysis import GoogleVisionAnalyser
+    from vision_cache import VisionCache
+
+    tweets, answers = load_corpus(corpus)
+    null_logger = NullLogger()
+    brain.logger = brain.tweet_logger = brain.possible_tweet_logger = null_logger
+    stub_client = StubVisionClient(answers, vision_latency)
+
+    base = {name: list(config[name]) for name in ("keywords", "possible_keywords", "possible_objects")}
+
+    results = []
+    for size in keyword_sizes:
+        # Share the padding between the lists in proportion to their real sizes
+        shares = share_sizes([len(keywords) for keywords in base.values()], size)
+        for (name, keywords), share in zip(base.items(), shares):
+            config[name] = pad_keywords(keywords, share)
+        handler = brain.TweetHandler()
+        # The Google backend is used with the stub client, so parsing its responses is included in the timings
+        handler.image_analyser = GoogleVisionAnalyser(stub_client)
+        # The stub answers by image URL, so photos are not downloaded
+        handler.image_downloader = None
+        # Every replay should pay for image analysis, so the cache is disabled
+        handler.vision_cache = VisionCache(max_entries=0)
+
+        # Alerts already sent are skipped, so every replay starts with an empty seen store to do the same work
+        handler.seen_store = SeenStore(capacity=len(tweets))
+        replay(handler, tweets)
+        latencies = []
+        elapsed = 0
+        for _ in range(repeats):
+            handler.seen_store = SeenStore(capacity=len(tweets))
+            start = time.perf_counter()
+            latencies.extend(replay(handler, tweets))
+            elapsed += time.perf_counter() - start
+
+        # Memory is measured on a separate pass, tracing slows everything down
+        handler.seen_store = SeenStore(capacity=len(tweets))
+        tracemalloc.start()
+        replay(handler, tweets)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        latencies.sort()
+        results.append({
+            "keywords": sum(len(config[name]) for name in base),
+            "tweets": len(latencies),
+            "p50_ms": percentile(latencies, 0.50) * 1000,
+            "p95_ms": percentile(latencies, 0.95) * 1000,
+            "p99_ms": percentile(latencies, 0.99) * 1000,
+            "mean_ms": statistics.mean(latencies) * 1000,
+            "tweets_per_second": len(latencies) / elapsed,
+            "peak_memory_bytes": peak
+        })
+        handler.image_executor.shutdown()
+
+    for name, keywords in base.items():
+        config[name] = keywords
+    return results
+
+
+# Client libraries which should only be imported when they are used
+HEAVY_MODULES = ("tweepy", "google.cloud.vision", "grpc")
+
+
+def import_times(module):
+    """ Imports a module in a fresh interpreter, timing every import.
+
+    Args:
+        module (str): Module to import.
+
+    Returns:
+        dict: Module name -> (self time, cumulative time) in milliseconds, for every module imported.
+    """
+    output = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True, text=True, check=True, cwd=os.path.dirname(os.path.abspath(__file__))
+    ).stderr
+    times = {}
+    for line in output.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        own, cumulative, name = line[len("import time:"):].split("|")
+        if own.strip().isdigit():
+            times[name.strip()] = (int(own) / 1000, int(cumulative) / 1000)
+    return times
+
+
+def benchmark_imports(modules, repeats=3, budgets=None):
+    """ Measures how long importing each module takes.
+
+    Args:
+        modules (list of str): Modules to import.
+        repeats (int): Number of fresh interpreters for each module, the fastest is reported.
+        budgets (dict): Module -> budget in milliseconds.
+
+    Returns:
+        list of dict: One result per module, with the import time, the slowest imports by their own time, the heavy
+            client libraries imported and whether the module is within its budget.
+    """
+    budgets = budgets or {}
+    results = []
+    for module in modules:
+        best = None
+        for _ in range(repeats):
+            times = import_times(module)
+            if best is None or times[module][1] < best[module][1]:
+                best = times
+        result = {
+            "module": module,
+            "import_ms": best[module][1],
+            "slowest": [
+                {"module": name, "self_ms": own}
+                for name, (own, _) in sorted(best.items(), key=lambda item: item[1][0], reverse=True)[:5]
+            ],
+            "heavy_modules": [name for name in HEAVY_MODULES if name in best]
+        }
+        if module in budgets:
+            result["budget_ms"] = budgets[module]
+            result["within_budget"] = result["import_ms"] <= budgets[module]
+        results.append(result)
+    return results
+
+
+def environment():
+    """ Describes where the benchmark was run, so results can be compared over time.
+
+    Returns:
+        dict: Time, git commit, Python version and platform.
+    """
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "commit": commit,
+        "python": platform.python_version(),
+        "platform": platform.platform()
+    }
+
+
+def main():
+    """ Command line entry point, prints results as JSON. """
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    overlaps = subparsers.add_parser("overlaps", help="Compare overlap resolution with the legacy duplicate removal")
+    overlaps.add_argument("--keywords", type=int, nargs="+", default=[1000, 2000, 5000])
+    overlaps.add_argument("--repeats", type=int, default=3)
+
+    replay_parser = subparsers.add_parser("replay", help="Replay archived tweets through TweetHandler.process_tweet")
+    replay_parser.add_argument(
+        "--corpus", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmark_tweets.jsonl")
+    )
+    replay_parser.add_argument("--keyword-sizes", type=int, nargs="+", default=[33, 300, 1000])
+    replay_parser.add_argument("--repeats", type=int, default=5)
+    replay_parser.add_argument("--vision-latency", type=float, default=0)
+    replay_parser.add_argument("--output", help="Also write the results to this file")
+
+    imports = subparsers.add_parser("imports", help="Measure how long modules take to import")
+    imports.add_argument("--modules", nargs="+", default=["matcher", "brain", "main"])
+    imports.add_argument("--repeats", type=int, default=3)
+    imports.add_argument(
+        "--budget", nargs="+", default=[], metavar="MODULE=MS", help="Fail if a module takes longer to import"
+    )
+
+    args = parser.parse_args()
+    if args.command == "overlaps":
+        results = benchmark_overlaps(args.keywords, args.repeats)
+    elif args.command == "replay":
+        results = benchmark_replay(args.corpus, args.keyword_sizes, args.repeats, args.vision_latency)
+    elif args.command == "imports":
+        budgets = {module: float(ms) for module, ms in (budget.split("=") for budget in args.budget)}
+        results = benchmark_imports(list(dict.fromkeys(args.modules + list(budgets))), args.repeats, budgets)
+
+    report = json.dumps({"benchmark": args.command, "environment": environment(), "results": results}, indent=2)
+    print(report)
+    if getattr(args, "output", None):
+        with open(args.output, "w") as file:
+            file.write(report + "\n")
+    if any(result.get("within_budget") is False for result in results):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -10,12 +10,146 @@ This is where all the clever stuff happens:
 
 import json
 import os
-from fuzzysearch import find_near_matches
-from google.cloud import vision
-from config import config, tweet_logger, possible_tweet_logger, image_client, logger
+import threading
+from bisect import bisect_right
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from itertools import islice
+from config import config, tweet_logger, possible_tweet_logger, logger
+from dedup import SeenStore
+from image_analysis import VISION_SKIPPED, ImageAnalysisError, ImageDownloader, create_image_analyser
+from matcher import KeywordState, resolve_overlaps
+from metrics import counter, gauge, histogram, timed
+from normalize import NormalizedText, normalize
+from profiler import traced
+from results import KEYWORDS, LABELS, OCR, POSSIBLE_KEYWORDS, POSSIBLE_OBJECTS, TEXT, ScanResult
+from vision_cache import VisionCache
+
+SCAN_SECONDS = histogram("scan_seconds", "Time spent scanning text for keywords", ["list"])
+MATCHES = counter("keyword_matches_total", "Keyword matches found", ["list"])
+HIGHLIGHT_SECONDS = histogram("highlight_seconds", "Time spent highlighting keywords")
+DUPLICATE_ALERTS = counter("duplicate_alerts_total", "Alerts not sent because they had already been sent")
+IMAGES_DROPPED = counter("image_tweets_dropped_total", "Tweets whose images were skipped as the image queue was full")
+
+# Discord markdown placed before and after highlighted keywords
+KEYWORD_STYLE = ("__**", "**__")
+POSSIBLE_STYLE = ("__", "__")
+
+# Tweets hold at most four photos, they are downloaded in parallel
+PHOTOS_PER_TWEET = 4
+
+def as_normalized(text):
+    """ Normalizes text for scanning, unless it has already been normalized.
+
+    Args:
+        text (str or NormalizedText): Text to be scanned.
+
+    Returns:
+        NormalizedText: Normalized text.
+    """
+    if isinstance(text, NormalizedText):
+        return text
+    return normalize(text)
+
+
+def photo_urls(tweet):
+    """ Gets the URLs of the photos in a tweet.
+
+    Args:
+        tweet (tweet): Tweet object.
 
+    Returns:
+        list of str: URLs of the photos, in the order they appear in the tweet.
+    """
+    return [media["media_url_https"] for media in tweet.entities.get("media", []) if media["type"] == "photo"]
+
+
+def _scan_into(result, list_index, text, source=TEXT, image=0):
+    """ Finds keyword matches in text, without logging or recording metrics.
 
+    Overlapping matches are resolved, e.g. the text "I like etherium" could match both "eth" and "etherium", only the
+    longest match is kept.
 
+    Args:
+        result (ScanResult): Result to add the matches to, scanned with the keyword lists it holds.
+        list_index (int): Keyword list to search for, KEYWORDS, POSSIBLE_KEYWORDS or POSSIBLE_OBJECTS.
+        text (str or NormalizedText): Tweet text, normalized first if it is a plain string.
+        source (int): Where the text came from, TEXT, OCR or LABELS.
+        image (int): Index of the photo the text came from, 0 for the tweet text.
+
+    Returns:
+        int: Number of matches added.
+    """
+    normalized = as_normalized(text)
+    found = result.state.matchers[list_index].scan(normalized.text)
+    keyword_ids = {id(match): index for index, match in found}
+    matches = resolve_overlaps([match for _, match in found])
+    for match in matches:
+        start, end = normalized.original_span(match.start, match.end)
+        result.add(list_index, source, image, keyword_ids[id(match)], start, end, match.dist)
+    return len(matches)
+
+
+def _scan_keywords(state, text):
+    """ Finds the keyword and possible keyword matches in a text.
+
+    Args:
+        state (KeywordState): Compiled keyword lists.
+        text (str): Tweet text.
+
+    Returns:
+        ScanResult: Matches found in the text.
+    """
+    result = ScanResult(None, state)
+    normalized = normalize(text)
+    _scan_into(result, KEYWORDS, normalized)
+    _scan_into(result, POSSIBLE_KEYWORDS, normalized)
+    return result
+
+
+# Compiled keyword lists for batch worker processes
+_batch_state = None
+
+
+def _init_batch_worker(nlp_keywords):
+    """ Compiles the keyword lists in a batch worker process.
+
+    Args:
+        nlp_keywords (dict): Keyword lists, keyed by "keywords", "possible_keywords" and "possible_objects".
+    """
+    global _batch_state
+    _batch_state = KeywordState(
+        nlp_keywords["keywords"], nlp_keywords["possible_keywords"], nlp_keywords["possible_objects"]
+    )
+
+
+def _scan_batch(texts):
+    """ Scans a chunk of texts in a batch worker process.
+
+    Args:
+        texts (list of str): Tweet texts.
+
+    Returns:
+        list of ScanResult: Matches for each text, sent back without the keyword lists.
+    """
+    return [_scan_keywords(_batch_state, text) for text in texts]
+
+
+def _attach_state(results, state):
+    """ Gives results sent back from a batch worker the keyword lists they were scanned with.
+
+    The workers compile the same lists, so the keyword indices in the results refer to the same keywords.
+
+    Args:
+        results (list of ScanResult): Results from a batch worker.
+        state (KeywordState): Compiled keyword lists the texts were scanned with.
+
+    Returns:
+        list of ScanResult: The same results.
+    """
+    for result in results:
+        result.state = state
+    return results
 
 
 class TweetHandler:
@@ -24,139 +158,232 @@ class TweetHandler:
     This class manages processing of tweets.
 
     Attributes:
-        keywords (list of str): List of definite crypto keywords
-        possible (list of str): List of possible crypto keywords
+        state (KeywordState): Compiled keyword lists, replaced as a whole when the keywords are reloaded
+        image_executor (ThreadPoolExecutor): Worker pool for image analysis
+        image_queue_size (int): Maximum number of tweets waiting for or having their images analysed
+        image_analyser (ImageAnalyser): Backend finding the text and objects in images
+        image_downloader (ImageDownloader): Downloader for photos, None if the backend fetches them itself
+        vision_cache (VisionCache): Cache of image analysis results
+        seen_store (SeenStore): Store of tweets and alerts already seen, shared with the listener
     """
     def __init__(self):
-        self.keywords = config["keywords"]
-        self.possible_keywords = config["possible_keywords"]
-        self.possible_objects = config["possible_objects"]
-
-    def _remove_duplicates(self, matches):
-        """ Removes matches which are duplicated.
-
-        For example, the text "I like etherium" could trigger keywords for "eth" and "etherium".
-
-        This method removes the shortest duplicates.
+        # Compile each keyword list once, so every text is scanned in a single pass per list
+        self.state = KeywordState(config["keywords"], config["possible_keywords"], config["possible_objects"])
+
+        # Images are analysed in the background, so text alerts never wait for image analysis
+        self.image_executor = ThreadPoolExecutor(max_workers=config["image_workers"], thread_name_prefix="image")
+        # The pool's own queue is unbounded, so the tweets handed to it are counted and limited
+        self.image_queue_size = config["image_queue_size"]
+        self._images_pending = 0
+        self._images_lock = threading.Lock()
+        gauge("image_queue_depth", "Tweets waiting for or having their images analysed", lambda: self._images_pending)
+        self.image_analyser = create_image_analyser(config["image_backend"])
+        # Each photo is downloaded once and the same bytes are used for every analysis and for the cache keys
+        self.image_downloader = None
+        if (config["image_download"] and self.image_analyser.uses_content) or config["vision_cache_hash_content"]:
+            self.image_downloader = ImageDownloader(
+                config["image_variant"],
+                timeout=config["vision_timeout"],
+                pool_size=config["image_workers"] * PHOTOS_PER_TWEET
+            )
+        self.vision_cache = VisionCache(
+            max_entries=config["vision_cache_size"],
+            path=config["vision_cache_path"] or None,
+            ttl=config["vision_cache_ttl"],
+            max_rows=config["vision_cache_max_rows"],
+            hash_content=config["vision_cache_hash_content"]
+        )
+        gauge("vision_cache_hits", "Google Vision API results found in the cache",
+              lambda: self.vision_cache.stats()["hits"])
+        gauge("vision_cache_misses", "Google Vision API results missing from the cache",
+              lambda: self.vision_cache.stats()["misses"])
+        self.seen_store = SeenStore(
+            path=config["seen_store_path"] or None,
+            memory_size=config["seen_store_memory_size"],
+            ttl=config["seen_store_ttl"]
+        )
+
+    @property
+    def keywords(self):
+        """ list of str: List of definite crypto keywords. """
+        return self.state.keywords
+
+    @property
+    def possible_keywords(self):
+        """ list of str: List of possible crypto keywords. """
+        return self.state.possible_keywords
+
+    @property
+    def possible_objects(self):
+        """ list of str: List of possible image objects. """
+        return self.state.possible_objects
+
+    def reload_keywords(self, nlp_keywords):
+        """ Replaces the keyword lists.
+
+        The new lists are compiled before being swapped in with a single assignment, so tweets being processed
+        carry on with the old lists in the meantime and never see a partly built matcher.
 
         Args:
-            matches: A list of keyword Matches
-
-        Returns:
-            A filtered list of keyword Matches containing no duplicates
-
+            nlp_keywords (dict): Keyword lists, keyed by "keywords", "possible_keywords" and "possible_objects".
         """
-        for match_1 in matches:
-            for match_2 in matches:
-                if match_1.start == match_2.start and match_1 != match_2:
-                    # 2 keywords start at the same position, find the shortest word and remove the match
-                    logger.debug("These two keywords start at the same position: {} || {}".format(match_1, match_2))
-                    if match_2.end >= match_1.end:
-                        matches.remove(match_1)
-                    else:
-                        matches.remove(match_2)
-                if match_1.end == match_2.end and match_1 != match_2:
-                    # 2 keywords end at the same position, find the shortest word and remove the match
-                    logger.debug("These two keywords start at the end position: {} || {}".format(match_1, match_2))
-                    if match_2.start <= match_1.start:
-                        matches.remove(match_1)
-                    else:
-                        matches.remove(match_2)
-        return matches
-
-    def _scan_text(self, keywords, text):
+        state = KeywordState(
+            nlp_keywords["keywords"], nlp_keywords["possible_keywords"], nlp_keywords["possible_objects"]
+        )
+        self.state = state
+        logger.info(
+            f"Reloaded keywords: {len(state.keywords)} keywords, {len(state.possible_keywords)} possible keywords, "
+            f"{len(state.possible_objects)} possible objects"
+        )
+
+    def _scan_text(self, list_index, text, result=None, source=TEXT, image=0):
         """ Scans and finds keyword matches in text.
 
         Args:
-            keywords (list of str): List of keywords to search for in the text
-            text (str): Tweet text
+            list_index (int): Keyword list to search for, KEYWORDS, POSSIBLE_KEYWORDS or POSSIBLE_OBJECTS.
+            text (str or NormalizedText): Tweet text, normalized first if it is a plain string
+            result (ScanResult): Result to add the matches to, a new one is started if not given.
+            source (int): Where the text came from, TEXT, OCR or LABELS.
+            image (int): Index of the photo the text came from, 0 for the tweet text.
 
         Returns:
-            list of str: List of keywords found in the text.
+            ScanResult: The result, with the matches positioned in the original text.
         """
-        # Remove handles from text
-        text_no_handles = ' '.join(word for word in text.split(' ') if not word.startswith('@'))
-        print("^^^")
-        print(text_no_handles)
-
-        # Scan for matches
-        matches = []
-        for keyword in keywords:
-            if len(keyword) > 4:
-                max_l_dist = 1
-            else:
-                max_l_dist = 0
-            test = find_near_matches(keyword, text_no_handles, max_l_dist=max_l_dist)
-            if test:
-                matches.append(test[0])
-        return self._remove_duplicates(matches)
-
-    def scan_for_keywords(self, text):
+        if result is None:
+            result = ScanResult(None, self.state)
+        name = result.state.matchers[list_index].name
+        with SCAN_SECONDS.time(name):
+            found = _scan_into(result, list_index, text, source, image)
+        if found:
+            MATCHES.inc(name, amount=found)
+        return result
+
+    def scan_for_keywords(self, text, result=None, source=TEXT, image=0):
         """ Scans for keywords in the text,
 
         Args:
-            text (str): Tweet text.
+            text (str or NormalizedText): Tweet text.
+            result (ScanResult): Result to add the matches to, a new one is started if not given.
+            source (int): Where the text came from, TEXT or OCR.
+            image (int): Index of the photo the text came from, 0 for the tweet text.
 
         Returns:
-            list of str: List of keywords found in the text.
+            ScanResult: The result, with the keywords found in the text.
         """
-        return self._scan_text(self.keywords, text)
+        return self._scan_text(KEYWORDS, text, result, source, image)
 
-    def scan_for_possible_keywords(self, text):
+    def scan_for_possible_keywords(self, text, result=None, source=TEXT, image=0):
         """ Scans for possible keywords in the text.
 
         Args:
-            text (str): Tweet text.
+            text (str or NormalizedText): Tweet text.
+            result (ScanResult): Result to add the matches to, a new one is started if not given.
+            source (int): Where the text came from, TEXT or OCR.
+            image (int): Index of the photo the text came from, 0 for the tweet text.
 
         Returns:
-            list of str: List of possible keywords found in the text.
+            ScanResult: The result, with the possible keywords found in the text.
         """
-        return self._scan_text(self.possible_keywords, text)
+        return self._scan_text(POSSIBLE_KEYWORDS, text, result, source, image)
 
-    def scan_for_possible_image_objects(self, text):
+    def scan_for_possible_image_objects(self, text, result=None, image=0):
         """ Scans for possible objects in the image.
 
         Args:
             text (str): Space delimited list of objects found in the image.
+            result (ScanResult): Result to add the matches to, a new one is started if not given.
+            image (int): Index of the photo.
 
         Returns:
-            list of str: List of possible objects found in the image..
+            ScanResult: The result, with the possible objects found in the image.
         """
-        return self._scan_text(self.possible_objects, text)
+        return self._scan_text(POSSIBLE_OBJECTS, text, result, LABELS, image)
 
-    def highlight_keywords(self, text, matches, bold=True, underline=True):
+    def scan_texts(self, texts, workers=None, chunk_size=1000):
+        """ Scans many texts for keywords and possible keywords, e.g. to backfill an account's timeline.
+
+        Nothing is logged or alerted. The texts are read in chunks which are scanned by a pool of worker processes,
+        with at most two chunks per worker in flight, so memory stays flat however many texts there are.
+
+        Usage:
+
+            for text, result in zip(texts, tweet_handler.scan_texts(texts)):
+                print(text, result.keywords(KEYWORDS), result.keywords(POSSIBLE_KEYWORDS))
+
+        Args:
+            texts (iterable of str): Tweet texts, read lazily.
+            workers (int): Number of worker processes, defaults to the number of CPUs. 0 scans in this process.
+            chunk_size (int): Number of texts sent to a worker at a time.
+
+        Yields:
+            ScanResult: Keyword and possible keyword matches for each text, in the same order as the texts.
+        """
+        state = self.state
+        if workers == 0:
+            for text in texts:
+                yield _scan_keywords(state, text)
+            return
+
+        workers = workers or os.cpu_count()
+        nlp_keywords = {
+            "keywords": state.keywords,
+            "possible_keywords": state.possible_keywords,
+            "possible_objects": state.possible_objects
+        }
+        texts = iter(texts)
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_batch_worker, initargs=(nlp_keywords,)) as pool:
+            pending = deque()
+            for chunk in iter(lambda: list(islice(texts, chunk_size)), []):
+                pending.append(pool.submit(_scan_batch, chunk))
+                if len(pending) >= 2 * workers:
+                    yield from _attach_state(pending.popleft().result(), state)
+            while pending:
+                yield from _attach_state(pending.popleft().result(), state)
+
+    @timed(HIGHLIGHT_SECONDS)
+    def highlight_keywords(self, text, result, source=TEXT, image=0):
         """ Adds Discord compatible text highlighting.
 
+        Definite keywords are bold and underlined, possible keywords and objects are underlined. Where a definite and a
+        possible match overlap, only the definite match is highlighted, even if the possible match starts earlier or is
+        longer. The highlights are then sorted once and the highlighted text is built in a single pass.
+
         Args:
-            text (str): String of the original tweet text in lower case.
-            matches (list of str): List of keyword Matches.
-            bold (bool): Boolean to set keywords bold.
-            underline (bool): Boolean to set keywords underlined.
+            text (str): Original text the matches are positioned in.
+            result (ScanResult): Matches found in the tweet.
+            source (int): Where the text came from, only matches from there are highlighted.
+            image (int): Index of the photo the text came from, 0 for the tweet text.
 
         Returns:
             str: A block of text containing Discord highlighting for the matched keywords.
         """
-
-        if bold:
-            start_block = "**"
-            end_block = "**"
-        else:
-            start_block = ""
-            end_block = ""
-        if underline:
-            start_block = "__" + start_block
-            end_block = end_block + "__"
-
-        for match in matches:
-            # Get position of substring
-            start = text.find(match.matched)
-            end = start + len(match.matched)
-
-            # Add the blocks to the string, starting with the end block
-            # It is important to begin with the end block to avoid changing the position of the end of the string
-            text = text[:end] + end_block + text[end:]
-            text = text[:start] + start_block + text[start:]
-        return text
+        spans = result.spans(source=source, image=image)
+        definite = sorted((start, end) for start, end, list_index in spans if list_index == KEYWORDS)
+        definite_starts = [start for start, _ in definite]
+        highlights = [(start, end, KEYWORD_STYLE) for start, end in definite]
+        for start, end, list_index in spans:
+            if list_index == KEYWORDS:
+                continue
+            # Skip possible matches overlapping the definite match before or after them
+            index = bisect_right(definite_starts, start)
+            if index and definite[index - 1][1] > start or index < len(definite) and definite[index][0] < end:
+                continue
+            highlights.append((start, end, POSSIBLE_STYLE))
+        highlights.sort()
+
+        parts = []
+        position = 0
+        for start, end, (start_block, end_block) in highlights:
+            if start < position:
+                # Overlaps a match which has already been highlighted
+                continue
+            parts.append(text[position:start])
+            parts.append(start_block)
+            parts.append(text[start:end])
+            parts.append(end_block)
+            position = end
+        parts.append(text[position:])
+        return "".join(parts)
 
     def build_tweet_url(self, tweet):
         """ Builds a link to the original tweet.
@@ -170,24 +397,91 @@ class TweetHandler:
         """
         return f"http://twitter.com/{tweet.user.screen_name}/status/{tweet.id_str}"
 
-    def message_formatter(self, intro, text, tweet):
+    def message_formatter(self, intro, text, tweet, source="text"):
         """ Sends results in standardised format.
 
+        The message is tagged with the tweet id and source, so the text and image alerts for a tweet can be matched up.
+
         Args:
             intro (str): Intro text, e.g. "Possible", "Not a".
             text (str): Tweet text.
             tweet (tweet): Tweet object.
+            source (str): Where the match was found, either "text" or "image".
 
         Returns:
             str: A formatted string ready for logging.
 
         """
-        return f"{intro} crypto related tweet from {tweet.user.screen_name}:\n \t{text}\n {self.build_tweet_url(tweet)}"
+        return (
+            f"{intro} crypto related tweet from {tweet.user.screen_name} [{tweet.id_str}/{source}]:\n"
+            f" \t{text}\n {self.build_tweet_url(tweet)}"
+        )
+
+    def _cache_feature(self, feature):
+        """ Gets the name results of an analysis are cached under.
+
+        Results from other backends are kept apart from Google Vision API results, which keep the plain names so
+        existing caches are still used.
+
+        Args:
+            feature (str): Analysis, "text" or "objects".
+
+        Returns:
+            str: Cache feature name.
+        """
+        if self.image_analyser.name == "google":
+            return feature
+        return f"{self.image_analyser.name}:{feature}"
+
+    def _download(self, image_urls):
+        """ Downloads photos in parallel, if the image analysis backend or the cache keys use the content.
+
+        Args:
+            image_urls (list of str): URLs of the photos.
+
+        Returns:
+            list of memoryview: Content of each photo, None for any which were not downloaded.
+        """
+        if self.image_downloader is None:
+            return [None] * len(image_urls)
+        return self.image_downloader.download_all(image_urls)
+
+    def _scan_image(self, feature, image_url, detect):
+        """ Gets a single analysis of an image, from the cache if possible.
+
+        The cache is checked by URL first, the photo is only downloaded if it has to be analysed or hashed.
+
+        Args:
+            feature (str): Analysis, "text" or "objects".
+            image_url (str): URL of the image.
+            detect (callable): Backend method making the analysis.
+
+        Returns:
+            str: Result of the analysis.
+        """
+        cache_feature = self._cache_feature(feature)
+        keys = self.vision_cache.keys(image_url)
+        result = self.vision_cache.get(cache_feature, keys, count_miss=not self.vision_cache.hash_content)
+        if result is not None:
+            return result
+
+        content = self._download([image_url])[0]
+        keys = self.vision_cache.keys(image_url, content)
+        if self.vision_cache.hash_content:
+            result = self.vision_cache.get(cache_feature, keys[1:])
+            if result is not None:
+                self.vision_cache.set(cache_feature, keys, result)
+                return result
+
+        logger.info(f"Identifying {feature} in image")
+        result = detect(image_url, content)
+        self.vision_cache.set(cache_feature, keys, result)
+        return result
 
     def scan_image_text(self, image_url):
         """ Gets text from image.
 
-        Uses Google Vision API to extract text from image.
+        Uses the image analysis backend to extract text from image.
 
         Args:
             image_url (str): Url for the image.
@@ -196,23 +490,12 @@ class TweetHandler:
             str: A space delimited list of words in the image.
 
         """
-        image = vision.Image()
-        image.source.image_uri = image_url
-
-        logger.info("Identifying text in image")
-        response = image_client.text_detection(image=image)
-
-        result = ""
-        for text in response.text_annotations:
-            temp = text.description.replace('\n', ' ').replace('\r', '')
-            result = " ".join([result, temp])
-
-        return result.lower()
+        return self._scan_image("text", image_url, self.image_analyser.detect_text)
 
     def scan_image_objects(self, image_url):
         """ Extracts objects from image.
 
-        Uses Google Vision API to extract objects from the image, e.g. "car", "dog"
+        Uses the image analysis backend to extract objects from the image, e.g. "car", "dog"
 
         Args:
             image_url (str): URL of the image.
@@ -220,18 +503,96 @@ class TweetHandler:
         Returns:
             str: A space delimited string of objects found in the image.
         """
-        image = vision.Image()
-        image.source.image_uri = image_url
-        response = image_client.label_detection(image=image)
-        logger.info("Identifying objects in image:")
+        return self._scan_image("objects", image_url, self.image_analyser.detect_objects)
+
+    def scan_images(self, image_urls, objects=True):
+        """ Extracts text and objects from several images at once.
+
+        Images are analysed together, so with Google Vision API a tweet with several photos only makes one round
+        trip. Photos are only downloaded once, and only if they are not already cached by URL. Photos which are
+        downloaded are downloaded in parallel.
 
-        result = ""
-        for label in response.label_annotations:
-            result = " ".join([result, label.description])
+        Args:
+            image_urls (list of str): URLs of the images.
+            objects (bool): Whether to find objects, otherwise objects are only returned if they are already cached.
+
+        Returns:
+            list of (str, str): Text and objects found in each image, in the same order as the URLs. Images which
+                could not be analysed are returned as None.
 
-        return result.lower()
+        Raises:
+            ImageAnalysisError: If the images could not be analysed at all.
+        """
+        text_feature = self._cache_feature("text")
+        objects_feature = self._cache_feature("objects")
+
+        def cached(keys, count_miss=True):
+            image_text = self.vision_cache.get(text_feature, keys, count_miss)
+            image_objects = self.vision_cache.get(objects_feature, keys, count_miss)
+            if image_objects is None and not objects:
+                image_objects = ""
+            if image_text is None or image_objects is None:
+                return None
+            return image_text, image_objects
+
+        def store(keys, result):
+            image_text, image_objects = result
+            self.vision_cache.set(text_feature, keys, image_text)
+            if objects:
+                self.vision_cache.set(objects_feature, keys, image_objects)
+
+        # Use results cached by URL where there are any, only the photos missing from the cache are downloaded
+        results = [
+            cached(self.vision_cache.keys(image_url), not self.vision_cache.hash_content) for image_url in image_urls
+        ]
+        uncached = [index for index, result in enumerate(results) if result is None]
+        if not uncached:
+            return results
+
+        # Photos may also be cached by their content, the rest are sent for analysis
+        missing = []
+        for index, content in zip(uncached, self._download([image_urls[index] for index in uncached])):
+            keys = self.vision_cache.keys(image_urls[index], content)
+            if self.vision_cache.hash_content:
+                results[index] = cached(keys[1:])
+            if results[index] is None:
+                missing.append((index, keys, content))
+            else:
+                store(keys, results[index])
+        if not missing:
+            return results
 
-    def handle_keywords(self, tweet, text, matched_keywords, matched_possible_keywords):
+        logger.info(f"Identifying text and objects in {len(missing)} image(s)")
+        analysed = self.image_analyser.analyse(
+            [image_urls[index] for index, _, _ in missing], [content for _, _, content in missing], objects
+        )
+
+        for (index, keys, _), result in zip(missing, analysed):
+            if result is not None:
+                store(keys, result)
+                results[index] = result
+        logger.debug(f"Vision cache: {self.vision_cache.stats()}")
+        return results
+
+    def _send_alert(self, alert_logger, tweet, message):
+        """ Sends an alert, unless the same alert has already been sent for the tweet.
+
+        The alert is only marked as sent once it has been sent, so it is sent again if sending raised.
+
+        Args:
+            alert_logger (Logger): Logger for the alert channel.
+            tweet (tweet): Tweet object.
+            message (str): Alert message.
+
+        """
+        if self.seen_store.seen_alert(tweet.id, message):
+            DUPLICATE_ALERTS.inc()
+            logger.debug(f"Alert for tweet {tweet.id_str} has already been sent")
+            return
+        alert_logger.info(message)
+        self.seen_store.mark_alert(tweet.id, message)
+
+    def handle_keywords(self, tweet, text, result, source=TEXT, image=0):
         """ Checks if results exist for keywords and prints them.
 
         Logs are sent to the log handler.
@@ -239,27 +600,29 @@ class TweetHandler:
         Args:
             tweet (tweet): Tweet object.
             text (str): Text where results were found, could be tweet text or image words.
-            matched_keywords (list of str): List of matched crypto related keywords.
-            matched_possible_keywords (list of str): List of possible matched crypto related keywords.
+            result (ScanResult): Matches found in the tweet.
+            source (int): Where the text came from, either TEXT or OCR.
+            image (int): Index of the photo the text came from, 0 for the tweet text.
 
         """
-        if matched_keywords:
+        label = "text" if source == TEXT else "image"
+        if result.count(KEYWORDS, source, image):
             # Highlight the tweet text
-            highlighted_text = self.highlight_keywords(text, matched_keywords)
-            if matched_possible_keywords:
-                highlighted_text = self.highlight_keywords(highlighted_text, matched_possible_keywords, bold=False)
+            highlighted_text = self.highlight_keywords(text, result, source, image)
 
             # Log tweet text
-            tweet_logger.info(self.message_formatter("@everyone Matched", highlighted_text, tweet))
+            self._send_alert(tweet_logger, tweet, self.message_formatter("@everyone Matched", highlighted_text, tweet, label))
 
-        elif matched_possible_keywords:
+        elif result.count(POSSIBLE_KEYWORDS, source, image):
             # Highlight the tweet text
-            highlighted_text = self.highlight_keywords(text, matched_possible_keywords, bold=False)
+            highlighted_text = self.highlight_keywords(text, result, source, image)
 
             # Log tweet text
-            possible_tweet_logger.info(self.message_formatter("@everyone Possible", highlighted_text, tweet))
+            self._send_alert(
+                possible_tweet_logger, tweet, self.message_formatter("@everyone Possible", highlighted_text, tweet, label)
+            )
 
-    def handle_objects(self, tweet, image_objects, matched_possible_image_objects):
+    def handle_objects(self, tweet, image_objects, result, image=0):
         """ Checks if results exist for objects and prints them.
 
         Logs are sent to the log handler.
@@ -267,53 +630,190 @@ class TweetHandler:
         Args:
             tweet (tweet): Tweet object.
             image_objects (str): Space delimited string containing objects found in the image.
-            matched_possible_image_objects (list of str): List of possible matched objects found in the image.
+            result (ScanResult): Matches found in the tweet.
+            image (int): Index of the photo.
 
         """
-        if matched_possible_image_objects:
+        if result.count(POSSIBLE_OBJECTS, LABELS, image):
             # Highlight the objects
-            highlighted_objects = self.highlight_keywords(image_objects, matched_possible_image_objects, bold=False)
+            highlighted_objects = self.highlight_keywords(image_objects, result, LABELS, image)
 
             # Log list of objects
-            possible_tweet_logger.info(self.message_formatter("@everyone Possible", f"Matched objects: {highlighted_objects}", tweet))
+            self._send_alert(possible_tweet_logger, tweet, self.message_formatter("@everyone Possible", f"Matched objects: {highlighted_objects}", tweet, "image"))
 
-    def process_tweet(self, tweet):
-        """ Main handler for tweets.
+    def process_images(self, tweet, result):
+        """ Searches for keywords and objects in the images of a tweet.
 
-        Searches for keywords in the text and image.
+        This is the second phase of processing a tweet, it runs on the image worker pool so the text alert does not
+        have to wait for the image analysis backend.
 
-        Also searches for objects, e.g. "dog", "animal".
+        Args:
+            tweet (tweet): Tweet object.
+            result (ScanResult): Result of the first phase, the matches in the images are added to it.
+
+        Returns:
+            ScanResult: The result.
+
+        """
+        try:
+            analysed = self.scan_images(result.image_urls, result.objects)
+        except ImageAnalysisError as e:
+            logger.warning(f"Image analysis failed for tweet {tweet.id_str}: {e}")
+            return result
+        complete = None not in analysed
+
+        for image, found in enumerate(analysed):
+            if found is None:
+                continue
+            image_text, image_objects = found
+            logger.info(f"Text in image: {image_text}")
+            logger.info(f"Objects in image: {image_objects}")
+            normalized_image_text = normalize(image_text)
+            self.scan_for_keywords(normalized_image_text, result, OCR, image)
+            self.scan_for_possible_keywords(normalized_image_text, result, OCR, image)
+            self.scan_for_possible_image_objects(image_objects, result, image)
+
+            self.handle_keywords(tweet, image_text, result, OCR, image)
+            self.handle_objects(tweet, image_objects, result, image)
+
+        # A photo which could not be analysed is retried if the tweet is delivered again
+        if complete:
+            self.mark_processed(tweet)
+        return result
+
+    def mark_processed(self, tweet):
+        """ Marks a tweet as processed, so it is skipped if it is delivered again.
+
+        Tweets are only marked once they have been processed, a tweet which was dropped or failed part way is processed
+        again when it is delivered again. Alerts already sent for it are not sent twice.
+
+        Args:
+            tweet (tweet): Tweet object.
+        """
+        self.seen_store.mark_tweet(tweet.id)
+
+    def reserve_image_slot(self, tweet):
+        """ Takes a place in the image queue for a tweet, unless the queue is full.
+
+        When the image analysis backend is slow, tweets with photos would otherwise pile up without limit. If the
+        queue is full the images of the tweet are not analysed, its text alert has already been sent.
+
+        Args:
+            tweet (tweet): Tweet object.
+
+        Returns:
+            bool: True if the images may be analysed, release_image_slot() must be called once they have been.
+        """
+        with self._images_lock:
+            if self._images_pending < self.image_queue_size:
+                self._images_pending += 1
+                return True
+        IMAGES_DROPPED.inc()
+        logger.warning(f"Image queue full, not analysing the images of tweet {tweet.id_str}")
+        return False
+
+    def release_image_slot(self, *_):
+        """ Gives back a place in the image queue, once the images of a tweet have been analysed.
+
+        Accepts and ignores any arguments, so it can be used as a done callback.
+        """
+        with self._images_lock:
+            self._images_pending -= 1
 
-        Uses Google Vision API for image analysis.
+    def _log_image_errors(self, future):
+        """ Logs any unexpected error raised while processing images.
+
+        Args:
+            future (Future): Completed image processing task.
+
+        """
+        error = future.exception()
+        if error is not None:
+            logger.error(f"Error processing images: {error!r}")
+
+    def skip_objects(self, result):
+        """ Decides whether object detection can be skipped for the images of a tweet.
+
+        Objects only ever raise a possible alert, so once the text has alerted they add little and are not worth
+        paying for. The "vision_skip_objects" setting chooses when they are skipped: "never", "matched" when the text
+        matched a definite keyword, or "alerted" when the text raised any alert.
+
+        Args:
+            result (ScanResult): Matches found in the tweet text.
+
+        Returns:
+            bool: True if objects should not be detected.
+        """
+        rule = config["vision_skip_objects"]
+        if rule == "matched":
+            return result.count(KEYWORDS, TEXT) > 0
+        if rule == "alerted":
+            return result.count(KEYWORDS, TEXT) + result.count(POSSIBLE_KEYWORDS, TEXT) > 0
+        return False
+
+    @traced
+    def process_text(self, tweet):
+        """ Searches for keywords in the text of a tweet, sending its alert.
+
+        This is the first phase of processing a tweet.
 
         Args:
             tweet (tweet): Tweet object
 
+        Returns:
+            ScanResult: Matches found in the text, along with the URLs of the photos in the tweet to be analysed in the
+                second phase and whether objects should be searched for in them.
+
         """
-        text = tweet.text.lower()
+        result = ScanResult(tweet.id, self.state)
+
+        # Normalize once for every scan, matches are positioned in the original text for highlighting
+        text = normalize(tweet.text)
 
         # Get the keywords from the tweet text
-        matched_keywords = self.scan_for_keywords(text)
-        matched_possible_keywords = self.scan_for_possible_keywords(text)
+        self.scan_for_keywords(text, result)
+        self.scan_for_possible_keywords(text, result)
 
-        self.handle_keywords(tweet, text, matched_keywords, matched_possible_keywords)
+        self.handle_keywords(tweet, tweet.text, result)
 
-        # Check if tweet contains an image
-        try:
-            for media in tweet.entities["media"]:
-                if media["type"] == "photo":
-                    logger.debug("Found image in tweet, sending to Google API for analysis")
-                    image_url = media["media_url_https"]
-                    logger.debug(image_url)
-                    image_text = self.scan_image_text(image_url)
-                    logger.info(f"Text in image: {image_text}")
-                    image_objects = self.scan_image_objects(image_url)
-                    logger.info(f"Objects in image: {image_objects}")
-                    matched_image_keywords = self.scan_for_keywords(image_text)
-                    matched_possible_image_keywords = self.scan_for_possible_keywords(image_text)
-                    matched_possible_image_objects = self.scan_for_possible_image_objects(image_objects)
-
-                    self.handle_keywords(tweet, image_text, matched_image_keywords, matched_possible_image_keywords)
-                    self.handle_objects(tweet, image_objects, matched_possible_image_objects)
-        except KeyError:
-            pass
+        # Check if tweet contains any images, the tweet has been processed once they have been analysed
+        result.image_urls = photo_urls(tweet)
+        if not result.image_urls:
+            self.mark_processed(tweet)
+        elif self.skip_objects(result):
+            VISION_SKIPPED.inc("text_alerted")
+            result.objects = False
+        return result
+
+    @traced
+    def process_tweet(self, tweet):
+        """ Main handler for tweets.
+
+        Searches for keywords in the text and image.
+
+        Also searches for objects, e.g. "dog", "animal".
+
+        The text is processed straight away and its alert sent, any images are then handed to the image worker pool
+        for analysis, which sends its own follow up alert. Images are skipped if "image_queue_size" tweets are already
+        waiting for the pool.
+
+        Args:
+            tweet (tweet): Tweet object
+
+        Returns:
+            ScanResult: Matches found in the tweet. Matches in the photos are added once they have been analysed, see
+                ScanResult.wait().
+
+        """
+        result = self.process_text(tweet)
+        if not result.image_urls:
+            return result
+
+        if not self.reserve_image_slot(tweet):
+            return result
+        logger.debug(f"Found image(s) in tweet {tweet.id_str}, sending for analysis")
+        logger.debug(result.image_urls)
+        result.image_future = self.image_executor.submit(self.process_images, tweet, result)
+        result.image_future.add_done_callback(self.release_image_slot)
+        result.image_future.add_done_callback(self._log_image_errors)
+        return result
@@ -6,13 +6,13 @@ Variables generally include application options, Twitter API authorisation, Disc
 
 Keywords for matching to tweets are also placed into the "config" dictionary here.
 
-The API client and logging services are also set up here.
+The API clients and logging services are also set up here. Clients are only created when first used, so importing
+this module stays fast and has no side effects beyond reading the keywords file.
 
 """
-import tweepy
 import json
 import os
-from google.cloud import vision
+import threading
 
 from log import Logger
 
@@ -26,22 +26,96 @@ config = {
     "twitter_api_secret": os.getenv("TWITTER_API_SECRET"),
     "twitter_access_token": os.getenv("TWITTER_ACCESS_TOKEN"),
     "twitter_access_token_secret": os.getenv("TWITTER_ACCESS_TOKEN_SECRET"),
+    "twitter_api_host": os.getenv("TWITTER_API_HOST", default="api.twitter.com"),
+    "twitter_stream_host": os.getenv("TWITTER_STREAM_HOST", default="stream.twitter.com"),
     "logs_webhook_url": os.getenv("DISCORD_LOGS_WEBHOOK_URL", default=""),
     "tweets_webhook_url": os.getenv("DISCORD_TWEETS_WEBHOOK_URL", default=""),
-    "possible_tweets_webhook_url": os.getenv("DISCORD_POSSIBLE_TWEETS_WEBHOOK_URL", default="")
+    "possible_tweets_webhook_url": os.getenv("DISCORD_POSSIBLE_TWEETS_WEBHOOK_URL", default=""),
+    "discord_async": os.getenv("DISCORD_ASYNC", "False").lower() in ("true", "1", "t"),
+    "vision_timeout": float(os.getenv("GOOGLE_VISION_TIMEOUT", default="10")),
+    "vision_call_timeout": float(os.getenv("VISION_CALL_TIMEOUT", default="15")),
+    "vision_circuit_failures": int(os.getenv("VISION_CIRCUIT_FAILURES", default="5")),
+    "vision_circuit_reset": float(os.getenv("VISION_CIRCUIT_RESET", default="30")),
+    "vision_rate_limit": int(os.getenv("VISION_RATE_LIMIT", default="0")),
+    "vision_daily_budget": int(os.getenv("VISION_DAILY_BUDGET", default="0")),
+    "vision_skip_objects": os.getenv("VISION_SKIP_OBJECTS", default="never").lower(),
+    "image_workers": int(os.getenv("IMAGE_WORKERS", default="4")),
+    "image_queue_size": int(os.getenv("IMAGE_QUEUE_SIZE", default="100")),
+    "vision_cache_size": int(os.getenv("VISION_CACHE_SIZE", default="1024")),
+    "vision_cache_path": os.getenv("VISION_CACHE_PATH", default=""),
+    "vision_cache_ttl": float(os.getenv("VISION_CACHE_TTL", default=str(7 * 24 * 60 * 60))),
+    "vision_cache_max_rows": int(os.getenv("VISION_CACHE_MAX_ROWS", default="100000")),
+    "vision_cache_hash_content": os.getenv("VISION_CACHE_HASH_CONTENT", "False").lower() in ("true", "1", "t"),
+    "tweet_workers": int(os.getenv("TWEET_WORKERS", default="2")),
+    "worker_mode": os.getenv("TWEET_WORKER_MODE", default="thread").lower(),
+    "tweet_queue_size": int(os.getenv("TWEET_QUEUE_SIZE", default="100")),
+    "tweet_queue_overflow": os.getenv("TWEET_QUEUE_OVERFLOW", default="drop_oldest").lower(),
+    "tweet_queue_spill_path": os.getenv("TWEET_QUEUE_SPILL_PATH", default="spilled_tweets.jsonl"),
+    "tweet_queue_report_interval": float(os.getenv("TWEET_QUEUE_REPORT_INTERVAL", default="60")),
+    "metrics_port": int(os.getenv("METRICS_PORT", default="0")),
+    "metrics_host": os.getenv("METRICS_HOST", default="127.0.0.1"),
+    "metrics_summary_interval": float(os.getenv("METRICS_SUMMARY_INTERVAL", default="0")),
+    "profile_dir": os.getenv("PROFILE_DIR", default="profiles"),
+    "profile_seconds": float(os.getenv("PROFILE_SECONDS", default="30")),
+    "profile_interval": float(os.getenv("PROFILE_INTERVAL", default="0.01")),
+    "profile_trace_threshold": float(os.getenv("PROFILE_TRACE_THRESHOLD", default="0.1")),
+    "keywords_path": os.getenv("KEYWORDS_PATH", default=os.path.join(os.getcwd(), "keywords.json")),
+    "keywords_reload_interval": float(os.getenv("KEYWORDS_RELOAD_INTERVAL", default="10")),
+    "stream_shards": int(os.getenv("STREAM_SHARDS", default="1")),
+    "stream_shard_mode": os.getenv("STREAM_SHARD_MODE", default="thread").lower(),
+    "run_mode": os.getenv("RUN_MODE", default="threaded").lower(),
+    "image_download": os.getenv("IMAGE_DOWNLOAD", "True").lower() in ("true", "1", "t"),
+    "image_variant": os.getenv("IMAGE_VARIANT", default="").lower(),
+    "image_fixtures_path": os.getenv("IMAGE_FIXTURES_PATH", default=""),
+    "seen_store_memory_size": int(os.getenv("SEEN_STORE_MEMORY_SIZE", default="10000")),
+    "seen_store_ttl": float(os.getenv("SEEN_STORE_TTL", default=str(30 * 24 * 60 * 60)))
 }
+# The event loop must never wait on a Discord post, so alerts and logs are always sent in the background
+if config["run_mode"] == "asyncio":
+    config["discord_async"] = True
+# Offline runs replay the same test tweets, so by default nothing is remembered between them
+config["seen_store_path"] = os.getenv("SEEN_STORE_PATH", default="" if config["offline_mode"] else "seen_tweets.sqlite3")
+# Offline runs cannot reach Google Vision API, so by default images are answered from fixtures
+config["image_backend"] = os.getenv("IMAGE_BACKEND", default="fixture" if config["offline_mode"] else "google").lower()
 
 
 # =====================================================================
 # KEYWORDS
 # =====================================================================
-print(os.getcwd())
-with open(os.path.join(os.getcwd(), "keywords.json")) as file:
-    nlp_keywords = json.load(file)
+KEYWORD_LISTS = ("keywords", "possible_keywords", "possible_objects")
 
-config["keywords"] = nlp_keywords["keywords"]
-config["possible_keywords"] = nlp_keywords["possible_keywords"]
-config["possible_objects"] = nlp_keywords["possible_objects"]
+
+def load_keywords(path):
+    """ Loads and validates the keywords file.
+
+    Args:
+        path (str): Path of the keywords JSON file.
+
+    Returns:
+        dict: Keyword lists, keyed by "keywords", "possible_keywords" and "possible_objects".
+
+    Raises:
+        ValueError: If the file is not valid JSON or a keyword list is missing or malformed.
+    """
+    with open(path) as file:
+        try:
+            nlp_keywords = json.load(file)
+        except json.JSONDecodeError as e:
+            raise ValueError(f"{path} is not valid JSON: {e}")
+
+    for name in KEYWORD_LISTS:
+        keywords = nlp_keywords.get(name) if isinstance(nlp_keywords, dict) else None
+        if not isinstance(keywords, list):
+            raise ValueError(f"{path} is missing the list \"{name}\"")
+        for keyword in keywords:
+            if not isinstance(keyword, str) or not keyword.strip():
+                raise ValueError(f"{path} has an invalid entry in \"{name}\": {keyword!r}")
+            if keyword != keyword.lower():
+                raise ValueError(f"{path} has a keyword which is not lower case in \"{name}\": {keyword!r}")
+    return {name: nlp_keywords[name] for name in KEYWORD_LISTS}
+
+
+config.update(load_keywords(config["keywords_path"]))
 
 
 # =====================================================================
@@ -53,10 +127,13 @@ def twitter_api():
     Returns:
         API: Tweepy API instance.
     """
+    import tweepy
+
     auth = tweepy.OAuthHandler(config["twitter_api_key"], config["twitter_api_secret"])
     auth.set_access_token(config["twitter_access_token"], config["twitter_access_token_secret"])
     api = tweepy.API(
         auth,
+        host=config["twitter_api_host"],
         wait_on_rate_limit=True,
         wait_on_rate_limit_notify=True,
         retry_count=10,
@@ -75,10 +152,25 @@ def twitter_api():
 # =====================================================================
 # GOOGLE VISION API
 # =====================================================================
-if not config["offline_mode"]:
-    image_client = vision.ImageAnnotatorClient()
-else:
-    image_client = None
+_image_client = None
+_image_client_lock = threading.Lock()
+
+
+def image_client():
+    """ Gets the Google Vision API client, creating it on first use.
+
+    The client library pulls in grpc and protobuf, so it is only imported once an image is analysed.
+
+    Returns:
+        ImageAnnotatorClient: Google Vision API client.
+    """
+    global _image_client
+    with _image_client_lock:
+        if _image_client is None:
+            from google.cloud import vision
+            _image_client = vision.ImageAnnotatorClient()
+        return _image_client
+
 
 # =====================================================================
 # LOGGING
@@ -86,17 +178,20 @@ else:
 logger = Logger(
     "logs",
     logs_webhook_url=config["logs_webhook_url"],
-    offline_mode=config["offline_mode"]
+    offline_mode=config["offline_mode"],
+    async_mode=config["discord_async"]
 )
 tweet_logger = Logger(
     "tweets",
     logs_webhook_url=config["logs_webhook_url"],
     tweets_webhook_url=config["tweets_webhook_url"],
-    offline_mode=config["offline_mode"]
+    offline_mode=config["offline_mode"],
+    async_mode=config["discord_async"]
 )
 possible_tweet_logger = Logger(
     "possible_tweets",
     logs_webhook_url=config["logs_webhook_url"],
     tweets_webhook_url=config["possible_tweets_webhook_url"],
-    offline_mode=config["offline_mode"]
+    offline_mode=config["offline_mode"],
+    async_mode=config["discord_async"]
 )
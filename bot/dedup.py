@@ -0,0 +1,204 @@
+""" Store of tweets and alerts which have already been seen.
+
+Used to skip tweets which have already been processed, e.g. when a tweet is delivered again after a reconnect or a
+processed tweet is retweeted, and to stop the same alert being sent twice. Checking a key never marks it, a key is only
+marked once the work it stands for is done, so a tweet which was dropped or failed is processed again if it is
+delivered again.
+
+Keys are held in a SQLite database so they survive restarts, with two in-memory structures in front of it so most
+checks never touch the disk:
+
+    * A Bloom filter answers "definitely not seen" for new keys, which is the common case.
+    * A least recently used cache answers "seen" for recent keys.
+
+"""
+
+import hashlib
+import math
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+
+class BloomFilter:
+    """ Bloom filter for strings.
+
+    Attributes:
+        size (int): Number of bits.
+        hashes (int): Number of bits set for each key.
+    """
+
+    def __init__(self, capacity, error_rate=0.001):
+        """ Sizes the filter for the expected number of keys.
+
+        Args:
+            capacity (int): Expected number of keys.
+            error_rate (float): Acceptable rate of false positives at that capacity.
+        """
+        self.size = max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self._bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, key):
+        """ Gets the bit positions for a key, using double hashing.
+
+        Args:
+            key (str): Key.
+
+        Returns:
+            generator of int: Bit positions.
+        """
+        digest = hashlib.blake2b(key.encode(), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], "little")
+        second = int.from_bytes(digest[8:], "little") | 1
+        return ((first + i * second) % self.size for i in range(self.hashes))
+
+    def add(self, key):
+        """ Adds a key.
+
+        Args:
+            key (str): Key.
+        """
+        for position in self._positions(key):
+            self._bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, key):
+        return all(self._bits[position >> 3] & (1 << (position & 7)) for position in self._positions(key))
+
+
+class SeenStore:
+    """ Persistent store of seen tweets and alerts.
+
+    Attributes:
+        ttl (float): Seconds before a key is forgotten.
+    """
+
+    def __init__(self, path=None, memory_size=10000, capacity=1000000, ttl=30 * 24 * 60 * 60):
+        """ Opens the store, loading the keys already on disk into the Bloom filter.
+
+        Args:
+            path (str): Path of the SQLite database, None keeps keys in memory only.
+            memory_size (int): Number of recent keys cached in memory.
+            capacity (int): Expected number of keys, used to size the Bloom filter.
+            ttl (float): Seconds before a key is forgotten.
+        """
+        self.ttl = ttl
+        self._memory_size = memory_size
+        self._recent = OrderedDict()
+        self._bloom = BloomFilter(capacity)
+        self._lock = threading.Lock()
+        self._last_prune = 0
+
+        self._db = sqlite3.connect(path or ":memory:", check_same_thread=False)
+        # Every new key is committed, write ahead logging keeps that cheap enough for the stream thread
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute("CREATE TABLE IF NOT EXISTS seen (key TEXT PRIMARY KEY, created REAL NOT NULL)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS seen_created ON seen (created)")
+        self._prune(time.time())
+        for (key,) in self._db.execute("SELECT key FROM seen"):
+            self._bloom.add(key)
+
+    def _prune(self, now):
+        """ Removes keys older than the time to live from the disk, at most once an hour.
+
+        Args:
+            now (float): Current time.
+        """
+        if now - self._last_prune < 60 * 60:
+            return
+        self._last_prune = now
+        self._db.execute("DELETE FROM seen WHERE created <= ?", (now - self.ttl,))
+        self._db.commit()
+
+    def _remember(self, key):
+        """ Puts a key in the cache of recent keys. The lock must be held.
+
+        Args:
+            key (str): Key.
+        """
+        self._recent[key] = True
+        self._recent.move_to_end(key)
+        while len(self._recent) > self._memory_size:
+            self._recent.popitem(last=False)
+
+    def has_seen(self, key):
+        """ Checks whether a key has been marked as seen, without marking it.
+
+        Args:
+            key (str): Key.
+
+        Returns:
+            bool: True if the key has been seen.
+        """
+        with self._lock:
+            if key in self._recent:
+                self._recent.move_to_end(key)
+                return True
+
+            # Only keys which might have been seen need to be looked up on disk
+            if key not in self._bloom:
+                return False
+            row = self._db.execute("SELECT created FROM seen WHERE key = ?", (key,)).fetchone()
+            if row is None or time.time() - row[0] >= self.ttl:
+                return False
+            self._remember(key)
+            return True
+
+    def add(self, *keys):
+        """ Marks keys as seen.
+
+        Args:
+            *keys (str): Keys.
+        """
+        now = time.time()
+        with self._lock:
+            for key in keys:
+                self._bloom.add(key)
+                self._remember(key)
+            self._db.executemany(
+                "INSERT OR REPLACE INTO seen (key, created) VALUES (?, ?)", [(key, now) for key in keys]
+            )
+            self._db.commit()
+            self._prune(now)
+
+    def seen_tweet(self, tweet_id):
+        """ Checks whether a tweet has already been processed.
+
+        Args:
+            tweet_id (int): Tweet id.
+
+        Returns:
+            bool: True if the tweet has already been processed.
+        """
+        return self.has_seen(f"tweet:{tweet_id}")
+
+    def mark_tweet(self, tweet_id):
+        """ Marks a tweet as processed.
+
+        Args:
+            tweet_id (int): Tweet id.
+        """
+        self.add(f"tweet:{tweet_id}")
+
+    def seen_alert(self, tweet_id, message):
+        """ Checks whether an alert has already been sent for a tweet.
+
+        Args:
+            tweet_id (int): Tweet id.
+            message (str): Alert message.
+
+        Returns:
+            bool: True if the alert has already been sent.
+        """
+        return self.has_seen(f"alert:{tweet_id}:" + hashlib.sha1(message.encode()).hexdigest())
+
+    def mark_alert(self, tweet_id, message):
+        """ Marks an alert for a tweet as sent.
+
+        Args:
+            tweet_id (int): Tweet id.
+            message (str): Alert message.
+        """
+        self.add(f"alert:{tweet_id}:" + hashlib.sha1(message.encode()).hexdigest())
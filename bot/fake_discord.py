@@ -0,0 +1,132 @@
+""" Local stand-in for Discord webhooks.
+
+Records every message posted to it along with its arrival time, and can answer with HTTP 429 rate limits, so Discord
+delivery can be tried out without sending anything to Discord.
+
+Usage:
+
+    python fake_discord.py --port 8765 --rate-limit-every 5
+
+Then point the DISCORD_*_WEBHOOK_URL settings at http://127.0.0.1:8765/<channel name>.
+
+"""
+
+import argparse
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class FakeDiscord:
+    """ Fake Discord webhook server.
+
+    Attributes:
+        messages (list of dict): Messages received, each with the channel (request path), content and arrival time.
+        rate_limited (int): Number of requests answered with HTTP 429.
+        rate_limit_every (int): Answer every nth request with HTTP 429, 0 never rate limits.
+        retry_after (float): Seconds to ask clients to wait when rate limited.
+    """
+
+    def __init__(self, host="127.0.0.1", port=0, rate_limit_every=0, retry_after=0.1, verbose=False):
+        """ Initialises the server, it is not started until start() is called.
+
+        Args:
+            host (str): Address to listen on.
+            port (int): Port to listen on, 0 picks a free port.
+            rate_limit_every (int): Answer every nth request with HTTP 429, 0 never rate limits.
+            retry_after (float): Seconds to ask clients to wait when rate limited.
+            verbose (bool): Print each message as it arrives.
+        """
+        self.messages = []
+        self.rate_limited = 0
+        self.rate_limit_every = rate_limit_every
+        self.retry_after = retry_after
+        self.verbose = verbose
+        self._requests = 0
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), self._handler())
+        self._thread = None
+
+    @property
+    def url(self):
+        """ str: Base URL of the server, add a channel name to get a webhook URL. """
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def _handler(self):
+        """ Builds the request handler class bound to this server.
+
+        Returns:
+            type: BaseHTTPRequestHandler subclass.
+        """
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                arrived = time.time()
+                with fake._lock:
+                    fake._requests += 1
+                    limited = fake.rate_limit_every and fake._requests % fake.rate_limit_every == 0
+                    if limited:
+                        fake.rate_limited += 1
+                    else:
+                        content = json.loads(body or b"{}").get("content", "")
+                        fake.messages.append({"channel": self.path, "content": content, "time": arrived})
+
+                if limited:
+                    self._reply(429, {"message": "You are being rate limited.", "retry_after": fake.retry_after})
+                    return
+                if fake.verbose:
+                    print(f"{self.path}: {content}")
+                self._reply(204)
+
+            def _reply(self, status, payload=None):
+                data = json.dumps(payload).encode() if payload is not None else b""
+                self.send_response(status)
+                if data:
+                    self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def start(self):
+        """ Starts serving on a background thread. """
+        self._thread = threading.Thread(target=self._server.serve_forever, name="fake-discord", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """ Stops the server. """
+        self._server.shutdown()
+        self._server.server_close()
+
+
+def main():
+    """ Command line entry point, serves until interrupted. """
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--rate-limit-every", type=int, default=0)
+    parser.add_argument("--retry-after", type=float, default=1)
+    args = parser.parse_args()
+
+    fake = FakeDiscord(args.host, args.port, args.rate_limit_every, args.retry_after, verbose=True)
+    print(f"Fake Discord listening on {fake.url}")
+    fake.start()
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        fake.stop()
+
+
+if __name__ == "__main__":
+    main()
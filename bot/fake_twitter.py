@@ -0,0 +1,371 @@
+""" Local stand-in for the Twitter API v1.1 filter stream.
+
+Serves the filter stream over HTTPS, in the length delimited format the bot asks for, along with enough of the REST
+API for the bot to start up. Statuses are generated at a steady rate with bursts on top, e.g. a tweetstorm with
+replies. Replies come from users who are not followed, as the follow filter delivers them too. The time each status
+is written to a connection is recorded, so it can be compared with when its alert arrives.
+
+Usage:
+
+    python fake_twitter.py --port 8766 --rate 5 --burst-size 200 --burst-interval 30
+
+Then set TWITTER_API_HOST and TWITTER_STREAM_HOST to 127.0.0.1:8766, and REQUESTS_CA_BUNDLE and SSL_CERT_FILE to the
+certificate it prints, so the bot trusts it.
+
+"""
+
+import argparse
+import itertools
+import json
+import os
+import queue
+import random
+import ssl
+import subprocess
+import tempfile
+import threading
+import time
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+STREAM_PATH = "/1.1/statuses/filter.json"
+VERIFY_CREDENTIALS_PATH = "/1.1/account/verify_credentials.json"
+
+MATCHING_TEXTS = (
+    "Buying more bitcoin today",
+    "Doge to the moon",
+    "Thinking about cardano and polkadot",
+    "crypto is the future of money",
+)
+OTHER_TEXTS = (
+    "Rocket launch went well",
+    "New factory opening next month",
+    "Great question",
+    "Thanks for all the support",
+)
+
+
+def make_certificate(directory, host="127.0.0.1"):
+    """ Creates a self-signed certificate with the openssl command line tool.
+
+    Args:
+        directory (str): Directory to write the certificate and key to.
+        host (str): Address the certificate is valid for.
+
+    Returns:
+        (str, str): Paths of the certificate and the private key.
+    """
+    certfile = os.path.join(directory, "fake_twitter.pem")
+    keyfile = os.path.join(directory, "fake_twitter.key")
+    subprocess.run(
+        [
+            "openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "1",
+            "-keyout", keyfile, "-out", certfile, "-subj", f"/CN={host}",
+            "-addext", f"subjectAltName=IP:{host},DNS:localhost"
+        ],
+        check=True,
+        capture_output=True
+    )
+    return certfile, keyfile
+
+
+class FakeTwitter:
+    """ Fake Twitter API v1.1 stream server.
+
+    Attributes:
+        certfile (str): Path of the server's certificate, which clients need to trust.
+        sent (dict): Status id -> time it was written to a connection.
+        statuses (dict): Status id -> generated status, for statuses which were written to a connection.
+        generated (int): Statuses generated.
+        undelivered (int): Statuses generated while no connection was following their user.
+        dropped (int): Statuses still waiting to be written when their connection ended.
+        connections (int): Stream connections made.
+        disconnects (int): Stream connections which ended, whether closed by the client or the server.
+    """
+
+    def __init__(self, following_ids, host="127.0.0.1", port=0, certfile=None, keyfile=None, keep_alive=30,
+                 disconnect_every=0, verbose=False):
+        """ Initialises the server, it is not started until start() is called.
+
+        Args:
+            following_ids (list of str): Ids of the users statuses are generated for.
+            host (str): Address to listen on.
+            port (int): Port to listen on, 0 picks a free port.
+            certfile (str): Path of the certificate, a self-signed one is created if not given.
+            keyfile (str): Path of the private key.
+            keep_alive (float): Seconds of quiet before a keep-alive newline is sent.
+            disconnect_every (int): Close each connection after this many statuses, 0 never disconnects.
+            verbose (bool): Print each connection as it is made.
+        """
+        self.following_ids = [int(user_id) for user_id in following_ids]
+        self.keep_alive = keep_alive
+        self.disconnect_every = disconnect_every
+        self.verbose = verbose
+        self.sent = {}
+        self.statuses = {}
+        self.generated = 0
+        self.undelivered = 0
+        self.dropped = 0
+        self.connections = 0
+        self.disconnects = 0
+        self._ids = itertools.count(1500000000000000000)
+        self._subscribers = {}
+        self._lock = threading.Lock()
+
+        if certfile is None:
+            self._tempdir = tempfile.TemporaryDirectory()
+            certfile, keyfile = make_certificate(self._tempdir.name, host)
+        self.certfile = certfile
+        self._server = ThreadingHTTPServer((host, port), self._handler())
+        self._server.daemon_threads = True
+        context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        context.load_cert_chain(certfile, keyfile)
+        self._server.socket = context.wrap_socket(self._server.socket, server_side=True)
+        self._threads = []
+        self._stopping = threading.Event()
+
+    @property
+    def host(self):
+        """ str: Host and port of the server, for the TWITTER_API_HOST and TWITTER_STREAM_HOST settings. """
+        host, port = self._server.server_address[:2]
+        return f"{host}:{port}"
+
+    def _handler(self):
+        """ Builds the request handler class bound to this server.
+
+        Returns:
+            type: BaseHTTPRequestHandler subclass.
+        """
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            # The stream is delimited by closing the connection
+            protocol_version = "HTTP/1.0"
+
+            def do_GET(self):
+                if self.path.split("?")[0] != VERIFY_CREDENTIALS_PATH:
+                    self._reply(404, {"errors": [{"code": 34, "message": "Sorry, that page does not exist."}]})
+                    return
+                self._reply(200, {"id": 1, "id_str": "1", "screen_name": "fake_twitter"})
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0))).decode()
+                if self.path.split("?")[0] != STREAM_PATH:
+                    self._reply(404, {"errors": [{"code": 34, "message": "Sorry, that page does not exist."}]})
+                    return
+                follow = parse_qs(body).get("follow", [""])[0]
+                fake._stream(self, {int(user_id) for user_id in follow.split(",") if user_id})
+
+            def _reply(self, status, payload):
+                data = json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def _stream(self, handler, follow):
+        """ Writes statuses to a stream connection until it is closed.
+
+        Args:
+            handler (BaseHTTPRequestHandler): Request handler for the connection.
+            follow (set of int): Ids of the users the connection follows.
+        """
+        statuses = queue.Queue()
+        with self._lock:
+            self.connections += 1
+            self._subscribers[statuses] = follow
+        if self.verbose:
+            print(f"Stream connected following {len(follow)} user(s)")
+
+        written = 0
+        try:
+            handler.send_response(200)
+            handler.send_header("Content-Type", "application/json; charset=utf-8")
+            handler.end_headers()
+            handler.wfile.flush()
+            while not self._stopping.is_set():
+                try:
+                    status = statuses.get(timeout=self.keep_alive)
+                except queue.Empty:
+                    handler.wfile.write(b"\r\n")
+                    handler.wfile.flush()
+                    continue
+                data = json.dumps(status).encode()
+                handler.wfile.write(b"%d\r\n" % len(data) + data)
+                handler.wfile.flush()
+                with self._lock:
+                    self.sent.setdefault(status["id"], time.time())
+                    self.statuses[status["id"]] = status
+                written += 1
+                if self.disconnect_every and written >= self.disconnect_every:
+                    break
+        except (OSError, ssl.SSLError):
+            pass
+        finally:
+            with self._lock:
+                del self._subscribers[statuses]
+                self.disconnects += 1
+                self.dropped += statuses.qsize()
+
+    def status(self, user_id, text, in_reply_to=None):
+        """ Builds a status in the Twitter API v1.1 format.
+
+        Args:
+            user_id (int): Id of the author.
+            text (str): Text of the status.
+            in_reply_to (dict): Status being replied to.
+
+        Returns:
+            dict: Status.
+        """
+        status_id = next(self._ids)
+        screen_name = f"user{user_id}"
+        if in_reply_to is not None:
+            text = f"@{in_reply_to['user']['screen_name']} {text}"
+        return {
+            "created_at": formatdate(usegmt=True),
+            "id": status_id,
+            "id_str": str(status_id),
+            "text": text,
+            "in_reply_to_status_id": in_reply_to["id"] if in_reply_to else None,
+            "in_reply_to_user_id": in_reply_to["user"]["id"] if in_reply_to else None,
+            "user": {"id": user_id, "id_str": str(user_id), "screen_name": screen_name},
+            "entities": {"hashtags": [], "urls": [], "user_mentions": [], "symbols": []}
+        }
+
+    def publish(self, status):
+        """ Sends a status to every connection following its author or the author of the status it replies to.
+
+        Args:
+            status (dict): Status.
+
+        Returns:
+            bool: True if any connection was following.
+        """
+        delivered = False
+        with self._lock:
+            self.generated += 1
+            for statuses, follow in self._subscribers.items():
+                if status["user"]["id"] in follow or status.get("in_reply_to_user_id") in follow:
+                    statuses.put(status)
+                    delivered = True
+            if not delivered:
+                self.undelivered += 1
+        return delivered
+
+    def generate(self, duration, rate=5, burst_size=0, burst_interval=30, match_ratio=0.5, reply_ratio=0.5):
+        """ Generates statuses from the followed users, blocking until the duration has passed.
+
+        Args:
+            duration (float): Seconds to generate statuses for.
+            rate (float): Statuses per second from the followed users.
+            burst_size (int): Statuses in each burst, half from the followed users and half replies to them.
+            burst_interval (float): Seconds between bursts.
+            match_ratio (float): Fraction of statuses from the followed users which contain a keyword.
+            reply_ratio (float): Fraction of statuses from the followed users which get a reply.
+
+        Returns:
+            list of int: Ids of the statuses from the followed users which contain a keyword.
+        """
+        matching = []
+
+        def tweet(reply):
+            user_id = random.choice(self.following_ids)
+            if random.random() < match_ratio:
+                status = self.status(user_id, random.choice(MATCHING_TEXTS))
+                matching.append(status["id"])
+            else:
+                status = self.status(user_id, random.choice(OTHER_TEXTS))
+            self.publish(status)
+            if reply:
+                self.publish(self.status(random.randint(10 ** 6, 10 ** 7), random.choice(OTHER_TEXTS), status))
+
+        start = time.monotonic()
+        end = start + duration
+        next_tweet = start if rate else float("inf")
+        next_burst = start + burst_interval if burst_size else float("inf")
+        while not self._stopping.is_set():
+            now = time.monotonic()
+            if now >= end:
+                break
+            if now >= next_burst:
+                for _ in range(burst_size // 2):
+                    tweet(reply=True)
+                next_burst += burst_interval
+            if now >= next_tweet:
+                tweet(reply=random.random() < reply_ratio)
+                next_tweet += 1 / rate
+            time.sleep(max(0, min(end, next_tweet, next_burst) - time.monotonic()))
+        return matching
+
+    def wait_for_connection(self, timeout=30):
+        """ Waits for a client to connect to the stream.
+
+        Args:
+            timeout (float): Seconds to wait.
+
+        Returns:
+            bool: True if a client is connected.
+        """
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            with self._lock:
+                if self._subscribers:
+                    return True
+            time.sleep(0.05)
+        return False
+
+    def start(self):
+        """ Starts serving on a background thread. """
+        thread = threading.Thread(target=self._server.serve_forever, name="fake-twitter", daemon=True)
+        thread.start()
+        self._threads.append(thread)
+
+    def stop(self):
+        """ Stops the server, closing any stream connections. """
+        self._stopping.set()
+        self._server.shutdown()
+        self._server.server_close()
+
+
+def main():
+    """ Command line entry point, generates statuses until interrupted or the duration has passed. """
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8766)
+    parser.add_argument("--certfile")
+    parser.add_argument("--keyfile")
+    parser.add_argument("--following-ids", nargs="+", default=["44196397"])
+    parser.add_argument("--duration", type=float, default=float("inf"))
+    parser.add_argument("--rate", type=float, default=5)
+    parser.add_argument("--burst-size", type=int, default=0)
+    parser.add_argument("--burst-interval", type=float, default=30)
+    parser.add_argument("--match-ratio", type=float, default=0.5)
+    parser.add_argument("--reply-ratio", type=float, default=0.5)
+    parser.add_argument("--disconnect-every", type=int, default=0)
+    args = parser.parse_args()
+
+    fake = FakeTwitter(
+        args.following_ids, args.host, args.port, args.certfile, args.keyfile,
+        disconnect_every=args.disconnect_every, verbose=True
+    )
+    print(f"Fake Twitter listening on {fake.host}, certificate {fake.certfile}")
+    fake.start()
+    try:
+        fake.generate(
+            args.duration, args.rate, args.burst_size, args.burst_interval, args.match_ratio, args.reply_ratio
+        )
+    except KeyboardInterrupt:
+        pass
+    fake.stop()
+
+
+if __name__ == "__main__":
+    main()
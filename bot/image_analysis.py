@@ -0,0 +1,709 @@
+""" Image analysis backends.
+
+Finds the text and objects in the photos of a tweet. The backend is chosen with the "image_backend" setting:
+
+    * google: Google Vision API, one batched request for all the photos in a tweet.
+    * tesseract: Local OCR with Tesseract, needs the optional pytesseract and Pillow packages. Objects are not
+      detected.
+    * fixture: Canned answers read from a JSON file, for running the whole pipeline without a network.
+
+Every backend returns the text and objects as lower case, space delimited strings, so they can be scanned for keywords
+in the same way as tweet text.
+
+Photos are downloaded once by an ImageDownloader and the same bytes are passed to every analysis, rather than each
+analysis fetching the image from its URL again. Backends fall back to the URL when there is no content, e.g. the
+download failed.
+
+"""
+
+import json
+import threading
+import time
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+from io import BytesIO
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from config import config, image_client, logger
+from metrics import counter, histogram
+
+VISION_SECONDS = histogram("vision_request_seconds", "Time spent waiting for Google Vision API", ["method"])
+VISION_CALLS = counter("vision_calls_total", "Google Vision API requests", ["method"])
+VISION_ERRORS = counter("vision_errors_total", "Failed Google Vision API requests and images", ["method"])
+VISION_SKIPPED = counter("vision_skipped_total", "Image analysis requests not made to save cost", ["reason"])
+VISION_SHORT_CIRCUITED = counter("vision_short_circuited_total", "Image analysis requests refused by an open circuit")
+VISION_TIMEOUTS = counter("vision_timeouts_total", "Image analysis requests abandoned after the call timeout")
+VISION_BUSY = counter("vision_busy_total", "Image analysis requests refused while every call slot was still in use")
+
+IMAGE_BACKENDS = ("google", "tesseract", "fixture")
+DOWNLOAD_SECONDS = histogram("image_download_seconds", "Time spent downloading photos")
+DOWNLOAD_ERRORS = counter("image_download_errors_total", "Photos which could not be downloaded")
+
+# Sizes Twitter serves photos in, from smallest to largest
+IMAGE_VARIANTS = ("thumb", "small", "medium", "large", "orig")
+
+
+class ImageAnalysisError(Exception):
+    """ Raised when images could not be analysed at all, e.g. the backend timed out. """
+
+
+class ImageDownloader:
+    """ Downloads photos over a pooled HTTP session.
+
+    Attributes:
+        variant (str): Size of photo to download, one of IMAGE_VARIANTS, or empty for the size Twitter serves by
+            default.
+        timeout (float): Seconds to wait for each download.
+    """
+
+    def __init__(self, variant="", timeout=10, pool_size=4):
+        """ Initialises the downloader.
+
+        Args:
+            variant (str): Size of photo to download, one of IMAGE_VARIANTS, or empty for the default size.
+            timeout (float): Seconds to wait for each download.
+            pool_size (int): Number of connections kept open, and of photos downloaded at once by download_all().
+
+        Raises:
+            ValueError: If the variant is unknown.
+        """
+        if variant and variant not in IMAGE_VARIANTS:
+            raise ValueError(f"Unknown image variant {variant}, expected one of {', '.join(IMAGE_VARIANTS)}")
+        self.variant = variant
+        self.timeout = timeout
+        self._session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self._session.mount("https://", adapter)
+        self._session.mount("http://", adapter)
+        self._executor = ThreadPoolExecutor(max_workers=pool_size, thread_name_prefix="image-download")
+
+    def download(self, image_url):
+        """ Downloads a photo.
+
+        Args:
+            image_url (str): URL of the photo, e.g. the "media_url_https" of a tweet.
+
+        Returns:
+            memoryview: Content of the photo, or None if it could not be downloaded.
+        """
+        url = f"{image_url}:{self.variant}" if self.variant else image_url
+        try:
+            with DOWNLOAD_SECONDS.time():
+                response = self._session.get(url, timeout=self.timeout)
+                response.raise_for_status()
+        except requests.RequestException as e:
+            logger.warning(f"Unable to download image {url}: {e}")
+            DOWNLOAD_ERRORS.inc()
+            return None
+        # A view lets the content be hashed and passed around without being copied
+        return memoryview(response.content)
+
+    def download_all(self, image_urls):
+        """ Downloads several photos in parallel, e.g. all the photos in a tweet.
+
+        Args:
+            image_urls (list of str): URLs of the photos.
+
+        Returns:
+            list of memoryview: Content of each photo, in the same order as the URLs, None for any which could not be
+                downloaded.
+        """
+        if len(image_urls) <= 1:
+            return [self.download(image_url) for image_url in image_urls]
+        return list(self._executor.map(self.download, image_urls))
+
+
+class ImageAnalyser(ABC):
+    """ Base class for image analysis backends.
+
+    Attributes:
+        name (str): Name of the backend, used to keep its cached results apart from other backends.
+        uses_content (bool): Whether the backend analyses downloaded content, otherwise photos are not downloaded.
+    """
+
+    name = None
+    uses_content = True
+
+    @abstractmethod
+    def detect_text(self, image_url, content=None):
+        """ Finds the text in an image.
+
+        Args:
+            image_url (str): URL of the image.
+            content (memoryview): Downloaded content of the image, fetched from the URL if not supplied.
+
+        Returns:
+            str: A space delimited list of words in the image.
+
+        Raises:
+            ImageAnalysisError: If the image could not be analysed.
+        """
+
+    @abstractmethod
+    def detect_objects(self, image_url, content=None):
+        """ Finds the objects in an image, e.g. "car", "dog".
+
+        Args:
+            image_url (str): URL of the image.
+            content (memoryview): Downloaded content of the image, fetched from the URL if not supplied.
+
+        Returns:
+            str: A space delimited string of objects found in the image.
+
+        Raises:
+            ImageAnalysisError: If the image could not be analysed.
+        """
+
+    def analyse(self, image_urls, contents=None, objects=True):
+        """ Finds the text and objects in several images.
+
+        Backends which can analyse several images in one request override this.
+
+        Args:
+            image_urls (list of str): URLs of the images.
+            contents (list of memoryview): Downloaded content of each image, None for any which were not downloaded.
+            objects (bool): Whether to find objects, otherwise only text is found and objects are returned empty.
+
+        Returns:
+            list of (str, str): Text and objects found in each image, in the same order as the URLs. Images which
+                could not be analysed are returned as None.
+        """
+        results = []
+        for image_url, content in zip(image_urls, contents or [None] * len(image_urls)):
+            try:
+                image_objects = self.detect_objects(image_url, content) if objects else ""
+                results.append((self.detect_text(image_url, content), image_objects))
+            except ImageAnalysisError as e:
+                logger.warning(f"Unable to analyse image {image_url}: {e}")
+                results.append(None)
+        return results
+
+
+class GoogleVisionAnalyser(ImageAnalyser):
+    """ Google Vision API backend.
+
+    Requests are not retried and are limited by a timeout, so a slow response cannot hold up the image workers for
+    long. The client library is only imported once the first image is analysed.
+
+    Attributes:
+        timeout (float): Seconds to wait for each request.
+    """
+
+    name = "google"
+
+    def __init__(self, client=None, timeout=10):
+        """ Initialises the backend.
+
+        Args:
+            client (ImageAnnotatorClient): Google Vision API client, defaults to the shared client from config.
+            timeout (float): Seconds to wait for each request.
+        """
+        self._client = client
+        self.timeout = timeout
+
+    @property
+    def client(self):
+        """ ImageAnnotatorClient: Google Vision API client, created on first use. """
+        if self._client is None:
+            self._client = image_client()
+        return self._client
+
+    def _call(self, method, **kwargs):
+        """ Calls a client method, recording its duration and any error.
+
+        Args:
+            method (str): Name of the client method.
+            **kwargs: Arguments for the method.
+
+        Returns:
+            The response from the client.
+
+        Raises:
+            ImageAnalysisError: If the request failed, was rejected, could not be authorised or timed out.
+        """
+        from google.api_core.exceptions import GoogleAPIError
+        from google.auth.exceptions import GoogleAuthError
+
+        VISION_CALLS.inc(method)
+        try:
+            with VISION_SECONDS.time(method):
+                return getattr(self.client, method)(retry=None, timeout=self.timeout, **kwargs)
+        except (GoogleAPIError, GoogleAuthError, OSError) as e:
+            # OSError covers connection errors and timeouts raised by the transport rather than the client library
+            VISION_ERRORS.inc(method)
+            raise ImageAnalysisError(repr(e)) from e
+
+    def _image(self, image_url, content=None):
+        """ Builds the image for a request.
+
+        Args:
+            image_url (str): URL of the image.
+            content (memoryview): Downloaded content of the image.
+
+        Returns:
+            Image: Image holding the content, or referring to the URL if there is no content.
+        """
+        from google.cloud import vision
+
+        if content is not None:
+            return vision.Image(content=bytes(content))
+        image = vision.Image()
+        image.source.image_uri = image_url
+        return image
+
+    def _text(self, response):
+        """ Extracts the text found in an image from a response.
+
+        Args:
+            response (AnnotateImageResponse): Response containing text annotations.
+
+        Returns:
+            str: A space delimited list of words in the image.
+        """
+        result = ""
+        for text in response.text_annotations:
+            temp = text.description.replace('\n', ' ').replace('\r', '')
+            result = " ".join([result, temp])
+
+        return result.lower()
+
+    def _objects(self, response):
+        """ Extracts the objects found in an image from a response.
+
+        Args:
+            response (AnnotateImageResponse): Response containing label annotations.
+
+        Returns:
+            str: A space delimited string of objects found in the image.
+        """
+        result = ""
+        for label in response.label_annotations:
+            result = " ".join([result, label.description])
+
+        return result.lower()
+
+    def detect_text(self, image_url, content=None):
+        return self._text(self._call("text_detection", image=self._image(image_url, content)))
+
+    def detect_objects(self, image_url, content=None):
+        return self._objects(self._call("label_detection", image=self._image(image_url, content)))
+
+    def analyse(self, image_urls, contents=None, objects=True):
+        """ Finds the text and objects in several images with a single batched request.
+
+        A tweet with several photos only makes one round trip.
+
+        Args:
+            image_urls (list of str): URLs of the images.
+            contents (list of memoryview): Downloaded content of each image, None for any which were not downloaded.
+            objects (bool): Whether to find objects, otherwise label detection is left out of the request.
+
+        Returns:
+            list of (str, str): Text and objects found in each image, in the same order as the URLs. Images which
+                could not be analysed are returned as None.
+
+        Raises:
+            ImageAnalysisError: If the request failed.
+        """
+        from google.cloud import vision
+
+        features = [vision.Feature(type_=vision.Feature.Type.TEXT_DETECTION)]
+        if objects:
+            features.append(vision.Feature(type_=vision.Feature.Type.LABEL_DETECTION))
+        annotate_requests = [
+            vision.AnnotateImageRequest(image=self._image(image_url, content), features=features)
+            for image_url, content in zip(image_urls, contents or [None] * len(image_urls))
+        ]
+        batch = self._call("batch_annotate_images", requests=annotate_requests)
+
+        results = []
+        for image_url, response in zip(image_urls, batch.responses):
+            if response.error.message:
+                logger.warning(f"Unable to analyse image {image_url}: {response.error.message}")
+                VISION_ERRORS.inc("image")
+                results.append(None)
+                continue
+            results.append((self._text(response), self._objects(response)))
+        return results
+
+
+class TesseractAnalyser(ImageAnalyser):
+    """ Local OCR backend using Tesseract.
+
+    Only text is found, there is no local object detection so objects are always empty.
+
+    Attributes:
+        timeout (float): Seconds to wait for each download and each OCR run.
+    """
+
+    name = "tesseract"
+
+    def __init__(self, timeout=10):
+        """ Initialises the backend.
+
+        Args:
+            timeout (float): Seconds to wait for each download and each OCR run.
+
+        Raises:
+            ImportError: If pytesseract or Pillow is not installed.
+        """
+        try:
+            import pytesseract
+            from PIL import Image
+        except ImportError as e:
+            raise ImportError("The tesseract image backend needs the pytesseract and Pillow packages") from e
+        self._pytesseract = pytesseract
+        self._image_class = Image
+        self.timeout = timeout
+        self._session = requests.Session()
+
+    def detect_text(self, image_url, content=None):
+        try:
+            if content is None:
+                response = self._session.get(image_url, timeout=self.timeout)
+                response.raise_for_status()
+                content = response.content
+            image = self._image_class.open(BytesIO(content))
+            text = self._pytesseract.image_to_string(image, timeout=self.timeout)
+        except (requests.RequestException, OSError, RuntimeError, self._pytesseract.TesseractError) as e:
+            # pytesseract raises RuntimeError when the timeout is reached
+            raise ImageAnalysisError(repr(e)) from e
+        return " " + " ".join(text.split()).lower()
+
+    def detect_objects(self, image_url, content=None):
+        return ""
+
+
+class FixtureAnalyser(ImageAnalyser):
+    """ Backend giving canned answers, for running without a network.
+
+    Attributes:
+        answers (dict): Image URL -> {"text": str, "labels": list of str}. Images without an answer have no text or
+            objects.
+        latency (float): Seconds to wait before answering, to simulate a remote backend.
+    """
+
+    name = "fixture"
+    uses_content = False
+
+    def __init__(self, answers=None, latency=0):
+        """ Initialises the backend.
+
+        Args:
+            answers (dict): Image URL -> {"text": str, "labels": list of str}.
+            latency (float): Seconds to wait before answering, to simulate a remote backend.
+        """
+        self.answers = answers or {}
+        self.latency = latency
+
+    @classmethod
+    def from_file(cls, path, latency=0):
+        """ Loads the answers from a JSON file.
+
+        Args:
+            path (str): Path of a JSON object mapping image URLs to {"text": str, "labels": list of str}.
+            latency (float): Seconds to wait before answering.
+
+        Returns:
+            FixtureAnalyser: Backend giving the answers in the file.
+        """
+        with open(path) as file:
+            return cls(json.load(file), latency)
+
+    def detect_text(self, image_url, content=None):
+        time.sleep(self.latency)
+        text = self.answers.get(image_url, {}).get("text", "")
+        return " " + " ".join(text.split()).lower() if text else ""
+
+    def detect_objects(self, image_url, content=None):
+        time.sleep(self.latency)
+        labels = self.answers.get(image_url, {}).get("labels", [])
+        return "".join(" " + label for label in labels).lower()
+
+
+class CircuitBreaker:
+    """ Circuit breaker, stops calls to a backend which keeps failing.
+
+    The circuit is closed to begin with and calls go through. After a number of failures in a row it opens, and calls
+    are refused until the reset timeout has passed. It is then half open, a single probe call is let through: the
+    circuit closes again if the probe succeeds, or opens for another reset timeout if it fails.
+
+    Attributes:
+        failure_threshold (int): Failures in a row which open the circuit.
+        reset_timeout (float): Seconds the circuit stays open before a probe is let through.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold=5, reset_timeout=30):
+        """ Initialises the circuit breaker, closed.
+
+        Args:
+            failure_threshold (int): Failures in a row which open the circuit.
+            reset_timeout (float): Seconds the circuit stays open before a probe is let through.
+        """
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self._state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0
+        self._probing = False
+
+    @property
+    def state(self):
+        """ str: State of the circuit, "closed", "open" or "half_open". """
+        with self._lock:
+            if self._state == self.OPEN and time.monotonic() - self._opened_at >= self.reset_timeout:
+                return self.HALF_OPEN
+            return self._state
+
+    def allow(self):
+        """ Checks whether a call may be made, any call allowed must be followed by success() or failure().
+
+        Returns:
+            bool: True if the call may be made.
+        """
+        with self._lock:
+            if self._state == self.CLOSED:
+                return True
+            if self._state == self.OPEN:
+                if time.monotonic() - self._opened_at < self.reset_timeout:
+                    return False
+                self._state = self.HALF_OPEN
+            # Only one probe at a time while half open
+            if self._probing:
+                return False
+            self._probing = True
+            return True
+
+    def success(self):
+        """ Records a successful call, closing the circuit. """
+        with self._lock:
+            if self._state != self.CLOSED:
+                logger.info("Image analysis circuit closed")
+            self._state = self.CLOSED
+            self._failures = 0
+            self._probing = False
+
+    def cancel(self):
+        """ Records that an allowed call was not made after all, so another probe can be let through. """
+        with self._lock:
+            self._probing = False
+
+    def failure(self):
+        """ Records a failed call, opening the circuit if the probe failed or there have been too many failures. """
+        with self._lock:
+            self._failures += 1
+            self._probing = False
+            if self._state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+                if self._state != self.OPEN:
+                    logger.warning(f"Image analysis circuit opened after {self._failures} failure(s) in a row")
+                self._state = self.OPEN
+                self._opened_at = time.monotonic()
+
+
+class CallLimiter:
+    """ Limits the rate of requests and the number of images analysed each day.
+
+    Attributes:
+        per_minute (int): Requests allowed in any minute, 0 for no limit.
+        daily_budget (int): Units allowed each day (UTC), 0 for no limit. A unit is one feature on one image, which
+            is how Google Vision API is billed.
+    """
+
+    def __init__(self, per_minute=0, daily_budget=0):
+        """ Initialises the limiter.
+
+        Args:
+            per_minute (int): Requests allowed in any minute, 0 for no limit.
+            daily_budget (int): Units allowed each day, 0 for no limit.
+        """
+        self.per_minute = per_minute
+        self.daily_budget = daily_budget
+        self._lock = threading.Lock()
+        # Token bucket refilled continuously, holding at most a minute's worth of requests
+        self._tokens = per_minute
+        self._refilled_at = time.monotonic()
+        self._day = None
+        self._spent = 0
+
+    def acquire(self, units):
+        """ Takes a request from the limits, if there is room for it.
+
+        Args:
+            units (int): Units the request will use.
+
+        Returns:
+            str: None if the request may be made, otherwise the limit reached, "rate_limit" or "budget".
+        """
+        with self._lock:
+            if self.daily_budget:
+                day = time.gmtime().tm_yday
+                if day != self._day:
+                    self._day = day
+                    self._spent = 0
+                if self._spent + units > self.daily_budget:
+                    return "budget"
+            if self.per_minute:
+                now = time.monotonic()
+                self._tokens = min(self.per_minute, self._tokens + (now - self._refilled_at) * self.per_minute / 60)
+                self._refilled_at = now
+                if self._tokens < 1:
+                    return "rate_limit"
+                self._tokens -= 1
+            self._spent += units
+            return None
+
+    def remaining(self):
+        """ Gets the units left in today's budget.
+
+        Returns:
+            int: Units left, or None if there is no budget.
+        """
+        with self._lock:
+            if not self.daily_budget:
+                return None
+            if self._day != time.gmtime().tm_yday:
+                return self.daily_budget
+            return self.daily_budget - self._spent
+
+
+class GuardedAnalyser(ImageAnalyser):
+    """ Wraps a backend with a circuit breaker, a call timeout and rate and budget limits.
+
+    Requests refused by the circuit or the limits, or abandoned after the timeout, raise ImageAnalysisError, so the
+    image is skipped as if the backend had failed. Calls are made on a small pool of threads, a call which overruns
+    the timeout is left to finish there while the image worker moves on. Each call holds one of "workers" slots until
+    it finishes, so calls which overrun cannot pile up: once every slot is held, requests are refused straight away
+    rather than queueing behind them.
+
+    Attributes:
+        backend (ImageAnalyser): Wrapped backend.
+        breaker (CircuitBreaker): Circuit breaker for the backend.
+        limiter (CallLimiter): Rate and budget limits for the backend.
+        timeout (float): Seconds to wait for each call.
+    """
+
+    def __init__(self, backend, breaker=None, limiter=None, timeout=10, workers=4):
+        """ Initialises the wrapper.
+
+        Args:
+            backend (ImageAnalyser): Backend to wrap.
+            breaker (CircuitBreaker): Circuit breaker, defaults to one with the default settings.
+            limiter (CallLimiter): Rate and budget limits, defaults to no limits.
+            timeout (float): Seconds to wait for each call.
+            workers (int): Number of calls which can be in flight at once.
+        """
+        self.backend = backend
+        self.name = backend.name
+        self.uses_content = backend.uses_content
+        self.breaker = breaker or CircuitBreaker()
+        self.limiter = limiter or CallLimiter()
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(workers)
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="image-call")
+
+    def _run(self, function, *args, **kwargs):
+        """ Calls the backend on the pool, giving back the slot once the call has finished, however long it took.
+
+        Args:
+            function (callable): Backend method.
+            *args: Arguments for the method.
+            **kwargs: Keyword arguments for the method.
+
+        Returns:
+            The result of the method.
+        """
+        try:
+            return function(*args, **kwargs)
+        finally:
+            self._slots.release()
+
+    def _guard(self, units, function, *args, **kwargs):
+        """ Calls the backend, if the circuit and the limits allow it.
+
+        Args:
+            units (int): Units the call will use.
+            function (callable): Backend method.
+            *args: Arguments for the method.
+            **kwargs: Keyword arguments for the method.
+
+        Returns:
+            The result of the method.
+
+        Raises:
+            ImageAnalysisError: If the call was refused, timed out or failed.
+        """
+        if not self.breaker.allow():
+            VISION_SHORT_CIRCUITED.inc()
+            raise ImageAnalysisError("Skipped, circuit open")
+        if not self._slots.acquire(blocking=False):
+            self.breaker.cancel()
+            VISION_BUSY.inc()
+            raise ImageAnalysisError("Skipped, every call slot is held by a call which has not finished")
+        reason = self.limiter.acquire(units)
+        if reason is not None:
+            self._slots.release()
+            self.breaker.cancel()
+            VISION_SKIPPED.inc(reason)
+            raise ImageAnalysisError(f"Skipped, {reason.replace('_', ' ')} reached")
+
+        future = self._executor.submit(self._run, function, *args, **kwargs)
+        try:
+            result = future.result(timeout=self.timeout)
+        except TimeoutError:
+            VISION_TIMEOUTS.inc()
+            self.breaker.failure()
+            raise ImageAnalysisError(f"Timed out after {self.timeout}s") from None
+        except Exception:
+            self.breaker.failure()
+            raise
+        self.breaker.success()
+        return result
+
+    def detect_text(self, image_url, content=None):
+        return self._guard(1, self.backend.detect_text, image_url, content)
+
+    def detect_objects(self, image_url, content=None):
+        return self._guard(1, self.backend.detect_objects, image_url, content)
+
+    def analyse(self, image_urls, contents=None, objects=True):
+        units = len(image_urls) * (2 if objects else 1)
+        return self._guard(units, self.backend.analyse, image_urls, contents, objects)
+
+
+def create_image_analyser(backend):
+    """ Creates an image analysis backend from the settings.
+
+    Google Vision API is wrapped in a GuardedAnalyser, which stops calls while it is failing and keeps to the rate
+    and budget limits in the settings.
+
+    Args:
+        backend (str): Name of the backend, one of IMAGE_BACKENDS.
+
+    Returns:
+        ImageAnalyser: The backend.
+
+    Raises:
+        ValueError: If the backend is unknown.
+    """
+    if backend == "google":
+        return GuardedAnalyser(
+            GoogleVisionAnalyser(timeout=config["vision_timeout"]),
+            CircuitBreaker(config["vision_circuit_failures"], config["vision_circuit_reset"]),
+            CallLimiter(config["vision_rate_limit"], config["vision_daily_budget"]),
+            timeout=config["vision_call_timeout"],
+            workers=config["image_workers"]
+        )
+    if backend == "tesseract":
+        return TesseractAnalyser(config["vision_timeout"])
+    if backend == "fixture":
+        if config["image_fixtures_path"]:
+            return FixtureAnalyser.from_file(config["image_fixtures_path"])
+        return FixtureAnalyser()
+    raise ValueError(f"Unknown image backend {backend}, expected one of {', '.join(IMAGE_BACKENDS)}")
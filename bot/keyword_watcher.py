@@ -0,0 +1,107 @@
+""" Watcher for changes to the keywords file.
+
+Polls the keywords file from a background thread. When it changes, the file is loaded and validated, and the new
+keyword lists are handed to a callback, e.g. TweetHandler.reload_keywords, which compiles and swaps them in. An invalid
+file is reported and the current keywords are kept, so a typo cannot take the bot down.
+
+"""
+
+import os
+import threading
+
+from config import config, load_keywords, logger
+
+
+class KeywordWatcher:
+    """ Background watcher for the keywords file.
+
+    Attributes:
+        path (str): Path of the keywords file.
+        on_change (callable): Called with the new keyword lists after the file changes.
+        interval (float): Seconds between checks.
+    """
+
+    def __init__(self, path, on_change, interval=10):
+        """ Initialises the watcher, it is not started until start() is called.
+
+        Args:
+            path (str): Path of the keywords file.
+            on_change (callable): Called with the new keyword lists after the file changes.
+            interval (float): Seconds between checks.
+        """
+        self.path = path
+        self.on_change = on_change
+        self.interval = interval
+        self._signature = self._stat()
+        self._stopped = threading.Event()
+
+    def _stat(self):
+        """ Gets a signature of the file which changes when the file is modified.
+
+        Returns:
+            tuple: Modification time and size, or None if the file cannot be read.
+        """
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    def check(self):
+        """ Reloads the keywords if the file has changed since the last check.
+
+        Returns:
+            bool: True if new keywords were loaded.
+        """
+        signature = self._stat()
+        if signature is None or signature == self._signature:
+            return False
+        self._signature = signature
+
+        try:
+            nlp_keywords = load_keywords(self.path)
+        except (OSError, ValueError) as e:
+            logger.warning(f"Keywords file changed but could not be loaded, keeping the current keywords: {e}")
+            return False
+
+        self.on_change(nlp_keywords)
+        return True
+
+    def start(self):
+        """ Starts checking for changes on a background thread. """
+        threading.Thread(target=self._run, name="keyword-watcher", daemon=True).start()
+
+    def stop(self):
+        """ Stops checking for changes. """
+        self._stopped.set()
+
+    def _run(self):
+        """ Watcher loop. """
+        while not self._stopped.wait(self.interval):
+            try:
+                self.check()
+            except Exception as e:
+                logger.error(f"Error reloading keywords: {e!r}")
+
+
+def watch_keywords(tweet_handler):
+    """ Starts reloading a tweet handler's keywords whenever the keywords file changes.
+
+    Does nothing if the "keywords_reload_interval" setting is 0.
+
+    Args:
+        tweet_handler (TweetHandler): Tweet handler to reload.
+
+    Returns:
+        KeywordWatcher: The running watcher, or None if reloading is disabled.
+    """
+    if not config["keywords_reload_interval"]:
+        return None
+
+    def reload(nlp_keywords):
+        config.update(nlp_keywords)
+        tweet_handler.reload_keywords(nlp_keywords)
+
+    watcher = KeywordWatcher(config["keywords_path"], reload, config["keywords_reload_interval"])
+    watcher.start()
+    return watcher
@@ -0,0 +1,275 @@
+""" End-to-end load test against a local fake Twitter stream and fake Discord webhooks.
+
+Runs the bot (main.py) in a child process, pointed at a FakeTwitter stream served over TLS and a FakeDiscord receiving
+its alerts, so burst behaviour can be measured without live services.
+
+Usage:
+
+    python loadtest.py --duration 60 --rate 5 --burst-size 300 --burst-interval 20 --output results.json
+    python loadtest.py --env RUN_MODE=asyncio --env STREAM_SHARDS=2 --following 4
+
+Reports:
+
+    * Tweet to alert latency: from the status being written to the stream to its alert arriving at the webhook.
+    * Missing alerts: statuses containing a keyword whose alert never arrived, e.g. dropped by the tweet queue.
+    * Stream connections and disconnects seen by the fake stream, and statuses lost while the bot was not connected.
+    * CPU time of the bot, including any shard processes, and the peak resident memory of its largest process.
+    * Selected metrics scraped from the bot's metrics endpoint just before it is stopped.
+
+The bot runs with OFFLINE_MODE disabled, so it posts to the fake webhooks, with image analysis, the seen store and the
+tweet queue spill file kept local.
+
+"""
+
+import argparse
+import json
+import os
+import re
+import resource
+import signal
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+from fake_discord import FakeDiscord
+from fake_twitter import FakeTwitter
+
+ALERT_PATTERN = re.compile(r"\[(\d+)/(text|image)\]")
+REPORTED_METRICS = (
+    "tweets_seen_total", "duplicate_tweets_total", "tweet_queue_dropped", "tweet_queue_depth",
+    "discord_queue_depth", "duplicate_alerts_total"
+)
+
+
+def free_port():
+    """ Finds a free local port.
+
+    Returns:
+        int: Port number.
+    """
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def scrape_metrics(port):
+    """ Reads selected metrics from the bot's metrics endpoint.
+
+    Args:
+        port (int): Port of the metrics endpoint.
+
+    Returns:
+        dict: Metric line (name and labels) -> value, empty if the endpoint could not be read.
+    """
+    try:
+        with urllib.request.urlopen(f"http://127.0.0.1:{port}/metrics", timeout=5) as response:
+            text = response.read().decode()
+    except OSError:
+        return {}
+    metrics = {}
+    for line in text.splitlines():
+        if line.startswith(REPORTED_METRICS):
+            name, _, value = line.rpartition(" ")
+            metrics[name] = float(value)
+    return metrics
+
+
+def alert_times(discord):
+    """ Gets when the first alert for each status arrived, on the tweet and possible tweet channels.
+
+    Args:
+        discord (FakeDiscord): Fake webhook server the alerts were posted to.
+
+    Returns:
+        dict: Status id -> arrival time of its first alert.
+    """
+    times = {}
+    for message in list(discord.messages):
+        if message["channel"] == "/logs":
+            continue
+        match = ALERT_PATTERN.search(message["content"])
+        if match:
+            status_id = int(match.group(1))
+            times[status_id] = min(times.get(status_id, message["time"]), message["time"])
+    return times
+
+
+def percentile(values, fraction):
+    """ Gets a percentile of some values.
+
+    Args:
+        values (list of float): Sorted values.
+        fraction (float): Percentile as a fraction, e.g. 0.95.
+
+    Returns:
+        float: Value at the percentile.
+    """
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def run(args):
+    """ Runs the load test.
+
+    Args:
+        args (Namespace): Command line arguments.
+
+    Returns:
+        dict: Results.
+    """
+    following_ids = [str(44196397 + index) for index in range(args.following)]
+    discord = FakeDiscord(rate_limit_every=args.rate_limit_every)
+    twitter = FakeTwitter(following_ids, keep_alive=args.keep_alive, disconnect_every=args.disconnect_every)
+    discord.start()
+    twitter.start()
+    metrics_port = free_port()
+
+    workdir = tempfile.TemporaryDirectory()
+    env = dict(
+        os.environ,
+        OFFLINE_MODE="False",
+        TWITTER_USER_IDS_TO_FOLLOW=" ".join(following_ids),
+        TWITTER_API_KEY="key",
+        TWITTER_API_SECRET="secret",
+        TWITTER_ACCESS_TOKEN="token",
+        TWITTER_ACCESS_TOKEN_SECRET="token-secret",
+        TWITTER_API_HOST=twitter.host,
+        TWITTER_STREAM_HOST=twitter.host,
+        # Trust the fake stream's self-signed certificate, both for requests and for plain ssl contexts
+        REQUESTS_CA_BUNDLE=twitter.certfile,
+        SSL_CERT_FILE=twitter.certfile,
+        DISCORD_LOGS_WEBHOOK_URL=f"{discord.url}/logs",
+        DISCORD_TWEETS_WEBHOOK_URL=f"{discord.url}/tweets",
+        DISCORD_POSSIBLE_TWEETS_WEBHOOK_URL=f"{discord.url}/possible_tweets",
+        IMAGE_BACKEND="fixture",
+        SEEN_STORE_PATH="",
+        TWEET_QUEUE_SPILL_PATH=os.path.join(workdir.name, "spilled_tweets.jsonl"),
+        METRICS_PORT=str(metrics_port),
+        PYTHONUNBUFFERED="1"
+    )
+    for setting in args.env:
+        name, _, value = setting.partition("=")
+        env[name] = value
+
+    bot_dir = os.path.dirname(os.path.abspath(__file__))
+    output = open(os.path.join(workdir.name, "bot.log"), "w+")
+    wall_start = time.monotonic()
+    usage_before = resource.getrusage(resource.RUSAGE_CHILDREN)
+    bot = subprocess.Popen(
+        [sys.executable, "main.py"], cwd=bot_dir, env=env, stdout=output, stderr=subprocess.STDOUT,
+        start_new_session=True
+    )
+    try:
+        if not twitter.wait_for_connection(args.connect_timeout):
+            output.seek(0)
+            raise RuntimeError(f"The bot did not connect to the fake stream:\n{output.read()[-2000:]}")
+        startup_seconds = time.monotonic() - wall_start
+
+        matching = twitter.generate(
+            args.duration, args.rate, args.burst_size, args.burst_interval, args.match_ratio, args.reply_ratio
+        )
+        # Give the bot time to work through any backlog
+        deadline = time.monotonic() + args.drain
+        while time.monotonic() < deadline:
+            alerts = alert_times(discord)
+            if all(status_id in alerts for status_id in matching if status_id in twitter.sent):
+                break
+            time.sleep(0.25)
+        metrics = scrape_metrics(metrics_port)
+    finally:
+        # Stop the whole process group, so shard processes are stopped too
+        os.killpg(bot.pid, signal.SIGTERM)
+        try:
+            bot.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            os.killpg(bot.pid, signal.SIGKILL)
+            bot.wait()
+        wall_seconds = time.monotonic() - wall_start
+        twitter.stop()
+        discord.stop()
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+
+    alerts = alert_times(discord)
+    delivered = [status_id for status_id in matching if status_id in twitter.sent]
+    latencies = sorted(alerts[status_id] - twitter.sent[status_id] for status_id in delivered if status_id in alerts)
+    cpu_seconds = (usage.ru_utime - usage_before.ru_utime) + (usage.ru_stime - usage_before.ru_stime)
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    peak_rss = usage.ru_maxrss * (1 if sys.platform == "darwin" else 1024)
+
+    output.seek(0)
+    log_tail = output.read()[-2000:]
+    output.close()
+    workdir.cleanup()
+    return {
+        "settings": {
+            "duration": args.duration,
+            "rate": args.rate,
+            "burst_size": args.burst_size,
+            "burst_interval": args.burst_interval,
+            "following": args.following,
+            "match_ratio": args.match_ratio,
+            "reply_ratio": args.reply_ratio,
+            "disconnect_every": args.disconnect_every,
+            "env": args.env
+        },
+        "statuses_generated": twitter.generated,
+        "statuses_sent": len(twitter.sent),
+        "statuses_undelivered": twitter.undelivered,
+        "statuses_dropped_on_disconnect": twitter.dropped,
+        "matching_sent": len(delivered),
+        "alerts_received": len(alerts),
+        "alerts_missing": len([status_id for status_id in delivered if status_id not in alerts]),
+        "rate_limited": discord.rate_limited,
+        "latency_ms": {
+            "p50": percentile(latencies, 0.5) * 1000,
+            "p95": percentile(latencies, 0.95) * 1000,
+            "p99": percentile(latencies, 0.99) * 1000,
+            "max": latencies[-1] * 1000,
+            "mean": statistics.mean(latencies) * 1000
+        } if latencies else None,
+        "stream_connections": twitter.connections,
+        "stream_disconnects": twitter.disconnects,
+        "startup_seconds": startup_seconds,
+        "wall_seconds": wall_seconds,
+        "cpu_seconds": cpu_seconds,
+        "cpu_percent": cpu_seconds / wall_seconds * 100,
+        "peak_rss_mb": peak_rss / 2 ** 20,
+        "exit_code": bot.returncode,
+        "metrics": metrics,
+        "log_tail": log_tail if args.verbose else None
+    }
+
+
+def main():
+    """ Command line entry point. """
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--duration", type=float, default=30, help="Seconds to generate statuses for")
+    parser.add_argument("--rate", type=float, default=5, help="Statuses per second from the followed users")
+    parser.add_argument("--burst-size", type=int, default=200, help="Statuses in each burst, half of them replies")
+    parser.add_argument("--burst-interval", type=float, default=10, help="Seconds between bursts")
+    parser.add_argument("--following", type=int, default=1, help="Number of followed users")
+    parser.add_argument("--match-ratio", type=float, default=0.5)
+    parser.add_argument("--reply-ratio", type=float, default=0.5)
+    parser.add_argument("--disconnect-every", type=int, default=0, help="Drop the stream after this many statuses")
+    parser.add_argument("--keep-alive", type=float, default=5, help="Seconds between keep-alives on a quiet stream")
+    parser.add_argument("--rate-limit-every", type=int, default=0, help="Rate limit every nth Discord post")
+    parser.add_argument("--drain", type=float, default=30, help="Seconds to wait for alerts after the last status")
+    parser.add_argument("--connect-timeout", type=float, default=60)
+    parser.add_argument("--env", action="append", default=[], metavar="NAME=VALUE", help="Extra setting for the bot")
+    parser.add_argument("--verbose", action="store_true", help="Include the end of the bot's output")
+    parser.add_argument("--output", help="Also write the results to this file")
+    args = parser.parse_args()
+
+    results = run(args)
+    text = json.dumps(results, indent=2)
+    print(text)
+    if args.output:
+        with open(args.output, "w") as file:
+            file.write(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,22 +1,358 @@
+import atexit
 import json
 import os
 import logging
+import queue
+import sys
+import threading
+import time
+from itertools import count
+from logging.handlers import QueueHandler, QueueListener
+
+import requests
 from discord_handler import DiscordHandler
 
+from metrics import gauge, histogram
+
 LOG_FORMAT = logging.Formatter("%(name)-6s - %(levelname)-7s - %(message)s")
 TWEET_FORMAT = logging.Formatter("%(message)s")
 
+# Discord rejects messages longer than this
+DISCORD_MESSAGE_LIMIT = 2000
+
+# Message priorities, tweet alerts are always sent before log lines
+TWEET_PRIORITY = 0
+LOG_PRIORITY = 1
+
+DISCORD_EMIT_SECONDS = histogram(
+    "discord_emit_seconds", "Time spent handing a log record to Discord, in the logging call", ["mode"]
+)
+DISCORD_POST_SECONDS = histogram("discord_post_seconds", "Time spent posting a message to a Discord webhook")
+
+
+class TimedDiscordHandler(DiscordHandler):
+    """ Blocking Discord handler which records how long each emit takes. """
+
+    def emit(self, record):
+        with DISCORD_EMIT_SECONDS.time("sync"):
+            super().emit(record)
+
+
+class DiscordSender:
+    """ Background sender for a Discord webhook.
+
+    Messages are queued and sent by a background thread using a keep-alive HTTP session, so logging never waits on
+    Discord. Tweet alerts are sent as soon as possible, ahead of any waiting log lines. Log lines are merged into a
+    single message for each flush window, to keep the number of webhook calls down.
+
+    Attributes:
+        webhook_url (str): Discord webhook URL.
+        flush_window (float): Seconds to collect log lines for before sending them as one message.
+        max_retries (int): Number of times to retry a message after a server error.
+        max_rate_limit_wait (float): Seconds a message may spend waiting out rate limits before it is dropped.
+    """
+
+    def __init__(self, webhook_url, flush_window=2, max_retries=3, max_rate_limit_wait=60):
+        """ Initialises the sender and starts its background thread.
+
+        Args:
+            webhook_url (str): Discord webhook URL.
+            flush_window (float): Seconds to collect log lines for before sending them as one message.
+            max_retries (int): Number of times to retry a message after a server error.
+            max_rate_limit_wait (float): Seconds a message may spend waiting out rate limits before it is dropped.
+        """
+        self.webhook_url = webhook_url
+        self.flush_window = flush_window
+        self.max_retries = max_retries
+        self.max_rate_limit_wait = max_rate_limit_wait
+        self._start()
+
+    def _start(self):
+        """ Starts the session, queue and background thread, afresh in a forked child process. """
+        self.session = requests.Session()
+        self._queue = queue.PriorityQueue()
+        self._sequence = count()
+        self._thread = threading.Thread(target=self._run, name="discord-sender", daemon=True)
+        self._thread.start()
+
+    def send(self, message, priority=LOG_PRIORITY):
+        """ Queues a message to be sent.
+
+        Args:
+            message (str): Message text.
+            priority (int): TWEET_PRIORITY or LOG_PRIORITY.
+        """
+        self._queue.put((priority, next(self._sequence), message))
+
+    def depth(self):
+        """ Gets the number of messages waiting to be sent.
+
+        Returns:
+            int: Number of queued messages.
+        """
+        return self._queue.qsize()
+
+    def flush(self, timeout=5):
+        """ Waits for queued messages to be sent.
+
+        Args:
+            timeout (float): Maximum number of seconds to wait.
+        """
+        deadline = time.monotonic() + timeout
+        while self._queue.unfinished_tasks and time.monotonic() < deadline:
+            time.sleep(0.05)
+
+    def _run(self):
+        """ Sender loop, tweet alerts are sent straight away and log lines are sent once per flush window. """
+        while True:
+            priority, _, message = self._queue.get()
+            if priority == TWEET_PRIORITY:
+                self._post(message)
+                self._queue.task_done()
+                continue
+
+            lines = [message]
+            deadline = time.monotonic() + self.flush_window
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    priority, _, message = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if priority == TWEET_PRIORITY:
+                    # Alerts jump ahead of the log lines being collected
+                    self._post(message)
+                    self._queue.task_done()
+                else:
+                    lines.append(message)
+
+            for chunk in self._merge(lines):
+                self._post(chunk)
+            for _ in lines:
+                self._queue.task_done()
+
+    def _merge(self, lines):
+        """ Merges log lines into as few messages as fit within the Discord message limit.
+
+        Args:
+            lines (list of str): Log lines.
+
+        Returns:
+            list of str: Messages to send.
+        """
+        messages = []
+        current = ""
+        for line in lines:
+            line = line[:DISCORD_MESSAGE_LIMIT]
+            if current and len(current) + len(line) + 1 > DISCORD_MESSAGE_LIMIT:
+                messages.append(current)
+                current = line
+            else:
+                current = f"{current}\n{line}" if current else line
+        if current:
+            messages.append(current)
+        return messages
+
+    def _post(self, message):
+        """ Posts a message to the webhook, waiting out rate limits and retrying server errors.
+
+        Rate limits are waited out for up to "max_rate_limit_wait" seconds in total, so a webhook which stays rate
+        limited cannot hold up every other message for ever. Errors are written to stderr, logging them would queue
+        yet another message.
+
+        Args:
+            message (str): Message text.
+        """
+        attempts = 0
+        waited = 0
+        while True:
+            try:
+                with DISCORD_POST_SECONDS.time():
+                    response = self.session.post(self.webhook_url, json={"content": message}, timeout=10)
+            except requests.RequestException as e:
+                response = None
+                error = repr(e)
+            else:
+                if response.status_code < 400:
+                    return
+                error = f"HTTP {response.status_code}"
+
+            if response is not None and response.status_code == 429:
+                # Rate limited, Discord says how long to wait
+                delay = self._retry_after(response)
+                if waited + delay > self.max_rate_limit_wait:
+                    print(f"Unable to send message to Discord: still rate limited after {waited:g}s", file=sys.stderr)
+                    return
+                waited += delay
+                time.sleep(delay)
+                continue
+
+            attempts += 1
+            if attempts > self.max_retries or (response is not None and response.status_code < 500):
+                print(f"Unable to send message to Discord: {error}", file=sys.stderr)
+                return
+            time.sleep(2 ** attempts)
+
+    def _retry_after(self, response):
+        """ Gets the number of seconds to wait after a rate limited response.
+
+        Args:
+            response (Response): HTTP 429 response.
+
+        Returns:
+            float: Seconds to wait.
+        """
+        try:
+            return float(response.json()["retry_after"])
+        except (ValueError, KeyError, TypeError):
+            return float(response.headers.get("Retry-After", 1))
+
+
+class AsyncDiscordHandler(logging.Handler):
+    """ Non-blocking logging handler for Discord.
+
+    Formats each record and passes it to a DiscordSender, so emitting a record does not wait for HTTP.
+
+    Attributes:
+        sender (DiscordSender): Background sender for the webhook.
+        priority (int): TWEET_PRIORITY or LOG_PRIORITY.
+    """
+
+    def __init__(self, sender, priority=LOG_PRIORITY):
+        """ Initialises the handler.
+
+        Args:
+            sender (DiscordSender): Background sender for the webhook.
+            priority (int): TWEET_PRIORITY or LOG_PRIORITY.
+        """
+        super().__init__()
+        self.sender = sender
+        self.priority = priority
+
+    def emit(self, record):
+        """ Queues a record to be sent to Discord.
+
+        Args:
+            record (LogRecord): Log record.
+        """
+        try:
+            with DISCORD_EMIT_SECONDS.time("async"):
+                self.sender.send(self.format(record), self.priority)
+        except Exception:
+            self.handleError(record)
+
+
+# One sender per webhook URL, shared by every logger which sends to it
+_senders = {}
+_senders_lock = threading.Lock()
+
+
+def get_sender(webhook_url):
+    """ Gets the background sender for a webhook, creating it on first use.
+
+    Args:
+        webhook_url (str): Discord webhook URL.
+
+    Returns:
+        DiscordSender: Sender for the webhook.
+    """
+    with _senders_lock:
+        if webhook_url not in _senders:
+            _senders[webhook_url] = DiscordSender(webhook_url)
+        return _senders[webhook_url]
+
+
+def _restart_senders():
+    """ Restarts every sender in a forked child process.
+
+    A forked child inherits the parent's senders, which its handlers hold on to, but not their background threads, so
+    anything it logged to Discord would be queued and never sent. Messages still queued in the parent are left for the
+    parent to send.
+    """
+    global _senders_lock
+    _senders_lock = threading.Lock()
+    for sender in _senders.values():
+        sender._start()
+
+
+os.register_at_fork(after_in_child=_restart_senders)
+
+gauge(
+    "discord_queue_depth", "Messages waiting to be sent to Discord",
+    lambda: sum(sender.depth() for sender in list(_senders.values()))
+)
+
+
+@atexit.register
+def _flush_senders():
+    """ Gives queued messages a chance to be sent before exiting. """
+    for sender in list(_senders.values()):
+        sender.flush()
+
+
+# Every Logger by name, so records forwarded from other processes reach the right handlers
+_loggers = {}
+
+
+class _DispatchHandler(logging.Handler):
+    """ Hands records forwarded from another process to the logger of the same name in this process. """
+
+    def emit(self, record):
+        logger = _loggers.get(record.name)
+        if logger is not None and not logger._handlers_added:
+            logger._add_handlers()
+        logging.getLogger(record.name).handle(record)
+
+
+def forward_logs(log_queue, *loggers):
+    """ Sends everything logged by the loggers to a queue, instead of to their own handlers.
+
+    Used in worker processes, so one process sends everything to the console and Discord and Discord rate limits are
+    shared. The parent process reads the queue with listen_for_logs().
+
+    Args:
+        log_queue (multiprocessing.Queue): Queue read by the parent process.
+        *loggers (Logger): Loggers to forward.
+    """
+    handler = QueueHandler(log_queue)
+    for logger in loggers:
+        with logger._handlers_lock:
+            logger._handlers_added = True
+            for existing in list(logger.logger.handlers):
+                logger.logger.removeHandler(existing)
+            logger.logger.addHandler(handler)
+
+
+def listen_for_logs(log_queue):
+    """ Logs records forwarded by worker processes, from a background thread.
+
+    Each record goes to the handlers of the logger with the same name in this process.
+
+    Args:
+        log_queue (multiprocessing.Queue): Queue the worker processes forward to.
+
+    Returns:
+        QueueListener: The running listener.
+    """
+    listener = QueueListener(log_queue, _DispatchHandler())
+    listener.start()
+    return listener
+
 
 class Logger:
     """ Logging system for twitter notifier.
 
-    Includes handlers for Discord.
+    Includes handlers for Discord. Handlers are only added when the first message is logged, so creating a Logger
+    has no side effects, e.g. starting a Discord sender thread.
 
     Attributes:
         logger: Instance of python logging system.
     """
 
-    def __init__(self, logging_agent, logs_webhook_url=None, tweets_webhook_url=None, offline_mode=True):
+    def __init__(self, logging_agent, logs_webhook_url=None, tweets_webhook_url=None, offline_mode=True,
+                 async_mode=False):
         """ Initialises an instance of the Logger class.
 
         Args:
@@ -24,32 +360,59 @@ class Logger:
             logs_webhook_url (str): Discord webhook URL for logs channel.
             tweets_webhook_url (str): Discord webhook URL for tweets.
             offline_mode (bool): Offline mode = True skips logging to Discord.
+            async_mode (bool): Async mode = True sends to Discord from a background thread instead of blocking.
         """
 
         # Initialise logger
         self.logger = logging.getLogger(logging_agent)
         self.logger.setLevel(logging.DEBUG)
 
-        # Define console handler and add to logger
-        console_handler = logging.StreamHandler()
-        console_handler.setLevel(logging.DEBUG)
-        console_handler.setFormatter(LOG_FORMAT)
-        self.logger.addHandler(console_handler)
-
-        if not offline_mode:
-            # Define discord handler and add to logger
-            discord_log_handler = DiscordHandler(logs_webhook_url, emit_as_code_block=False)
-            discord_log_handler.setLevel(logging.INFO)
-            discord_log_handler.setFormatter(LOG_FORMAT)
-            self.logger.addHandler(discord_log_handler)
-
-            # If webhook for tweets has been supplied, define discord handler and add it to logger
-            if tweets_webhook_url:
-                tweet_format = TWEET_FORMAT
-                discord_tweet_handler = DiscordHandler(tweets_webhook_url, logging_agent, emit_as_code_block=False)
-                discord_tweet_handler.setLevel(logging.INFO)
-                discord_tweet_handler.setFormatter(tweet_format)
-                self.logger.addHandler(discord_tweet_handler)
+        self._logging_agent = logging_agent
+        self._logs_webhook_url = logs_webhook_url
+        self._tweets_webhook_url = tweets_webhook_url
+        self._offline_mode = offline_mode
+        self._async_mode = async_mode
+        self._handlers_added = False
+        self._handlers_lock = threading.Lock()
+        _loggers[logging_agent] = self
+
+    def _add_handlers(self):
+        """ Adds the console and Discord handlers, the first time a message is logged. """
+        with self._handlers_lock:
+            if self._handlers_added:
+                return
+            self._handlers_added = True
+
+            # Define console handler and add to logger
+            console_handler = logging.StreamHandler()
+            console_handler.setLevel(logging.DEBUG)
+            console_handler.setFormatter(LOG_FORMAT)
+            self.logger.addHandler(console_handler)
+
+            if not self._offline_mode:
+                # Define discord handler and add to logger
+                if self._async_mode:
+                    discord_log_handler = AsyncDiscordHandler(get_sender(self._logs_webhook_url), LOG_PRIORITY)
+                else:
+                    discord_log_handler = TimedDiscordHandler(self._logs_webhook_url, emit_as_code_block=False)
+                discord_log_handler.setLevel(logging.INFO)
+                discord_log_handler.setFormatter(LOG_FORMAT)
+                self.logger.addHandler(discord_log_handler)
+
+                # If webhook for tweets has been supplied, define discord handler and add it to logger
+                if self._tweets_webhook_url:
+                    tweet_format = TWEET_FORMAT
+                    if self._async_mode:
+                        discord_tweet_handler = AsyncDiscordHandler(
+                            get_sender(self._tweets_webhook_url), TWEET_PRIORITY
+                        )
+                    else:
+                        discord_tweet_handler = TimedDiscordHandler(
+                            self._tweets_webhook_url, self._logging_agent, emit_as_code_block=False
+                        )
+                    discord_tweet_handler.setLevel(logging.INFO)
+                    discord_tweet_handler.setFormatter(tweet_format)
+                    self.logger.addHandler(discord_tweet_handler)
 
     def _log(self, message, level="info"):
         """ Log selector.
@@ -61,6 +424,8 @@ class Logger:
         Returns:
 
         """
+        if not self._handlers_added:
+            self._add_handlers()
         if level == "info":
             self.logger.info(message)
         elif level == "warning":
@@ -5,11 +5,57 @@ Uses web sockets.
 Initiates the Twitter listener, triggering the analysis methods when tweets are received.
 
 """
+import multiprocessing
+import threading
 import time
 import tweepy
+from concurrent.futures import ProcessPoolExecutor
 
-from config import config, logger, twitter_api
+from config import config, logger, possible_tweet_logger, tweet_logger, twitter_api
 from brain import TweetHandler
+from keyword_watcher import watch_keywords
+from log import forward_logs, listen_for_logs
+from metrics import counter, gauge, histogram, start_http_server, start_summary, timed
+from profiler import install_signal_handlers
+from supervisor import StreamSupervisor
+from workers import TweetQueue
+
+TWEETS_SEEN = counter("tweets_seen_total", "Statuses received from the stream", ["followed"])
+DUPLICATE_TWEETS = counter("duplicate_tweets_total", "Followed tweets skipped because they were seen before", ["key"])
+ON_STATUS_SECONDS = histogram("on_status_seconds", "Time spent handling a status on the stream thread")
+PROCESS_SECONDS = histogram("process_tweet_seconds", "Time spent processing a tweet on a worker, excluding images")
+
+# Tweet handler for worker processes, when tweets are processed in a process pool
+_process_tweet_handler = None
+
+
+def _init_worker_process(log_queue):
+    """ Creates the tweet handler for a worker process.
+
+    Everything logged, including alerts, is forwarded to the parent process.
+
+    Args:
+        log_queue (multiprocessing.Queue): Queue read by the parent process.
+    """
+    global _process_tweet_handler
+    forward_logs(log_queue, logger, tweet_logger, possible_tweet_logger)
+    _process_tweet_handler = TweetHandler()
+    watch_keywords(_process_tweet_handler)
+
+
+def _process_tweet_json(data):
+    """ Processes a tweet in a worker process.
+
+    Args:
+        data (dict): Raw JSON of the tweet.
+
+    Returns:
+        bool: True if the tweet was processed completely, so the parent process can mark it as processed too.
+    """
+    tweet = tweepy.Status.parse(None, data)
+    # Wait for the image analysis, so the worker is not reused before it finishes
+    _process_tweet_handler.process_tweet(tweet).wait()
+    return _process_tweet_handler.seen_store.seen_tweet(tweet.id)
 
 
 class CryptoTweetListener(tweepy.StreamListener):
@@ -20,68 +66,283 @@ class CryptoTweetListener(tweepy.StreamListener):
     Attributes:
         api (API): Tweepy API instance.
         tweet_handler (TweetHandler): Tweet handler instance.
+        following_ids (frozenset of int): Ids of the users whose tweets are processed.
+        tweet_queue (TweetQueue): Queue of tweets waiting to be processed by the workers.
+        supervisor (StreamSupervisor): Supervisor keeping the stream connected.
+        last_error: HTTP status code or exception which stopped the stream, read by the supervisor.
 
     """
 
-    def __init__(self):
-        """ Initialises Crypto tweet listener instance. """
-        super().__init__()
-        self.api = twitter_api()
-        self.tweet_handler = TweetHandler()
+    def __init__(self, api, tweet_handler, following_ids=None, tweet_queue=None):
+        """ Initialises Crypto tweet listener instance.
+
+        Args:
+            api (API): Tweepy API instance.
+            tweet_handler (TweetHandler): Tweet handler instance.
+            following_ids (list of str): Ids of the users whose tweets are processed, defaults to every followed user.
+            tweet_queue (TweetQueue): Running tweet queue shared with other listeners, a new one is started if not
+                given.
+        """
+        super().__init__(api)
+        self.tweet_handler = tweet_handler
+        # Statuses from every other user are dropped, so the check has to be cheap
+        self.following_ids = frozenset(int(user_id) for user_id in following_ids or config["following_ids"])
+        if tweet_queue is None:
+            tweet_queue = self._build_tweet_queue()
+            tweet_queue.start()
+        self.tweet_queue = tweet_queue
+        self.supervisor = None
+        self.last_error = None
 
+    def _build_tweet_queue(self):
+        """ Creates the queue of tweets waiting to be processed.
+
+        Tweets are processed by worker threads, or by a pool of worker processes when the "worker_mode" setting is
+        "process". Worker processes are started fresh rather than forked, and forward their logs to this process, as
+        the stream shard processes do.
+
+        Returns:
+            TweetQueue: Tweet queue, not yet started.
+        """
+        if config["worker_mode"] == "process":
+            context = multiprocessing.get_context("spawn")
+            log_queue = context.Queue()
+            listen_for_logs(log_queue)
+            pool = ProcessPoolExecutor(
+                max_workers=config["tweet_workers"],
+                mp_context=context,
+                initializer=_init_worker_process,
+                initargs=(log_queue,)
+            )
+
+            def process(tweet):
+                # Workers mark tweets in their own seen stores, which the checks on the stream thread never read
+                if pool.submit(_process_tweet_json, tweet._json).result():
+                    self.tweet_handler.seen_store.mark_tweet(tweet.id)
+        else:
+            process = timed(PROCESS_SECONDS)(self.tweet_handler.process_tweet)
+
+        tweet_queue = TweetQueue(
+            process,
+            size=config["tweet_queue_size"],
+            workers=config["tweet_workers"],
+            overflow=config["tweet_queue_overflow"],
+            spill_path=config["tweet_queue_spill_path"],
+            serialize=lambda tweet: tweet._json,
+            deserialize=lambda data: tweepy.Status.parse(self.api, data),
+            report_interval=config["tweet_queue_report_interval"]
+        )
+        gauge("tweet_queue_depth", "Tweets waiting for a worker", lambda: tweet_queue.stats()["depth"])
+        gauge(
+            "tweet_queue_dropped", "Tweets dropped because the queue was full", lambda: tweet_queue.stats()["dropped"]
+        )
+        return tweet_queue
+
+    def on_connect(self):
+        """ Handles a successful connection to the stream. """
+        logger.info("Connected to API stream")
+        if self.supervisor is not None:
+            self.supervisor.connected()
+
+    @timed(ON_STATUS_SECONDS)
     def on_status(self, tweet):
         """ Handles received new statuses (tweets).
 
         This class is overridden from Tweepy StreamListener and handles what to do when a new tweet is received.
 
-        When a tweet is received from the watched user(s), it sends it to the the tweet handler for processing.
+        When a tweet is received from the watched user(s), it is put on the tweet queue for the tweet handler to
+        process, so the stream thread can go straight back to reading the socket. Tweets which have already been
+        processed, e.g. delivered again after a reconnect, and retweets of tweets which have already been processed are
+        skipped. The tweet handler marks tweets as processed, so a tweet which is dropped from the queue is not.
 
         Args:
             tweet (tweet): A tweet object containing tweet text and all metadata.
         """
         # The "follow" argument in the filter grabs all retweets and replies
         # To ensure, we only get tweets directly from the following account, apply an extra filter here
-        if str(tweet.user.id) in config["following_ids"]:
+        followed = tweet.user.id in self.following_ids
+        TWEETS_SEEN.inc("true" if followed else "false")
+        if followed:
+            seen_store = self.tweet_handler.seen_store
+            if seen_store.seen_tweet(tweet.id):
+                DUPLICATE_TWEETS.inc("id")
+                logger.debug(f"Skipping tweet id {tweet.id}, it has already been processed")
+                return
+            # A retweet has no text or photos of its own, a quote tweet does and is always processed
+            retweeted = getattr(tweet, "retweeted_status", None)
+            if retweeted is not None and seen_store.seen_tweet(retweeted.id):
+                DUPLICATE_TWEETS.inc("retweet")
+                logger.debug(f"Skipping tweet id {tweet.id}, it retweets processed tweet id {retweeted.id}")
+                return
             logger.info(f"Processing tweet id {tweet.id} from {tweet.user.screen_name}")
             logger.info(f"Tweet text: {tweet.text}")
-            self.tweet_handler.process_tweet(tweet)
+            self.tweet_queue.put(tweet)
 
     def on_exception(self, exception):
         """ Handles exceptions encountered.
 
+        The stream stops after an exception, the supervisor then reconnects.
+
         Args:
             exception: Exception message.
 
         """
         logger.warning(f"An exception was found: {exception}")
-        logger.info(f"Restarting API stream")
-        main()
+        self.last_error = exception
 
     def on_error(self, status):
         """ Handles errors received on the web socket.
 
+        Disconnects, so the supervisor can reconnect with the backoff suited to the error.
+
         Args:
             status: Error status code.
 
+        Returns:
+            bool: False, to stop the stream.
+
         """
         if str(status) == "401":
             logger.warning("Incomplete read error at Twitter endpoint, will reconnect now.")
         elif str(status) == "420":
-            logger.warning("Twitter API Rate Limit Exceeded, sleeping for 1 minute.")
-            time.sleep(1 * 60)
+            logger.warning("Twitter API Rate Limit Exceeded, backing off before reconnecting.")
         #else:
         #    logger.error(status)
 
-        logger.info("Restarting API stream")
-        main()
+        self.last_error = int(status)
+        return False
+
+
+def split_following_ids(following_ids, shards):
+    """ Splits the followed user ids between stream shards.
+
+    Args:
+        following_ids (list of str): Ids of the followed users.
+        shards (int): Number of shards wanted.
+
+    Returns:
+        list of list of str: Ids followed by each shard, fewer shards are returned if there are not enough ids.
+    """
+    shards = max(1, min(shards, len(following_ids)))
+    return [following_ids[index::shards] for index in range(shards)]
+
+
+def run_streams(api, tweet_handler, shards):
+    """ Runs a stream connection for each shard in this process.
+
+    The streams share the tweet handler and the tweet queue, each is kept connected by its own supervisor.
+
+    Args:
+        api (API): Tweepy API instance.
+        tweet_handler (TweetHandler): Tweet handler instance.
+        shards (list of list of str): Ids followed by each stream.
+    """
+    supervisors = []
+    tweet_queue = None
+    for following_ids in shards:
+        tweets_listener = CryptoTweetListener(api, tweet_handler, following_ids, tweet_queue)
+        tweet_queue = tweets_listener.tweet_queue
+        supervisor = StreamSupervisor(api, tweets_listener, following_ids, host=config["twitter_stream_host"])
+        tweets_listener.supervisor = supervisor
+        supervisors.append(supervisor)
+
+    for index, supervisor in enumerate(supervisors[1:], 1):
+        threading.Thread(target=supervisor.run, name=f"stream-{index}", daemon=True).start()
+    supervisors[0].run()
+
+
+def _run_shard_process(index, following_ids, log_queue):
+    """ Runs a stream shard in its own process, with its own tweet handler.
+
+    Everything logged, including alerts, is forwarded to the parent process.
+
+    Args:
+        index (int): Shard number.
+        following_ids (list of str): Ids followed by the shard.
+        log_queue (multiprocessing.Queue): Queue read by the parent process.
+    """
+    forward_logs(log_queue, logger, tweet_logger, possible_tweet_logger)
+    install_signal_handlers()
+    if config["tweet_queue_spill_path"]:
+        # Every shard needs its own spill file
+        config["tweet_queue_spill_path"] += f".{index}"
+
+    api = twitter_api()
+    tweet_handler = TweetHandler()
+    watch_keywords(tweet_handler)
+    run_streams(api, tweet_handler, [following_ids])
+
+
+def run_shard_processes(shards, check_interval=5):
+    """ Runs each stream shard in its own process, restarting any which exit.
+
+    Args:
+        shards (list of list of str): Ids followed by each shard.
+        check_interval (float): Seconds between checks that the processes are still running.
+    """
+    context = multiprocessing.get_context("spawn")
+    log_queue = context.Queue()
+    listen_for_logs(log_queue)
+
+    processes = {}
+    try:
+        while True:
+            for index, following_ids in enumerate(shards):
+                process = processes.get(index)
+                if process is not None and process.is_alive():
+                    continue
+                if process is not None:
+                    logger.warning(f"Stream shard {index} exited with code {process.exitcode}, restarting")
+                process = context.Process(
+                    target=_run_shard_process, args=(index, following_ids, log_queue), name=f"stream-shard-{index}"
+                )
+                process.start()
+                processes[index] = process
+                logger.info(f"Started stream shard {index} following {len(following_ids)} user(s)")
+            time.sleep(check_interval)
+    finally:
+        for process in processes.values():
+            process.terminate()
 
 
 def main():
-    """ Main function for running the bot. """
+    """ Main function for running the bot.
+
+    The API client, tweet handler and listener are created once, the supervisor then keeps the stream connected.
+
+    The followed users can be split between several stream connections with the "stream_shards" setting. The shards
+    run on threads sharing one tweet handler, or in "process" mode in their own processes with their own tweet
+    handlers, so matching is spread across cores. Alerts from every shard are sent by this process.
+
+    With the "run_mode" setting set to "asyncio", every shard's stream and every tweet run as tasks on one event loop
+    instead, see async_stream.
+    """
     logger.info("Starting Twitter feed listener")
-    tweets_listener = CryptoTweetListener()
-    stream = tweepy.Stream(tweets_listener.api.auth, tweets_listener)
-    stream.filter(follow=config["following_ids"])
+    if config["metrics_port"]:
+        start_http_server(config["metrics_port"], config["metrics_host"])
+        logger.info(f"Serving metrics on {config['metrics_host']}:{config['metrics_port']}/metrics")
+    if config["metrics_summary_interval"]:
+        start_summary(logger, config["metrics_summary_interval"])
+    install_signal_handlers()
+
+    shards = split_following_ids(config["following_ids"], config["stream_shards"])
+    if config["run_mode"] == "asyncio":
+        import asyncio
+        from async_stream import run_async
+
+        tweet_handler = TweetHandler()
+        watch_keywords(tweet_handler)
+        asyncio.run(run_async(tweet_handler, shards))
+        return
+
+    if len(shards) > 1 and config["stream_shard_mode"] == "process":
+        run_shard_processes(shards)
+        return
+
+    api = twitter_api()
+    tweet_handler = TweetHandler()
+    watch_keywords(tweet_handler)
+    run_streams(api, tweet_handler, shards)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,321 @@
+""" Compiled keyword matcher.
+
+Builds a single Aho-Corasick automaton from a list of keywords, so text can be scanned for every keyword in one
+pass rather than running a separate fuzzy search for each keyword.
+
+    * Short keywords (4 characters or fewer) must match exactly, these are added to the automaton as they are.
+    * Longer keywords may match within a Levenshtein distance of 1. Any such match must contain one half of the
+      keyword exactly (pigeonhole principle), so both halves are added to the automaton as "seeds". When a seed is
+      found, only the small window of text around it is checked with an edit distance calculation.
+
+Every match contains at least one of the patterns added to the automaton, so the patterns are also compiled into a
+regular expression used as a pre-filter. Most tweets contain none of them, and are rejected by the regular expression
+engine without walking the automaton character by character in Python.
+
+Matches are returned as fuzzysearch Match objects, so they can be used anywhere the output of find_near_matches was.
+
+"""
+
+import re
+from collections import deque
+from fuzzysearch.common import Match
+
+from metrics import counter
+
+PREFILTER = counter("prefilter_total", "Texts checked by the keyword pre-filter", ["list", "result"])
+
+
+def resolve_overlaps(matches):
+    """ Resolves overlapping matches, keeping the longest match from each overlapping group.
+
+    For example, the text "I like cryptocurrency" could trigger keywords for "crypto" and "cryptocurrency".
+
+    Matches are sorted once and then swept from left to right, so every occurrence is kept unless a longer match
+    overlaps it.
+
+    Args:
+        matches (list of Match): List of keyword Matches, in any order.
+
+    Returns:
+        list of Match: Non-overlapping Matches ordered by position.
+    """
+    resolved = []
+    for match in sorted(matches, key=lambda m: (m.start, m.start - m.end)):
+        if resolved and match.start < resolved[-1].end:
+            # Overlaps the previous match, keep whichever is longer
+            previous = resolved[-1]
+            if match.end - match.start > previous.end - previous.start:
+                resolved[-1] = match
+        else:
+            resolved.append(match)
+    return resolved
+
+
+def trie_pattern(patterns):
+    """ Builds a regular expression matching any of the patterns.
+
+    The patterns are arranged in a trie so common prefixes are only tried once, e.g. "bitcoin" and "bitcoins" become
+    "bitcoins?".
+
+    Args:
+        patterns (iterable of str): Literal strings.
+
+    Returns:
+        str: Regular expression, which never matches if there are no patterns.
+    """
+    trie = {}
+    for pattern in patterns:
+        node = trie
+        for char in pattern:
+            node = node.setdefault(char, {})
+        node[""] = {}
+
+    def build(node):
+        optional = "" in node
+        branches = [re.escape(char) + build(child) for char, child in sorted(node.items()) if char]
+        if not branches:
+            return ""
+        body = branches[0] if len(branches) == 1 else "(?:" + "|".join(branches) + ")"
+        if optional:
+            return body + "?" if len(branches) == 1 and len(branches[0]) == 1 else "(?:" + body + ")?"
+        return body
+
+    if not trie:
+        return "(?!)"
+    return build(trie)
+
+
+def max_l_dist(keyword):
+    """ Gets the maximum Levenshtein distance allowed for a keyword.
+
+    Args:
+        keyword (str): Keyword to be matched.
+
+    Returns:
+        int: Maximum number of edits allowed for a match.
+    """
+    if len(keyword) > 4:
+        return 1
+    return 0
+
+
+class KeywordMatcher:
+    """ Multi-pattern keyword matcher.
+
+    Attributes:
+        keywords (list of str): List of keywords compiled into the matcher.
+        name (str): Name of the keyword list, used in metrics.
+    """
+
+    def __init__(self, keywords, name="keywords"):
+        """ Compiles the keywords into an Aho-Corasick automaton.
+
+        Args:
+            keywords (list of str): List of keywords to search for.
+            name (str): Name of the keyword list, used in metrics.
+        """
+        self.keywords = list(keywords)
+        self.name = name
+
+        # Trie, each node is a dict of character -> child node
+        self._patterns = set()
+        self._goto = [{}]
+        self._fail = [0]
+        self._output = [[]]
+
+        for index, keyword in enumerate(self.keywords):
+            distance = max_l_dist(keyword)
+            if distance == 0:
+                self._add_pattern(keyword, (index, None, 0))
+            else:
+                # Split the keyword into distance + 1 pieces, a match must contain at least one of them exactly
+                size = len(keyword) // (distance + 1)
+                for piece in range(distance + 1):
+                    offset = piece * size
+                    end = len(keyword) if piece == distance else offset + size
+                    self._add_pattern(keyword[offset:end], (index, offset, distance))
+
+        self._build_fail_links()
+        self._prefilter = re.compile(trie_pattern(self._patterns))
+
+    def _add_pattern(self, pattern, output):
+        """ Adds a pattern to the trie.
+
+        Args:
+            pattern (str): String to be found in the text.
+            output (tuple): Keyword index, offset of the pattern in the keyword (None for exact keywords) and
+                maximum distance.
+        """
+        self._patterns.add(pattern)
+        state = 0
+        for char in pattern:
+            next_state = self._goto[state].get(char)
+            if next_state is None:
+                next_state = len(self._goto)
+                self._goto[state][char] = next_state
+                self._goto.append({})
+                self._fail.append(0)
+                self._output.append([])
+            state = next_state
+        self._output[state].append((len(pattern),) + output)
+
+    def _build_fail_links(self):
+        """ Builds failure links with a breadth first walk of the trie. """
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self._goto[state].items():
+                queue.append(next_state)
+                fail = self._fail[state]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[next_state] = self._goto[fail].get(char, 0)
+                self._output[next_state] = self._output[next_state] + self._output[self._fail[next_state]]
+
+    def _verify(self, keyword, text, start, end, distance):
+        """ Finds approximate matches for a keyword in a window of text.
+
+        Uses Sellers' algorithm, where a match may begin anywhere in the window.
+
+        Args:
+            keyword (str): Keyword to be matched.
+            text (str): Text being scanned.
+            start (int): Start of the window in the text.
+            end (int): End of the window in the text.
+            distance (int): Maximum Levenshtein distance.
+
+        Returns:
+            list of Match: The best match from each group of adjacent candidate end positions.
+        """
+        window = text[start:end]
+
+        # Each cell holds (cost, start of the match in the window)
+        previous = [(0, j) for j in range(len(window) + 1)]
+        for i, char in enumerate(keyword, 1):
+            current = [(i, 0)]
+            for j, text_char in enumerate(window, 1):
+                cost, origin = previous[j - 1]
+                best = (cost + (char != text_char), origin)
+                cost, origin = previous[j]
+                best = min(best, (cost + 1, origin))
+                cost, origin = current[j - 1]
+                best = min(best, (cost + 1, origin))
+                current.append(best)
+            previous = current
+
+        matches = []
+        group = None
+        for j in range(1, len(window) + 1):
+            cost, origin = previous[j]
+            if cost > distance or origin == j:
+                if group:
+                    matches.append(group)
+                group = None
+                continue
+            # Prefer the lowest cost, then the longest match
+            candidate = (cost, origin - j, origin, j)
+            if group is None or candidate < group:
+                group = candidate
+        if group:
+            matches.append(group)
+
+        return [Match(start + origin, start + j, cost, text[start + origin:start + j]) for cost, _, origin, j in matches]
+
+    def might_match(self, text):
+        """ Checks whether the text contains any of the patterns, without which no keyword can match.
+
+        Args:
+            text (str): Text to be scanned.
+
+        Returns:
+            bool: False if no keyword can match the text.
+        """
+        return self._prefilter.search(text) is not None
+
+    def scan(self, text):
+        """ Scans the text for all keywords in a single pass.
+
+        Args:
+            text (str): Text to be scanned.
+
+        Returns:
+            list of (int, Match): Keyword index and Match for every occurrence found, ordered by position.
+        """
+        if not self.might_match(text):
+            PREFILTER.inc(self.name, "reject")
+            return []
+        PREFILTER.inc(self.name, "pass")
+
+        found = []
+        windows = {}
+        state = 0
+        goto = self._goto
+        fail = self._fail
+        output = self._output
+
+        for position, char in enumerate(text):
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            for length, index, offset, distance in output[state]:
+                if offset is None:
+                    start = position + 1 - length
+                    found.append((index, Match(start, position + 1, 0, text[start:position + 1])))
+                else:
+                    # Position where the keyword would start if this piece matched at its offset
+                    keyword_start = position + 1 - length - offset
+                    window = (
+                        max(keyword_start - distance, 0),
+                        min(keyword_start + len(self.keywords[index]) + distance, len(text))
+                    )
+                    windows.setdefault(index, []).append(window)
+
+        for index, keyword_windows in windows.items():
+            keyword = self.keywords[index]
+            distance = max_l_dist(keyword)
+            keyword_windows.sort()
+            start, end = keyword_windows[0]
+            for next_start, next_end in keyword_windows[1:]:
+                if next_start <= end:
+                    end = max(end, next_end)
+                    continue
+                found.extend((index, match) for match in self._verify(keyword, text, start, end, distance))
+                start, end = next_start, next_end
+            found.extend((index, match) for match in self._verify(keyword, text, start, end, distance))
+
+        found.sort(key=lambda item: (item[1].start, item[1].end, item[0]))
+        return found
+
+
+class KeywordState:
+    """ Compiled keyword lists.
+
+    Built in full before being used, so it can be swapped in as a whole when the keywords change.
+
+    Attributes:
+        keywords (list of str): List of definite crypto keywords.
+        possible_keywords (list of str): List of possible crypto keywords.
+        possible_objects (list of str): List of possible image objects.
+        keyword_matcher (KeywordMatcher): Compiled matcher for the definite keywords.
+        possible_keyword_matcher (KeywordMatcher): Compiled matcher for the possible keywords.
+        possible_object_matcher (KeywordMatcher): Compiled matcher for the possible image objects.
+        lists (tuple of list of str): The three keyword lists, in the order of results.LISTS.
+        matchers (tuple of KeywordMatcher): The three matchers, in the same order.
+    """
+
+    def __init__(self, keywords, possible_keywords, possible_objects):
+        """ Compiles the keyword lists.
+
+        Args:
+            keywords (list of str): List of definite crypto keywords.
+            possible_keywords (list of str): List of possible crypto keywords.
+            possible_objects (list of str): List of possible image objects.
+        """
+        self.keywords = list(keywords)
+        self.possible_keywords = list(possible_keywords)
+        self.possible_objects = list(possible_objects)
+        self.keyword_matcher = KeywordMatcher(self.keywords, "keywords")
+        self.possible_keyword_matcher = KeywordMatcher(self.possible_keywords, "possible_keywords")
+        self.possible_object_matcher = KeywordMatcher(self.possible_objects, "possible_objects")
+        self.lists = (self.keywords, self.possible_keywords, self.possible_objects)
+        self.matchers = (self.keyword_matcher, self.possible_keyword_matcher, self.possible_object_matcher)
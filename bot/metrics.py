@@ -0,0 +1,434 @@
+""" Lightweight metrics for the hot path.
+
+Counters, gauges and histograms cheap enough to stay enabled in production, they only take a lock and bump a few
+numbers. Metrics can be scraped in the Prometheus text format from a local HTTP endpoint, and/or summarised to a
+logger periodically.
+
+Usage:
+
+    tweets_seen = counter("tweets_seen_total", "Statuses received from the stream")
+    scan_seconds = histogram("scan_seconds", "Time spent scanning text", ["list"])
+
+    tweets_seen.inc()
+    with scan_seconds.time("keywords"):
+        ...
+
+    @timed(scan_seconds, "possible_keywords")
+    def scan():
+        ...
+
+"""
+
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from functools import wraps
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Histogram bucket upper bounds in seconds, from 100 microseconds to 30 seconds
+DEFAULT_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+_registry = {}
+_registry_lock = threading.Lock()
+
+
+def _format_labels(names, values, extra=None):
+    """ Formats label names and values in the Prometheus text format.
+
+    Args:
+        names (tuple of str): Label names.
+        values (tuple of str): Label values.
+        extra (tuple of str): Extra label name and value, e.g. ("le", "0.5").
+
+    Returns:
+        str: Labels in braces, or an empty string if there are none.
+    """
+    pairs = list(zip(names, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{value}"' for name, value in pairs) + "}"
+
+
+class _Metric:
+    """ Base class for metrics, a value is held for each combination of label values.
+
+    Attributes:
+        name (str): Metric name.
+        help (str): Description of the metric.
+        label_names (tuple of str): Names of the labels.
+    """
+
+    type = None
+
+    def __init__(self, name, help, label_names=()):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(label_names)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def _key(self, labels):
+        """ Converts label values to a dictionary key.
+
+        Args:
+            labels (tuple): Label values, in the same order as the label names.
+
+        Returns:
+            tuple of str: Label values.
+        """
+        if len(labels) != len(self.label_names):
+            raise ValueError(f"{self.name} expects labels {self.label_names}")
+        return tuple(str(label) for label in labels)
+
+    def render(self):
+        """ Renders the metric in the Prometheus text format.
+
+        Returns:
+            list of str: Lines of output.
+        """
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"]
+        with self._lock:
+            values = dict(self._values)
+        for labels, value in sorted(values.items()):
+            lines.append(f"{self.name}{_format_labels(self.label_names, labels)} {value}")
+        return lines
+
+    def summary(self):
+        """ Summarises the metric in a single line.
+
+        Returns:
+            str: Summary, or None if nothing has been recorded.
+        """
+        with self._lock:
+            values = dict(self._values)
+        if not values:
+            return None
+        return f"{self.name}: " + ", ".join(
+            f"{'/'.join(labels) or 'total'}={value}" for labels, value in sorted(values.items())
+        )
+
+
+class Counter(_Metric):
+    """ Count which only goes up. """
+
+    type = "counter"
+
+    def inc(self, *labels, amount=1):
+        """ Increments the counter.
+
+        Args:
+            *labels: Label values.
+            amount (int): Amount to add.
+        """
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, *labels):
+        """ Gets the current count.
+
+        Args:
+            *labels: Label values.
+
+        Returns:
+            int: Count, 0 if nothing has been counted.
+        """
+        key = self._key(labels)
+        with self._lock:
+            return self._values.get(key, 0)
+
+
+class Gauge(_Metric):
+    """ Value read from a function whenever the metric is rendered, e.g. a queue depth. """
+
+    type = "gauge"
+
+    def __init__(self, name, help, function):
+        """ Initialises the gauge.
+
+        Args:
+            name (str): Metric name.
+            help (str): Description of the metric.
+            function (callable): Returns the current value.
+        """
+        super().__init__(name, help)
+        self.function = function
+
+    def _read(self):
+        """ Reads the current value from the function, under the lock like every other write to the values. """
+        value = self.function()
+        with self._lock:
+            self._values = {(): value}
+
+    def render(self):
+        self._read()
+        return super().render()
+
+    def summary(self):
+        self._read()
+        return super().summary()
+
+
+class Histogram(_Metric):
+    """ Distribution of observed values, e.g. durations in seconds. """
+
+    type = "histogram"
+
+    def __init__(self, name, help, label_names=(), buckets=DEFAULT_BUCKETS):
+        """ Initialises the histogram.
+
+        Args:
+            name (str): Metric name.
+            help (str): Description of the metric.
+            label_names (tuple of str): Names of the labels.
+            buckets (tuple of float): Bucket upper bounds, in increasing order.
+        """
+        super().__init__(name, help, label_names)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, *labels):
+        """ Records a value.
+
+        Args:
+            value (float): Observed value.
+            *labels: Label values.
+        """
+        key = self._key(labels)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                # Bucket counts (the last is for values above every bucket), count and sum
+                entry = self._values[key] = [[0] * (len(self.buckets) + 1), 0, 0.0]
+            entry[0][index] += 1
+            entry[1] += 1
+            entry[2] += value
+
+    @contextmanager
+    def time(self, *labels):
+        """ Times a block of code.
+
+        Args:
+            *labels: Label values.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, *labels)
+
+    def _snapshot(self):
+        """ Copies the recorded values.
+
+        Returns:
+            dict: Label values -> (bucket counts, count, sum).
+        """
+        with self._lock:
+            return {labels: (list(entry[0]), entry[1], entry[2]) for labels, entry in self._values.items()}
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"]
+        for labels, (counts, count, total) in sorted(self._snapshot().items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += bucket_count
+                lines.append(
+                    f"{self.name}_bucket{_format_labels(self.label_names, labels, ('le', bound))} {cumulative}"
+                )
+            lines.append(f"{self.name}_count{_format_labels(self.label_names, labels)} {count}")
+            lines.append(f"{self.name}_sum{_format_labels(self.label_names, labels)} {total}")
+        return lines
+
+    def quantile(self, fraction, *labels):
+        """ Estimates a quantile from the buckets.
+
+        Args:
+            fraction (float): Quantile as a fraction, e.g. 0.95.
+            *labels: Label values.
+
+        Returns:
+            float: Upper bound of the bucket holding the quantile, or None if nothing has been recorded.
+        """
+        entry = self._snapshot().get(self._key(labels))
+        if entry is None or not entry[1]:
+            return None
+        counts, count, _ = entry
+        cumulative = 0
+        for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+            cumulative += bucket_count
+            if cumulative >= fraction * count:
+                return bound
+
+    def summary(self):
+        snapshot = self._snapshot()
+        if not snapshot:
+            return None
+        parts = []
+        for labels, (_, count, total) in sorted(snapshot.items()):
+            p50 = self.quantile(0.5, *labels)
+            p99 = self.quantile(0.99, *labels)
+            parts.append(
+                f"{'/'.join(labels) or 'total'}: n={count} mean={total / count * 1000:.1f}ms "
+                f"p50<={p50 * 1000:g}ms p99<={p99 * 1000:g}ms"
+            )
+        return f"{self.name}: " + ", ".join(parts)
+
+
+def _register(metric):
+    """ Adds a metric to the registry, returning the existing metric if one has the same name.
+
+    Args:
+        metric (_Metric): Metric to register.
+
+    Returns:
+        _Metric: Registered metric.
+    """
+    with _registry_lock:
+        return _registry.setdefault(metric.name, metric)
+
+
+def counter(name, help, label_names=()):
+    """ Gets or creates a counter.
+
+    Args:
+        name (str): Metric name.
+        help (str): Description of the metric.
+        label_names (list of str): Names of the labels.
+
+    Returns:
+        Counter: Registered counter.
+    """
+    return _register(Counter(name, help, label_names))
+
+
+def gauge(name, help, function):
+    """ Gets or creates a gauge.
+
+    If a gauge with the same name is already registered, it reads from the new function from then on, so a gauge
+    reports on the object created last, e.g. a TweetHandler replacing an earlier one, rather than on one which is no
+    longer used.
+
+    Args:
+        name (str): Metric name.
+        help (str): Description of the metric.
+        function (callable): Returns the current value.
+
+    Returns:
+        Gauge: Registered gauge.
+    """
+    registered = _register(Gauge(name, help, function))
+    registered.function = function
+    return registered
+
+
+def histogram(name, help, label_names=(), buckets=DEFAULT_BUCKETS):
+    """ Gets or creates a histogram.
+
+    Args:
+        name (str): Metric name.
+        help (str): Description of the metric.
+        label_names (list of str): Names of the labels.
+        buckets (tuple of float): Bucket upper bounds, in increasing order.
+
+    Returns:
+        Histogram: Registered histogram.
+    """
+    return _register(Histogram(name, help, label_names, buckets))
+
+
+def timed(histogram, *labels):
+    """ Decorator which times every call of a function.
+
+    Args:
+        histogram (Histogram): Histogram to record the durations in.
+        *labels: Label values.
+
+    Returns:
+        callable: Decorator.
+    """
+
+    def decorator(function):
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            with histogram.time(*labels):
+                return function(*args, **kwargs)
+        return wrapper
+
+    return decorator
+
+
+def render():
+    """ Renders every metric in the Prometheus text format.
+
+    Returns:
+        str: Metrics text.
+    """
+    with _registry_lock:
+        metrics = list(_registry.values())
+    lines = []
+    for metric in metrics:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+def summary():
+    """ Summarises every metric which has recorded something.
+
+    Returns:
+        str: One line per metric.
+    """
+    with _registry_lock:
+        metrics = list(_registry.values())
+    return "\n".join(line for line in (metric.summary() for metric in metrics) if line)
+
+
+def start_http_server(port, host="127.0.0.1"):
+    """ Serves the metrics at /metrics from a background thread.
+
+    Args:
+        port (int): Port to listen on.
+        host (str): Address to listen on.
+
+    Returns:
+        ThreadingHTTPServer: The running server.
+    """
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = render().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+    return server
+
+
+def start_summary(logger, interval):
+    """ Logs a summary of every metric periodically, from a background thread.
+
+    Args:
+        logger (Logger): Logger to send the summary to.
+        interval (float): Seconds between summaries.
+    """
+
+    def report():
+        while True:
+            time.sleep(interval)
+            text = summary()
+            if text:
+                logger.info(f"Metrics summary:\n{text}")
+
+    threading.Thread(target=report, name="metrics-summary", daemon=True).start()
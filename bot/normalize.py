@@ -0,0 +1,160 @@
+""" Text normalization for keyword scanning.
+
+Tweet text is normalized once, before any keyword list is scanned:
+
+    * Handles and links are replaced by a space, so keywords inside them are not matched.
+    * HTML entities, e.g. "&amp;", are decoded.
+    * Text is lower cased, accents are removed and compatibility characters are folded, e.g. "Ｂ" becomes "b".
+    * Look-alike letters from other scripts are folded, e.g. the Cyrillic "о" or Canadian syllabics "ᗷ".
+    * Digits written in place of letters are folded, e.g. "bitc0in" becomes "bitcoin". Digits are only folded when
+      next to a letter and not another digit, so numbers are left alone.
+    * Emoji and other symbols are replaced by a space.
+
+The normalized text keeps a map back to the original text, so matches found in it can be highlighted in the original.
+
+"""
+
+import html
+import re
+import unicodedata
+
+from fuzzysearch.common import Match
+
+# Handles, links and HTML entities are handled as a whole, and runs of plain ASCII text are lower cased in one go.
+# Anything else is folded a character at a time.
+TOKEN_PATTERN = re.compile(
+    r"(?P<handle>@\w+)"
+    r"|(?P<link>https?://\S+)"
+    r"|(?P<entity>&(?:#\d+|#[xX][0-9a-fA-F]+|[A-Za-z]+);)"
+    r"|(?P<plain>(?:(?!https?://)[A-Za-z \t\r\n.,!?:;'\"()\-])+)"
+    r"|(?P<other>.)",
+    re.DOTALL
+)
+
+# Letters from other scripts which look like Latin letters
+HOMOGLYPHS = {
+    # Cyrillic
+    "а": "a", "в": "b", "е": "e", "ё": "e", "к": "k", "м": "m", "н": "h", "о": "o", "р": "p", "с": "c", "т": "t",
+    "у": "y", "х": "x", "і": "i", "ј": "j", "ѕ": "s", "ԁ": "d", "ԛ": "q", "ԝ": "w",
+    # Greek
+    "α": "a", "β": "b", "γ": "y", "ε": "e", "η": "n", "ι": "i", "κ": "k", "ν": "v", "ο": "o", "ρ": "p", "τ": "t",
+    "υ": "u", "χ": "x",
+    # Canadian syllabics and other look-alikes
+    "ᗷ": "b", "ᗩ": "a", "ᑕ": "c", "ᗪ": "d", "ᗴ": "e", "ᑎ": "n", "ᑭ": "p", "ᔕ": "s", "ᑌ": "u", "ᐯ": "v", "ᗯ": "w",
+    "ł": "l", "ø": "o", "đ": "d", "ß": "ss", "ı": "i",
+}
+
+# Digits written in place of letters
+LEET = {"0": "o", "1": "i", "3": "e", "4": "a", "5": "s", "7": "t"}
+
+
+def fold(char):
+    """ Folds a single character to the lower case ASCII letters it looks like.
+
+    Args:
+        char (str): Character.
+
+    Returns:
+        str: Folded text, which may be empty (e.g. for a combining accent) or more than one character.
+    """
+    folded = HOMOGLYPHS.get(char)
+    if folded is not None:
+        return folded
+    category = unicodedata.category(char)
+    if category in ("So", "Sk", "Cs") or category.startswith("Z"):
+        return " "
+    decomposed = unicodedata.normalize("NFKD", char.lower())
+    return "".join(HOMOGLYPHS.get(part, part) for part in decomposed if not unicodedata.combining(part))
+
+
+class NormalizedText:
+    """ Normalized text, with a map back to the original text.
+
+    Attributes:
+        original (str): Original text.
+        text (str): Normalized text, which is scanned for keywords.
+    """
+
+    def __init__(self, original, text, starts, ends):
+        """ Initialises the normalized text, normally created by normalize().
+
+        Args:
+            original (str): Original text.
+            text (str): Normalized text.
+            starts (list of int): Start in the original text of the characters each normalized character came from.
+            ends (list of int): End in the original text of the characters each normalized character came from.
+        """
+        self.original = original
+        self.text = text
+        self._starts = starts
+        self._ends = ends
+
+    def original_span(self, start, end):
+        """ Moves a span of the normalized text onto the original text.
+
+        Args:
+            start (int): Start of the span in the normalized text.
+            end (int): End of the span in the normalized text.
+
+        Returns:
+            (int, int): Start and end of the span in the original text.
+        """
+        return self._starts[start], self._ends[end - 1]
+
+    def to_original(self, matches):
+        """ Moves matches found in the normalized text onto the original text.
+
+        Args:
+            matches (list of Match): Matches positioned in the normalized text.
+
+        Returns:
+            list of Match: The same matches positioned in the original text, with the original text matched.
+        """
+        original = []
+        for match in matches:
+            start = self._starts[match.start]
+            end = self._ends[match.end - 1]
+            original.append(Match(start, end, match.dist, self.original[start:end]))
+        return original
+
+
+def normalize(text):
+    """ Normalizes text for keyword scanning.
+
+    Args:
+        text (str): Original text, e.g. a tweet.
+
+    Returns:
+        NormalizedText: Normalized text and map back to the original.
+    """
+    parts = []
+    starts = []
+    ends = []
+    for token in TOKEN_PATTERN.finditer(text):
+        start, end = token.span()
+        kind = token.lastgroup
+        if kind == "plain":
+            parts.append(token.group().lower())
+            starts.extend(range(start, end))
+            ends.extend(range(start + 1, end + 1))
+            continue
+
+        if kind == "handle" or kind == "link":
+            folded = " "
+        elif kind == "entity":
+            folded = "".join(fold(char) for char in html.unescape(token.group()))
+        else:
+            char = token.group()
+            folded = LEET.get(char)
+            if folded is not None:
+                neighbours = text[start - 1:start] + text[end:end + 1]
+                if not any(neighbour.isalpha() for neighbour in neighbours) or any(
+                    neighbour.isdigit() for neighbour in neighbours
+                ):
+                    folded = None
+            if folded is None:
+                folded = fold(char)
+        parts.append(folded)
+        starts.extend([start] * len(folded))
+        ends.extend([end] * len(folded))
+    return NormalizedText(text, "".join(parts), starts, ends)
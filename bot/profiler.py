@@ -0,0 +1,306 @@
+""" On-demand profiling of the running bot.
+
+Two kinds of profile can be taken without restarting the bot, by sending it a signal:
+
+    * SIGUSR1: Samples the stack of every thread (the stream listeners, tweet workers, image workers and Discord
+      senders) for "profile_seconds", then writes the samples in the collapsed stack format, one line per distinct
+      stack with the number of times it was seen. Sampling only reads the stacks from a background thread, so the
+      bot carries on at close to full speed. The file can be turned into a flame graph, e.g. with flamegraph.pl or
+      speedscope.
+    * SIGUSR2: Traces TweetHandler.process_tweet calls for "profile_seconds" with cProfile, and keeps the profiles of
+      calls which took longer than "profile_trace_threshold" seconds. They are merged and written as a pstats file,
+      which can be read with "python -m pstats". Tracing slows each call down, so the threshold applies to the traced
+      duration.
+
+Files are written to "profile_dir", and their paths are logged. Only one profile runs at a time.
+
+Usage:
+
+    kill -USR1 <pid>
+    docker kill --signal USR2 <container>
+
+"""
+
+import os
+import re
+import signal
+import sys
+import threading
+import time
+from collections import Counter
+from functools import wraps
+
+from config import config, logger
+
+# Trailing worker numbers, so e.g. the stacks of every image worker are merged
+THREAD_NUMBER_PATTERN = re.compile(r"[-_]?\d+$")
+
+# Only one profile runs at a time
+_session_lock = threading.Lock()
+# Tracer for process_tweet calls, set while a trace is running
+_tracer = None
+
+
+class SamplingProfiler:
+    """ Sampling profiler for every thread in the process.
+
+    Attributes:
+        interval (float): Seconds between samples.
+        samples (Counter): Collapsed stack -> number of times it was seen.
+        sample_count (int): Number of times the stacks were sampled.
+    """
+
+    def __init__(self, interval=0.01):
+        """ Initialises the profiler.
+
+        Args:
+            interval (float): Seconds between samples.
+        """
+        self.interval = interval
+        self.samples = Counter()
+        self.sample_count = 0
+
+    def sample(self, ignore=()):
+        """ Records the current stack of every thread.
+
+        Args:
+            ignore (tuple of int): Idents of threads which are not sampled.
+        """
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        for ident, frame in sys._current_frames().items():
+            if ident in ignore:
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            stack.append(THREAD_NUMBER_PATTERN.sub("", names.get(ident, "unknown")))
+            self.samples[";".join(reversed(stack))] += 1
+        self.sample_count += 1
+
+    def run(self, seconds):
+        """ Samples every thread but this one until the time is up.
+
+        Args:
+            seconds (float): Seconds to sample for.
+        """
+        ignore = (threading.get_ident(),)
+        deadline = time.monotonic() + seconds
+        while time.monotonic() < deadline:
+            self.sample(ignore)
+            time.sleep(self.interval)
+
+    def dump(self, path):
+        """ Writes the samples in the collapsed stack format.
+
+        Args:
+            path (str): Path of the file.
+        """
+        with open(path, "w") as file:
+            for stack, count in self.samples.most_common():
+                file.write(f"{stack} {count}\n")
+
+
+class CallTracer:
+    """ Profiles calls with cProfile, keeping the profiles of slow calls.
+
+    Attributes:
+        threshold (float): Seconds a call has to take for its profile to be kept.
+        calls (int): Number of calls traced.
+        slow_calls (int): Number of calls which took longer than the threshold.
+    """
+
+    def __init__(self, threshold):
+        """ Initialises the tracer.
+
+        Args:
+            threshold (float): Seconds a call has to take for its profile to be kept.
+        """
+        self.threshold = threshold
+        self.calls = 0
+        self.slow_calls = 0
+        self._stats = None
+        self._lock = threading.Lock()
+        # cProfile profiles a single thread, so only the outermost traced call on each thread is profiled
+        self._local = threading.local()
+
+    def call(self, function, *args, **kwargs):
+        """ Calls a function, profiling it.
+
+        Args:
+            function (callable): Function to call.
+            *args: Arguments for the function.
+            **kwargs: Keyword arguments for the function.
+
+        Returns:
+            The result of the function.
+        """
+        if getattr(self._local, "active", False):
+            return function(*args, **kwargs)
+
+        import cProfile
+        import pstats
+
+        profile = cProfile.Profile()
+        self._local.active = True
+        start = time.perf_counter()
+        try:
+            return profile.runcall(function, *args, **kwargs)
+        finally:
+            duration = time.perf_counter() - start
+            self._local.active = False
+            with self._lock:
+                self.calls += 1
+                if duration >= self.threshold:
+                    self.slow_calls += 1
+                    if self._stats is None:
+                        self._stats = pstats.Stats(profile)
+                    else:
+                        self._stats.add(profile)
+
+    def dump(self, path):
+        """ Writes the merged profiles of the slow calls in the pstats format.
+
+        Args:
+            path (str): Path of the file.
+
+        Returns:
+            bool: True if there were any slow calls to write.
+        """
+        with self._lock:
+            if self._stats is None:
+                return False
+            self._stats.dump_stats(path)
+            return True
+
+
+def traced(function):
+    """ Decorator letting a method be traced by trace_for().
+
+    While no trace is running the only cost is checking for one.
+
+    Args:
+        function (callable): Function to trace.
+
+    Returns:
+        callable: Wrapped function.
+    """
+
+    @wraps(function)
+    def wrapper(*args, **kwargs):
+        tracer = _tracer
+        if tracer is None:
+            return function(*args, **kwargs)
+        return tracer.call(function, *args, **kwargs)
+
+    return wrapper
+
+
+def _output_path(kind, extension):
+    """ Builds the path of a profile file.
+
+    Args:
+        kind (str): Kind of profile, "profile" or "trace".
+        extension (str): File extension.
+
+    Returns:
+        str: Path in the profile directory, named after the process and the time.
+    """
+    directory = config["profile_dir"]
+    os.makedirs(directory, exist_ok=True)
+    return os.path.join(directory, f"{kind}-{os.getpid()}-{time.strftime('%Y%m%d-%H%M%S')}.{extension}")
+
+
+def profile_for(seconds, interval=0.01):
+    """ Samples every thread for a while, then writes the collapsed stacks.
+
+    Blocks until the profile has been written.
+
+    Args:
+        seconds (float): Seconds to sample for.
+        interval (float): Seconds between samples.
+
+    Returns:
+        str: Path of the file written, or None if another profile was already running.
+    """
+    if not _session_lock.acquire(blocking=False):
+        logger.warning("A profile is already running")
+        return None
+    try:
+        logger.info(f"Profiling every thread for {seconds}s")
+        profiler = SamplingProfiler(interval)
+        profiler.run(seconds)
+        path = _output_path("profile", "collapsed")
+        profiler.dump(path)
+        logger.info(f"Wrote {profiler.sample_count} stack samples to {path}")
+        return path
+    finally:
+        _session_lock.release()
+
+
+def trace_for(seconds, threshold):
+    """ Traces process_tweet calls for a while, then writes the profiles of the slow calls.
+
+    Blocks until the profiles have been written.
+
+    Args:
+        seconds (float): Seconds to trace for.
+        threshold (float): Seconds a call has to take for its profile to be kept.
+
+    Returns:
+        str: Path of the file written, or None if there were no slow calls or another profile was already running.
+    """
+    global _tracer
+    if not _session_lock.acquire(blocking=False):
+        logger.warning("A profile is already running")
+        return None
+    try:
+        logger.info(f"Tracing process_tweet calls slower than {threshold}s for {seconds}s")
+        tracer = CallTracer(threshold)
+        _tracer = tracer
+        time.sleep(seconds)
+        _tracer = None
+        path = _output_path("trace", "pstats")
+        if not tracer.dump(path):
+            logger.info(f"None of the {tracer.calls} traced call(s) took longer than {threshold}s")
+            return None
+        logger.info(f"Wrote profiles of {tracer.slow_calls} of {tracer.calls} traced call(s) to {path}")
+        return path
+    finally:
+        _tracer = None
+        _session_lock.release()
+
+
+def _start(target, *args):
+    """ Runs a profile on a background thread, logging any error.
+
+    Args:
+        target (callable): profile_for or trace_for.
+        *args: Arguments for the function.
+    """
+
+    def run():
+        try:
+            target(*args)
+        except Exception as e:
+            logger.error(f"Profiling failed: {e!r}")
+
+    threading.Thread(target=run, name="profiler", daemon=True).start()
+
+
+def install_signal_handlers():
+    """ Starts a profile when the process receives SIGUSR1 or a trace on SIGUSR2, using the settings.
+
+    The handlers only start a thread, so nothing is logged from inside a signal handler. Must be called from the main
+    thread. Does nothing on platforms without these signals.
+    """
+    if not hasattr(signal, "SIGUSR1"):
+        return
+    signal.signal(
+        signal.SIGUSR1, lambda signum, frame: _start(profile_for, config["profile_seconds"], config["profile_interval"])
+    )
+    signal.signal(
+        signal.SIGUSR2,
+        lambda signum, frame: _start(trace_for, config["profile_seconds"], config["profile_trace_threshold"])
+    )
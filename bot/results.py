@@ -0,0 +1,219 @@
+""" Compact results of scanning a tweet.
+
+A ScanResult holds every match found in a tweet, in its text, the text in its photos (OCR) and the labels of its
+photos, as parallel arrays of small integers rather than a Match object and keyword string per match. Keywords are
+stored as indices into the keyword lists the tweet was scanned with, and looked up only when they are needed, e.g.
+to build an alert. The result keeps the compiled keyword lists it was started with, so the photos of a tweet are
+scanned with the same lists as its text even if the keywords are reloaded in between.
+
+"""
+
+from array import array
+from collections import namedtuple
+
+# Keyword lists a match can come from, stored as their index
+LISTS = ("keywords", "possible_keywords", "possible_objects")
+KEYWORDS, POSSIBLE_KEYWORDS, POSSIBLE_OBJECTS = range(len(LISTS))
+
+# Where a match was found, stored as their index
+SOURCES = ("text", "ocr", "labels")
+TEXT, OCR, LABELS = range(len(SOURCES))
+
+# A single match, as returned by ScanResult.matches()
+ScanMatch = namedtuple("ScanMatch", ["list", "source", "image", "keyword", "start", "end", "dist"])
+
+
+class ScanResult:
+    """ Matches found in a tweet.
+
+    Matches are added as the tweet is processed, the image phase adds its matches on an image worker after the text
+    phase has finished. Call wait() before reading a result whose images may still be being analysed.
+
+    Attributes:
+        tweet_id (int): Id of the tweet.
+        state (KeywordState): Compiled keyword lists the tweet is scanned with.
+        starts (array): Start of each match, positioned in the text it was found in.
+        ends (array): End of each match.
+        keyword_ids (array): Index of each match's keyword in its keyword list.
+        distances (array): Levenshtein distance of each match.
+        lists (array): Keyword list of each match, one of KEYWORDS, POSSIBLE_KEYWORDS or POSSIBLE_OBJECTS.
+        sources (array): Where each match was found, one of TEXT, OCR or LABELS.
+        images (array): Index of the photo each match was found in, 0 for matches in the text.
+        image_urls (list of str): URLs of the photos in the tweet.
+        objects (bool): Whether objects are searched for in the photos.
+        image_future (Future): Image analysis task, None if the photos are not being analysed.
+    """
+
+    __slots__ = (
+        "tweet_id", "state", "starts", "ends", "keyword_ids", "distances", "lists", "sources", "images", "image_urls",
+        "objects", "image_future"
+    )
+
+    def __init__(self, tweet_id, state):
+        """ Initialises an empty result.
+
+        Args:
+            tweet_id (int): Id of the tweet, None if the text is not from a tweet.
+            state (KeywordState): Compiled keyword lists the tweet is scanned with.
+        """
+        self.tweet_id = tweet_id
+        self.state = state
+        self.starts = array("I")
+        self.ends = array("I")
+        self.keyword_ids = array("I")
+        self.distances = array("B")
+        self.lists = array("B")
+        self.sources = array("B")
+        self.images = array("B")
+        self.image_urls = []
+        self.objects = True
+        self.image_future = None
+
+    def __len__(self):
+        return len(self.starts)
+
+    def __repr__(self):
+        return f"ScanResult(tweet_id={self.tweet_id}, matches={list(self.matches())})"
+
+    def __getstate__(self):
+        # Only the matches are pickled, e.g. to send a result back from a worker process. The compiled keyword lists
+        # are left out, the receiver sets state to its own copy of the same lists.
+        return {name: getattr(self, name) for name in self.__slots__ if name not in ("state", "image_future")}
+
+    def __setstate__(self, data):
+        self.state = None
+        self.image_future = None
+        for name, value in data.items():
+            setattr(self, name, value)
+
+    def add(self, list_index, source, image, keyword_id, start, end, dist):
+        """ Adds a match.
+
+        Args:
+            list_index (int): Keyword list of the match.
+            source (int): Where the match was found.
+            image (int): Index of the photo the match was found in, 0 for the text.
+            keyword_id (int): Index of the keyword in its keyword list.
+            start (int): Start of the match.
+            end (int): End of the match.
+            dist (int): Levenshtein distance of the match.
+        """
+        self.starts.append(start)
+        self.ends.append(end)
+        self.keyword_ids.append(keyword_id)
+        self.distances.append(dist)
+        self.lists.append(list_index)
+        self.sources.append(source)
+        self.images.append(image)
+
+    def _keyword(self, index):
+        """ Looks up the keyword of a match.
+
+        Args:
+            index (int): Position of the match in the arrays.
+
+        Returns:
+            str: Keyword.
+        """
+        return self.state.lists[self.lists[index]][self.keyword_ids[index]]
+
+    def _indices(self, list_index=None, source=None, image=None):
+        """ Gets the positions of the matches from a keyword list, source and/or photo.
+
+        Args:
+            list_index (int): Keyword list, None for any.
+            source (int): Source, None for any.
+            image (int): Photo, None for any.
+
+        Returns:
+            list of int: Positions in the arrays.
+        """
+        return [
+            index for index in range(len(self.starts))
+            if (list_index is None or self.lists[index] == list_index)
+            and (source is None or self.sources[index] == source)
+            and (image is None or self.images[index] == image)
+        ]
+
+    def count(self, list_index=None, source=None, image=None):
+        """ Counts the matches from a keyword list, source and/or photo.
+
+        Args:
+            list_index (int): Keyword list, None for any.
+            source (int): Source, None for any.
+            image (int): Photo, None for any.
+
+        Returns:
+            int: Number of matches.
+        """
+        return len(self._indices(list_index, source, image))
+
+    def spans(self, list_index=None, source=None, image=None):
+        """ Gets the spans of the matches from a keyword list, source and/or photo.
+
+        Args:
+            list_index (int): Keyword list, None for any.
+            source (int): Source, None for any.
+            image (int): Photo, None for any.
+
+        Returns:
+            list of (int, int, int): Start, end and keyword list of each match, in the order they were found.
+        """
+        indices = self._indices(list_index, source, image)
+        return [(self.starts[index], self.ends[index], self.lists[index]) for index in indices]
+
+    def keywords(self, list_index=None, source=None, image=None):
+        """ Gets the keywords matched from a keyword list, source and/or photo.
+
+        Args:
+            list_index (int): Keyword list, None for any.
+            source (int): Source, None for any.
+            image (int): Photo, None for any.
+
+        Returns:
+            list of str: Keyword of each match.
+        """
+        return [self._keyword(index) for index in self._indices(list_index, source, image)]
+
+    def matches(self, list_index=None, source=None, image=None):
+        """ Gets the matches from a keyword list, source and/or photo.
+
+        Args:
+            list_index (int): Keyword list, None for any.
+            source (int): Source, None for any.
+            image (int): Photo, None for any.
+
+        Yields:
+            ScanMatch: Each match, with its keyword list and source by name.
+        """
+        for index in self._indices(list_index, source, image):
+            yield ScanMatch(
+                LISTS[self.lists[index]], SOURCES[self.sources[index]], self.images[index], self._keyword(index),
+                self.starts[index], self.ends[index], self.distances[index]
+            )
+
+    @property
+    def matched(self):
+        """ bool: Whether a definite keyword was matched anywhere in the tweet. """
+        return KEYWORDS in self.lists
+
+    def wait(self, timeout=None):
+        """ Waits for the photos to be analysed, if they are being analysed.
+
+        Args:
+            timeout (float): Seconds to wait, None waits for as long as it takes.
+
+        Returns:
+            ScanResult: This result, complete.
+        """
+        if self.image_future is not None:
+            self.image_future.result(timeout)
+        return self
+
+    def to_dict(self):
+        """ Converts the result to plain data, e.g. to store it as JSON.
+
+        Returns:
+            dict: Tweet id and a list of matches, each a dict of the ScanMatch fields.
+        """
+        return {"tweet_id": self.tweet_id, "matches": [match._asdict() for match in self.matches()]}
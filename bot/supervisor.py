@@ -0,0 +1,183 @@
+""" Supervisor for the Twitter stream.
+
+Keeps the stream connected, reconnecting after errors and disconnects without rebuilding the API client or tweet
+handler. Reconnects back off exponentially, with some random jitter, following Twitter's guidance:
+
+    * Network errors: Start at 250ms, doubling up to 16 seconds.
+    * HTTP errors: Start at 5 seconds, doubling up to 320 seconds.
+    * HTTP 420 (rate limited): Start at 1 minute, doubling up to 15 minutes.
+
+The backoff is reset once a connection has stayed up for a while.
+
+"""
+
+import random
+import threading
+import time
+
+import tweepy
+
+from config import logger
+
+
+class Backoff:
+    """ Jittered exponential backoff.
+
+    Attributes:
+        start (float): First delay in seconds.
+        cap (float): Maximum delay in seconds.
+        jitter (float): Fraction of the delay added at random, so reconnects are spread out.
+        attempts (int): Number of delays given since the last reset.
+    """
+
+    def __init__(self, start, cap, jitter=0.1):
+        """ Initialises the backoff.
+
+        Args:
+            start (float): First delay in seconds.
+            cap (float): Maximum delay in seconds.
+            jitter (float): Fraction of the delay added at random, so reconnects are spread out.
+        """
+        self.start = start
+        self.cap = cap
+        self.jitter = jitter
+        self.attempts = 0
+
+    def next(self):
+        """ Gets the next delay.
+
+        Returns:
+            float: Seconds to wait, never less than the start delay.
+        """
+        delay = min(self.start * 2 ** self.attempts, self.cap)
+        self.attempts += 1
+        return delay + random.uniform(0, delay * self.jitter)
+
+    def reset(self):
+        """ Starts again from the first delay. """
+        self.attempts = 0
+
+
+class StreamSupervisor:
+    """ Runs the stream, reconnecting whenever it stops.
+
+    The listener should record why the stream stopped in its "last_error" attribute, as an HTTP status code or an
+    exception, and call connected() on the supervisor when a connection is made.
+
+    Attributes:
+        api (API): Tweepy API instance, reused for every connection.
+        listener (StreamListener): Listener, reused for every connection.
+        follow (list of str): User ids to follow.
+        stable_after (float): Seconds a connection has to stay up before the backoff is reset.
+    """
+
+    def __init__(self, api, listener, follow, stable_after=60, host="stream.twitter.com", clock=time.monotonic,
+                 sleep=time.sleep):
+        """ Initialises the supervisor.
+
+        Args:
+            api (API): Tweepy API instance, reused for every connection.
+            listener (StreamListener): Listener, reused for every connection.
+            follow (list of str): User ids to follow.
+            stable_after (float): Seconds a connection has to stay up before the backoff is reset.
+            host (str): Host serving the stream, with a port if it is not the default.
+            clock (callable): Returns the current time in seconds, for measuring connections and reconnects.
+            sleep (callable): Waits for a number of seconds before reconnecting.
+        """
+        self.api = api
+        self.listener = listener
+        self.follow = follow
+        self.stable_after = stable_after
+        self.stream = tweepy.Stream(api.auth, listener, host=host)
+        self._clock = clock
+        self._sleep = sleep
+
+        self._backoffs = {
+            "network": Backoff(0.25, 16),
+            "http": Backoff(5, 320),
+            "rate_limit": Backoff(60, 15 * 60)
+        }
+        self._lock = threading.Lock()
+        self._disconnected_at = None
+        self._connected_at = None
+        self._stats = {
+            "connects": 0,
+            "reconnects": 0,
+            "network": 0,
+            "http": 0,
+            "rate_limit": 0,
+            "last_reconnect_seconds": None,
+            "max_reconnect_seconds": 0,
+            "total_reconnect_seconds": 0
+        }
+
+    def connected(self):
+        """ Records a successful connection, called by the listener. """
+        now = self._clock()
+        with self._lock:
+            self._connected_at = now
+            self._stats["connects"] += 1
+            if self._disconnected_at is not None:
+                # Time from losing the connection to getting it back
+                latency = now - self._disconnected_at
+                self._stats["reconnects"] += 1
+                self._stats["last_reconnect_seconds"] = latency
+                self._stats["max_reconnect_seconds"] = max(self._stats["max_reconnect_seconds"], latency)
+                self._stats["total_reconnect_seconds"] += latency
+                self._disconnected_at = None
+                logger.info(f"Reconnected to API stream after {latency:.1f}s")
+
+    def stats(self):
+        """ Gets reconnect statistics.
+
+        Returns:
+            dict: Counts of connections, reconnects and disconnect reasons, along with the last, maximum and mean
+                reconnect times in seconds.
+        """
+        with self._lock:
+            stats = dict(self._stats)
+        stats["mean_reconnect_seconds"] = (
+            stats["total_reconnect_seconds"] / stats["reconnects"] if stats["reconnects"] else None
+        )
+        return stats
+
+    def _reason(self, error):
+        """ Classifies why the stream stopped.
+
+        Args:
+            error: HTTP status code or exception recorded by the listener.
+
+        Returns:
+            str: Name of the backoff to use, "network", "http" or "rate_limit".
+        """
+        if isinstance(error, int):
+            return "rate_limit" if error == 420 else "http"
+        return "network"
+
+    def run(self):
+        """ Runs the stream forever. """
+        while True:
+            self.listener.last_error = None
+            try:
+                self.stream.filter(follow=self.follow)
+            except Exception as e:
+                # The listener has already been told about the exception
+                self.listener.last_error = e
+
+            now = self._clock()
+            with self._lock:
+                stable = self._connected_at is not None and now - self._connected_at >= self.stable_after
+                self._connected_at = None
+                if self._disconnected_at is None:
+                    self._disconnected_at = now
+            if stable:
+                for backoff in self._backoffs.values():
+                    backoff.reset()
+
+            reason = self._reason(self.listener.last_error)
+            delay = self._backoffs[reason].next()
+            with self._lock:
+                self._stats[reason] += 1
+            logger.info(f"Restarting API stream in {delay:.1f}s ({reason})")
+            logger.debug(f"Stream supervisor: {self.stats()}")
+            self._sleep(delay)
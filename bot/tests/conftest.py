@@ -0,0 +1,77 @@
+""" Shared set up for the tests.
+
+The bot's modules import each other by name from the bot directory, and config reads the keywords file when it is first
+imported, so both are arranged before any test module is imported. Tests run in offline mode, so nothing is sent to
+Twitter, Google or Discord.
+
+"""
+
+import itertools
+import os
+import sys
+
+import pytest
+
+BOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+sys.path.insert(0, BOT_DIR)
+os.environ["OFFLINE_MODE"] = "True"
+os.environ.setdefault("KEYWORDS_PATH", os.path.join(BOT_DIR, "keywords.json"))
+
+
+class RecordingLogger:
+    """ Stand-in for a Logger, recording every message instead of sending it.
+
+    Attributes:
+        messages (list of (str, str)): Level and text of each message.
+    """
+
+    def __init__(self):
+        self.messages = []
+
+    def info(self, message):
+        self.messages.append(("info", message))
+
+    def warning(self, message):
+        self.messages.append(("warning", message))
+
+    def error(self, message):
+        self.messages.append(("error", message))
+
+    def debug(self, message):
+        self.messages.append(("debug", message))
+
+
+@pytest.fixture
+def make_tweet():
+    """ Builds tweets in the Twitter API v1.1 format, as they arrive from the stream. """
+    import tweepy
+
+    ids = itertools.count(1000)
+
+    def make(text, photos=(), tweet_id=None, user_id=44196397):
+        tweet_id = tweet_id or next(ids)
+        media = [
+            {"id": tweet_id * 10 + index, "type": "photo", "media_url_https": url} for index, url in enumerate(photos)
+        ]
+        data = {
+            "id": tweet_id,
+            "id_str": str(tweet_id),
+            "text": text,
+            "user": {"id": user_id, "id_str": str(user_id), "screen_name": "ghost"},
+            "entities": {"hashtags": [], "urls": [], "user_mentions": [], "media": media}
+        }
+        return tweepy.Status.parse(None, data)
+
+    return make
+
+
+@pytest.fixture
+def alerts(monkeypatch):
+    """ Records the alerts sent by TweetHandler, keyed by "tweets" and "possible_tweets". """
+    import brain
+
+    loggers = {"tweets": RecordingLogger(), "possible_tweets": RecordingLogger()}
+    monkeypatch.setattr(brain, "tweet_logger", loggers["tweets"])
+    monkeypatch.setattr(brain, "possible_tweet_logger", loggers["possible_tweets"])
+    return loggers
@@ -0,0 +1,189 @@
+""" Tests for the asyncio stream connection, against the fake Twitter server, and the tweet pipeline. """
+
+import asyncio
+import ssl
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+
+import brain
+from async_stream import STATUS_ERRORS, STREAM_PATH, AsyncTweetPipeline, AsyncTwitterStream
+from config import config
+from dedup import SeenStore
+from fake_twitter import FakeTwitter
+
+USER_ID = 44196397
+
+
+@pytest.fixture(autouse=True)
+def credentials(monkeypatch):
+    """ Dummy credentials, the fake server does not check the signature. """
+    for key in ("twitter_api_key", "twitter_api_secret", "twitter_access_token", "twitter_access_token_secret"):
+        monkeypatch.setitem(config, key, "fake")
+
+
+@pytest.fixture
+def fake():
+    server = FakeTwitter([USER_ID], keep_alive=0.1, disconnect_every=2)
+    server.start()
+    yield server
+    server.stop()
+
+
+async def wait_until(condition, timeout=5):
+    """ Waits for a condition to become true, polling it from the event loop. """
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    while not condition():
+        assert loop.time() < deadline, "Timed out waiting"
+        await asyncio.sleep(0.02)
+
+
+class SlowHandler:
+    """ Stand-in for TweetHandler, whose text processing takes a while and records how many tweets run at once. """
+
+    def __init__(self, seconds=0.05):
+        self.seconds = seconds
+        self.seen_store = SeenStore()
+        self.processed = []
+        self.running = 0
+        self.most_running = 0
+        self._lock = threading.Lock()
+
+    def process_text(self, tweet):
+        with self._lock:
+            self.running += 1
+            self.most_running = max(self.most_running, self.running)
+        time.sleep(self.seconds)
+        with self._lock:
+            self.running -= 1
+            self.processed.append(tweet.id)
+        return SimpleNamespace(image_urls=[])
+
+
+async def count_connections(handle, url, seconds, **kwargs):
+    """ Runs a stream against a local server for a while, checking it keeps running.
+
+    Returns:
+        int: Connections the server accepted.
+    """
+    connections = []
+
+    async def accept(reader, writer):
+        connections.append(writer)
+        await handle(reader, writer)
+
+    server = await asyncio.start_server(accept, "127.0.0.1", 0)
+    port = server.sockets[0].getsockname()[1]
+    stream = AsyncTwitterStream([str(USER_ID)], print, url.format(port=port), **kwargs)
+    task = asyncio.create_task(stream.run())
+    await asyncio.sleep(seconds)
+    assert not task.done(), task.exception()
+    task.cancel()
+    server.close()
+    return len(connections)
+
+
+def test_stream_survives_handler_errors_and_disconnects(fake):
+    received = []
+    errors = STATUS_ERRORS.value()
+
+    def on_status(status):
+        received.append(status["id"])
+        if "boom" in status["text"]:
+            raise RuntimeError("handler failed")
+
+    async def scenario():
+        stream = AsyncTwitterStream(
+            [str(USER_ID)], on_status, f"https://{fake.host}{STREAM_PATH}", stall_timeout=5,
+            ssl_context=ssl.create_default_context(cafile=fake.certfile)
+        )
+        task = asyncio.create_task(stream.run())
+        statuses = [fake.status(USER_ID, text) for text in ("boom", "bitcoin", "doge")]
+
+        await wait_until(lambda: fake.connections == 1)
+        fake.publish(statuses[0])
+        fake.publish(statuses[1])
+        # The server closes the connection after two statuses, the stream reconnects
+        await wait_until(lambda: fake.connections == 2 and fake.disconnects == 1)
+        await asyncio.to_thread(fake.wait_for_connection, 5)
+        fake.publish(statuses[2])
+        await wait_until(lambda: len(received) == 3)
+
+        assert not task.done()
+        task.cancel()
+        return [status["id"] for status in statuses]
+
+    assert asyncio.run(scenario()) == received
+    assert STATUS_ERRORS.value() == errors + 1
+
+
+def test_stream_reconnects_after_a_truncated_chunk():
+    async def truncated(reader, writer):
+        await reader.readuntil(b"\r\n\r\n")
+        writer.write(b"HTTP/1.1 200 OK\r\nTransfer-Encoding: chunked\r\n\r\n100\r\npartial")
+        await writer.drain()
+        writer.close()
+
+    connections = asyncio.run(count_connections(truncated, "http://127.0.0.1:{port}" + STREAM_PATH, 1))
+    assert connections >= 2
+
+
+def test_stream_reconnects_when_the_connection_hangs():
+    async def silent(reader, writer):
+        await asyncio.sleep(10)
+
+    # The TLS handshake never completes, so only the connect timeout gets the stream going again
+    connections = asyncio.run(
+        count_connections(silent, "https://127.0.0.1:{port}" + STREAM_PATH, 1, connect_timeout=0.1)
+    )
+    assert connections >= 2
+
+
+def test_pipeline_writes_the_seen_store_off_the_event_loop(monkeypatch, alerts, make_tweet):
+    monkeypatch.setitem(config, "image_backend", "fixture")
+    handler = brain.TweetHandler()
+    writers = []
+    add = handler.seen_store.add
+    monkeypatch.setattr(handler.seen_store, "add", lambda *keys: writers.append(threading.get_ident()) or add(*keys))
+    tweet = make_tweet("I like BITCOIN", user_id=USER_ID)
+
+    async def scenario():
+        pipeline = AsyncTweetPipeline(handler, [str(USER_ID)])
+        pipeline.on_status(tweet._json)
+        await wait_until(lambda: handler.seen_store.seen_tweet(tweet.id))
+
+    asyncio.run(scenario())
+    assert alerts["tweets"].messages
+    assert writers and threading.get_ident() not in writers
+
+
+def test_pipeline_limits_the_tweets_processed_at_once(make_tweet):
+    handler = SlowHandler()
+    tweets = [make_tweet("I like BITCOIN", user_id=USER_ID) for _ in range(6)]
+
+    async def scenario():
+        pipeline = AsyncTweetPipeline(handler, [str(USER_ID)], text_concurrency=2)
+        for tweet in tweets:
+            pipeline.on_status(tweet._json)
+        await wait_until(lambda: len(handler.processed) == len(tweets))
+
+    asyncio.run(scenario())
+    assert handler.most_running == 2
+
+
+def test_pipeline_skips_a_tweet_delivered_again_while_it_is_processed(make_tweet):
+    handler = SlowHandler(seconds=0.2)
+    tweet = make_tweet("I like BITCOIN", user_id=USER_ID)
+
+    async def scenario():
+        pipeline = AsyncTweetPipeline(handler, [str(USER_ID)])
+        pipeline.on_status(tweet._json)
+        await asyncio.sleep(0.05)
+        pipeline.on_status(tweet._json)
+        await wait_until(lambda: not pipeline._tasks)
+
+    asyncio.run(scenario())
+    assert handler.processed == [tweet.id]
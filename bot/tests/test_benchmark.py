@@ -0,0 +1,20 @@
+""" Tests for the benchmark helpers. """
+
+from benchmark import pad_keywords, share_sizes
+
+
+def test_share_sizes_adds_up_to_the_total():
+    assert sum(share_sizes([20, 9, 4], 1000)) == 1000
+    assert share_sizes([20, 9, 4], 33) == [20, 9, 4]
+
+
+def test_share_sizes_never_shrinks_a_list():
+    assert share_sizes([20, 9, 4], 10) == [20, 9, 4]
+
+
+def test_pad_keywords_keeps_the_real_keywords():
+    padded = pad_keywords(["bitcoin", "doge"], 50)
+
+    assert len(padded) == 50
+    assert padded[:2] == ["bitcoin", "doge"]
+    assert pad_keywords(["bitcoin", "doge"], 1) == ["bitcoin", "doge"]
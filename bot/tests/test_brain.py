@@ -0,0 +1,153 @@
+""" Tests for the tweet handler. """
+
+import pickle
+
+import pytest
+
+import brain
+from config import config
+from image_analysis import FixtureAnalyser
+
+PHOTO = "https://pbs.twimg.com/media/photo.jpg"
+
+
+@pytest.fixture
+def handler(monkeypatch, alerts):
+    """ Tweet handler with the real keywords, photos answered from fixtures. """
+    monkeypatch.setitem(config, "image_backend", "fixture")
+    return brain.TweetHandler()
+
+
+def test_text_alert_is_sent_straight_away(handler, alerts, make_tweet):
+    result = handler.process_tweet(make_tweet("I like BITCOIN"))
+
+    assert result.matched
+    assert result.image_future is None
+    assert [message for _, message in alerts["tweets"].messages][0].startswith("@everyone Matched")
+
+
+def test_image_queue_is_bounded(monkeypatch, make_tweet, alerts):
+    monkeypatch.setitem(config, "image_queue_size", 1)
+    handler = brain.TweetHandler()
+    handler.image_analyser = FixtureAnalyser({PHOTO: {"text": "bitcoin"}}, latency=0.2)
+    dropped = brain.IMAGES_DROPPED.value()
+
+    first = handler.process_tweet(make_tweet("look", [PHOTO]))
+    second = handler.process_tweet(make_tweet("look again", [PHOTO]))
+
+    assert first.image_future is not None
+    assert second.image_future is None
+    assert brain.IMAGES_DROPPED.value() == dropped + 1
+
+    first.wait()
+    assert first.keywords(brain.KEYWORDS) == ["bitcoin"]
+    assert handler._images_pending == 0
+    third = handler.process_tweet(make_tweet("and again", [PHOTO])).wait()
+    assert third.keywords(brain.KEYWORDS) == ["bitcoin"]
+
+
+def test_definite_keyword_highlight_wins_over_earlier_possible_keyword(monkeypatch, alerts, make_tweet):
+    monkeypatch.setitem(config, "keywords", ["coin"])
+    monkeypatch.setitem(config, "possible_keywords", ["dogecoin"])
+    handler = brain.TweetHandler()
+    text = "buy dogecoin now"
+
+    result = handler.process_tweet(make_tweet(text))
+
+    assert result.keywords(brain.KEYWORDS) == ["coin"]
+    assert result.keywords(brain.POSSIBLE_KEYWORDS) == ["dogecoin"]
+    assert handler.highlight_keywords(text, result) == "buy doge__**coin**__ now"
+
+
+def test_tweets_are_only_marked_once_processed(monkeypatch, make_tweet, alerts):
+    monkeypatch.setitem(config, "image_queue_size", 1)
+    handler = brain.TweetHandler()
+    handler.image_analyser = FixtureAnalyser({PHOTO: {"text": "bitcoin"}}, latency=0.2)
+
+    text_only = make_tweet("just text")
+    handler.process_tweet(text_only)
+    assert handler.seen_store.seen_tweet(text_only.id)
+
+    first = make_tweet("look", [PHOTO])
+    dropped = make_tweet("look again", [PHOTO])
+    first_result = handler.process_tweet(first)
+    handler.process_tweet(dropped)
+    assert not handler.seen_store.seen_tweet(first.id)
+
+    first_result.wait()
+    assert handler.seen_store.seen_tweet(first.id)
+    assert not handler.seen_store.seen_tweet(dropped.id)
+
+
+def test_alert_is_marked_only_after_it_is_sent(handler, alerts, make_tweet):
+    class FailingLogger:
+        def info(self, message):
+            raise ConnectionError("Discord is down")
+
+    tweet = make_tweet("I like BITCOIN")
+    with pytest.raises(ConnectionError):
+        handler._send_alert(FailingLogger(), tweet, "alert")
+    assert not handler.seen_store.seen_alert(tweet.id, "alert")
+
+    handler._send_alert(alerts["tweets"], tweet, "alert")
+    handler._send_alert(alerts["tweets"], tweet, "alert")
+    assert alerts["tweets"].messages == [("info", "alert")]
+
+
+class RecordingDownloader:
+    """ Stand-in for ImageDownloader, recording the photos downloaded. """
+
+    def __init__(self):
+        self.downloaded = []
+
+    def download_all(self, image_urls):
+        self.downloaded.extend(image_urls)
+        return [memoryview(url.encode()) for url in image_urls]
+
+
+def test_cached_photos_are_not_downloaded(handler):
+    handler.image_downloader = RecordingDownloader()
+    other = "https://pbs.twimg.com/media/other.jpg"
+    keys = handler.vision_cache.keys(PHOTO)
+    handler.vision_cache.set(handler._cache_feature("text"), keys, " cached")
+    handler.vision_cache.set(handler._cache_feature("objects"), keys, " dog")
+
+    assert handler.scan_image_text(PHOTO) == " cached"
+    assert handler.scan_image_objects(PHOTO) == " dog"
+    assert handler.scan_images([PHOTO, other]) == [(" cached", " dog"), ("", "")]
+    assert handler.image_downloader.downloaded == [other]
+
+
+@pytest.mark.parametrize("rule, text, skipped", [
+    ("never", "I like BITCOIN", False),
+    ("matched", "I like BITCOIN", True),
+    ("matched", "nothing to see", False),
+])
+def test_objects_are_skipped_once_the_text_has_matched(monkeypatch, handler, make_tweet, rule, text, skipped):
+    monkeypatch.setitem(config, "vision_skip_objects", rule)
+    result = handler.process_text(make_tweet(text, [PHOTO]))
+
+    assert result.objects is not skipped
+
+
+def test_scan_texts_yields_scan_results(handler):
+    texts = ["I like BITCOIN", "nothing to see", "doge and bitc0in"] * 3
+
+    in_process = list(handler.scan_texts(texts, workers=0))
+    in_workers = list(handler.scan_texts(texts, workers=2, chunk_size=2))
+
+    assert all(isinstance(result, brain.ScanResult) for result in in_workers)
+    assert [result.to_dict() for result in in_workers] == [result.to_dict() for result in in_process]
+    assert in_workers[0].keywords(brain.KEYWORDS) == ["bitcoin"]
+    assert in_workers[1].count() == 0
+    start, end, _ = in_workers[2].spans(brain.KEYWORDS)[-1]
+    assert texts[2][start:end] == "bitc0in"
+
+
+def test_scan_result_pickles_without_the_keyword_lists(handler):
+    result = handler.scan_for_keywords("I like BITCOIN")
+
+    copy = pickle.loads(pickle.dumps(result))
+    assert copy.state is None
+    copy.state = handler.state
+    assert copy.to_dict() == result.to_dict()
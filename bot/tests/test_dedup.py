@@ -0,0 +1,55 @@
+""" Tests for the store of seen tweets and alerts. """
+
+import time
+
+from dedup import BloomFilter, SeenStore
+
+
+def test_bloom_filter_has_no_false_negatives():
+    bloom = BloomFilter(1000, error_rate=0.01)
+    keys = [f"tweet:{i}" for i in range(1000)]
+    for key in keys:
+        bloom.add(key)
+
+    assert all(key in bloom for key in keys)
+    false_positives = sum(f"other:{i}" in bloom for i in range(10000))
+    assert false_positives < 300
+
+
+def test_checking_does_not_mark():
+    store = SeenStore()
+
+    assert not store.seen_tweet(1)
+    assert not store.seen_tweet(1)
+
+    store.mark_tweet(1)
+    assert store.seen_tweet(1)
+    assert not store.seen_tweet(2)
+
+
+def test_alerts_are_marked_separately():
+    store = SeenStore()
+    assert not store.seen_alert(1, "alert")
+
+    store.mark_alert(1, "alert")
+    assert store.seen_alert(1, "alert")
+    assert not store.seen_alert(1, "another alert")
+    assert not store.seen_alert(2, "alert")
+
+
+def test_keys_survive_a_restart(tmp_path):
+    path = str(tmp_path / "seen.sqlite3")
+    SeenStore(path).mark_tweet(1)
+
+    store = SeenStore(path)
+    assert store.seen_tweet(1)
+    assert not store.seen_tweet(2)
+
+
+def test_keys_are_forgotten_after_the_ttl(tmp_path):
+    store = SeenStore(str(tmp_path / "seen.sqlite3"), memory_size=0, ttl=0.05)
+    store.mark_tweet(1)
+    assert store.seen_tweet(1)
+
+    time.sleep(0.1)
+    assert not store.seen_tweet(1)
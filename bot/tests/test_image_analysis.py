@@ -0,0 +1,263 @@
+""" Tests for the image analysis backends. """
+
+import threading
+import time
+
+import pytest
+from google.api_core.exceptions import RetryError, ServiceUnavailable
+from google.auth.exceptions import TransportError
+
+from image_analysis import (
+    VISION_BUSY, VISION_SHORT_CIRCUITED, CallLimiter, CircuitBreaker, FixtureAnalyser, GoogleVisionAnalyser,
+    GuardedAnalyser, ImageAnalyser, ImageAnalysisError, ImageDownloader
+)
+
+PHOTO = "https://pbs.twimg.com/media/photo.jpg"
+
+
+def test_backends_must_implement_detection():
+    class TextOnly(ImageAnalyser):
+        def detect_text(self, image_url, content=None):
+            return ""
+
+    with pytest.raises(TypeError):
+        ImageAnalyser()
+    with pytest.raises(TypeError):
+        TextOnly()
+
+
+class RaisingClient:
+    """ Stand-in for the Google Vision API client, raising an error from every request. """
+
+    def __init__(self, error):
+        self.error = error
+
+    def text_detection(self, **kwargs):
+        raise self.error
+
+
+@pytest.mark.parametrize("error", [
+    ServiceUnavailable("unavailable"),
+    RetryError("deadline exceeded", None),
+    TransportError("connection reset"),
+    ConnectionError("connection refused"),
+    TimeoutError("read timed out"),
+])
+def test_google_errors_are_image_analysis_errors(error):
+    analyser = GoogleVisionAnalyser(client=RaisingClient(error))
+
+    with pytest.raises(ImageAnalysisError):
+        analyser._call("text_detection", image=None)
+
+
+class HangingAnalyser(FixtureAnalyser):
+    """ Backend whose calls hang until they are released. """
+
+    def __init__(self):
+        super().__init__({PHOTO: {"text": "bitcoin"}})
+        self.release = threading.Event()
+
+    def detect_text(self, image_url, content=None):
+        self.release.wait(5)
+        return super().detect_text(image_url, content)
+
+
+def test_overrunning_calls_are_capped():
+    backend = HangingAnalyser()
+    analyser = GuardedAnalyser(backend, CircuitBreaker(failure_threshold=10), timeout=0.05, workers=1)
+    busy = VISION_BUSY.value()
+
+    with pytest.raises(ImageAnalysisError, match="Timed out"):
+        analyser.detect_text(PHOTO)
+    # The overrunning call still holds the only slot, so the next call is refused rather than queued behind it
+    with pytest.raises(ImageAnalysisError, match="slot"):
+        analyser.detect_text(PHOTO)
+    assert VISION_BUSY.value() == busy + 1
+    assert analyser.breaker.state == CircuitBreaker.CLOSED
+
+    backend.release.set()
+    analyser._executor.submit(lambda: None).result(5)
+    assert analyser.detect_text(PHOTO) == " bitcoin"
+
+
+@pytest.fixture
+def photo_server():
+    """ Local HTTP server serving every path as a photo, slowly. """
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            time.sleep(0.2)
+            body = self.path.encode()
+            self.send_response(200)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+    server.server_close()
+
+
+def test_photos_are_downloaded_in_parallel(photo_server):
+    downloader = ImageDownloader(pool_size=4)
+    urls = [f"{photo_server}/{index}.jpg" for index in range(4)]
+
+    start = time.perf_counter()
+    contents = downloader.download_all(urls)
+    elapsed = time.perf_counter() - start
+
+    assert [bytes(content) for content in contents] == [f"/{index}.jpg".encode() for index in range(4)]
+    assert elapsed < 0.6
+
+
+def test_circuit_opens_after_failures_in_a_row():
+    breaker = CircuitBreaker(failure_threshold=3, reset_timeout=60)
+    for _ in range(2):
+        assert breaker.allow()
+        breaker.failure()
+    assert breaker.allow()
+    breaker.success()
+    for _ in range(2):
+        breaker.allow()
+        breaker.failure()
+    # A success in between starts the count again
+    assert breaker.state == CircuitBreaker.CLOSED
+
+    breaker.allow()
+    breaker.failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    assert not breaker.allow()
+
+
+def test_half_open_circuit_lets_one_probe_through():
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0.05)
+    breaker.allow()
+    breaker.failure()
+    time.sleep(0.06)
+
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    assert breaker.allow()
+    assert not breaker.allow()
+
+    # A failed probe opens the circuit for another reset timeout
+    breaker.failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    assert not breaker.allow()
+
+    time.sleep(0.06)
+    assert breaker.allow()
+    breaker.success()
+    assert breaker.state == CircuitBreaker.CLOSED
+    assert breaker.allow() and breaker.allow()
+
+
+def test_cancelled_probe_lets_another_through():
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0)
+    breaker.allow()
+    breaker.failure()
+
+    assert breaker.allow()
+    breaker.cancel()
+    assert breaker.allow()
+
+
+def test_limiter_keeps_to_the_rate_and_budget():
+    assert CallLimiter().acquire(100) is None
+    assert CallLimiter().remaining() is None
+
+    rate = CallLimiter(per_minute=2)
+    assert rate.acquire(1) is None
+    assert rate.acquire(1) is None
+    assert rate.acquire(1) == "rate_limit"
+
+    budget = CallLimiter(daily_budget=3)
+    assert budget.acquire(2) is None
+    assert budget.acquire(2) == "budget"
+    assert budget.remaining() == 1
+    assert budget.acquire(1) is None
+    assert budget.remaining() == 0
+
+
+class FailingAnalyser(FixtureAnalyser):
+    """ Backend whose calls fail. """
+
+    def detect_text(self, image_url, content=None):
+        raise ImageAnalysisError("backend failed")
+
+
+def test_guard_short_circuits_a_failing_backend():
+    analyser = GuardedAnalyser(FailingAnalyser(), CircuitBreaker(failure_threshold=2, reset_timeout=60))
+    short_circuited = VISION_SHORT_CIRCUITED.value()
+
+    for _ in range(2):
+        with pytest.raises(ImageAnalysisError, match="backend failed"):
+            analyser.detect_text(PHOTO)
+    with pytest.raises(ImageAnalysisError, match="circuit open"):
+        analyser.detect_text(PHOTO)
+    assert VISION_SHORT_CIRCUITED.value() == short_circuited + 1
+
+
+def test_guard_counts_units_against_the_budget():
+    analyser = GuardedAnalyser(FixtureAnalyser({PHOTO: {"text": "bitcoin"}}), limiter=CallLimiter(daily_budget=5))
+
+    assert analyser.analyse([PHOTO, PHOTO]) == [(" bitcoin", ""), (" bitcoin", "")]
+    assert analyser.limiter.remaining() == 1
+    with pytest.raises(ImageAnalysisError, match="budget reached"):
+        analyser.analyse([PHOTO], objects=True)
+    assert analyser.analyse([PHOTO], objects=False) == [(" bitcoin", "")]
+    # Refused calls leave the circuit closed
+    assert analyser.breaker.state == CircuitBreaker.CLOSED
+
+
+class BatchClient:
+    """ Stand-in for the Google Vision API client, answering batched requests. """
+
+    def __init__(self, responses):
+        self.responses = responses
+        self.calls = []
+
+    def batch_annotate_images(self, requests, retry=None, timeout=None):
+        from google.cloud import vision
+
+        self.calls.append(requests)
+        return vision.BatchAnnotateImagesResponse(responses=self.responses)
+
+
+def test_google_analyses_every_photo_in_one_batched_request():
+    from google.cloud import vision
+
+    client = BatchClient([
+        vision.AnnotateImageResponse(
+            text_annotations=[vision.EntityAnnotation(description="Buy\nBITCOIN")],
+            label_annotations=[vision.EntityAnnotation(description="Dog")]
+        ),
+        vision.AnnotateImageResponse(error={"message": "bad image"}),
+    ])
+    analyser = GoogleVisionAnalyser(client=client)
+
+    results = analyser.analyse([PHOTO, "https://pbs.twimg.com/media/other.jpg"], [memoryview(b"image"), None])
+
+    assert results == [(" buy bitcoin", " dog"), None]
+    requests, = client.calls
+    assert [request.image.content for request in requests] == [b"image", b""]
+    assert requests[1].image.source.image_uri == "https://pbs.twimg.com/media/other.jpg"
+    for request in requests:
+        assert [feature.type_ for feature in request.features] == [
+            vision.Feature.Type.TEXT_DETECTION, vision.Feature.Type.LABEL_DETECTION
+        ]
+
+
+def test_google_leaves_labels_out_when_objects_are_skipped():
+    from google.cloud import vision
+
+    client = BatchClient([vision.AnnotateImageResponse()])
+    GoogleVisionAnalyser(client=client).analyse([PHOTO], objects=False)
+
+    requests, = client.calls
+    assert [feature.type_ for feature in requests[0].features] == [vision.Feature.Type.TEXT_DETECTION]
@@ -0,0 +1,83 @@
+""" Tests for reloading the keywords when the keywords file changes. """
+
+import json
+import os
+
+import pytest
+
+import brain
+from keyword_watcher import KeywordWatcher
+
+
+def write_keywords(path, keywords, mtime):
+    """ Writes a keywords file with a given modification time, so changes do not depend on the clock. """
+    with open(path, "w") as file:
+        if isinstance(keywords, str):
+            file.write(keywords)
+        else:
+            json.dump({"keywords": keywords, "possible_keywords": ["moon"], "possible_objects": ["dog"]}, file)
+    os.utime(path, ns=(mtime, mtime))
+
+
+@pytest.fixture
+def watched(tmp_path, alerts):
+    """ Tweet handler reloaded by a watcher of a temporary keywords file. """
+    path = str(tmp_path / "keywords.json")
+    write_keywords(path, ["bitcoin"], 1_000_000_000)
+    handler = brain.TweetHandler()
+    return path, handler, KeywordWatcher(path, handler.reload_keywords)
+
+
+def test_changed_file_swaps_in_new_keywords(watched):
+    path, handler, watcher = watched
+    old_state = handler.state
+
+    write_keywords(path, ["dogecoin", "cardano"], 2_000_000_000)
+
+    assert watcher.check()
+    assert handler.state is not old_state
+    assert handler.keywords == ["dogecoin", "cardano"]
+    assert handler.scan_for_keywords("cardano is up").keywords(brain.KEYWORDS) == ["cardano"]
+
+
+@pytest.mark.parametrize("content", [
+    "",
+    "{not json",
+    json.dumps({"keywords": ["bitcoin"]}),
+    json.dumps({"keywords": ["Bitcoin"], "possible_keywords": [], "possible_objects": []}),
+    json.dumps({"keywords": [""], "possible_keywords": [], "possible_objects": []}),
+])
+def test_invalid_file_keeps_the_current_keywords(watched, content):
+    path, handler, watcher = watched
+    old_state = handler.state
+
+    write_keywords(path, content, 2_000_000_000)
+
+    assert not watcher.check()
+    assert handler.state is old_state
+
+
+def test_unchanged_file_does_nothing(watched):
+    path, handler, watcher = watched
+    old_state = handler.state
+    reloads = []
+    watcher.on_change = reloads.append
+
+    assert not watcher.check()
+    # Rewriting the same file without changing its modification time or size is not a change
+    write_keywords(path, ["bitcoin"], 1_000_000_000)
+    assert not watcher.check()
+    assert reloads == []
+    assert handler.state is old_state
+
+
+def test_invalid_file_is_not_retried_until_it_changes_again(watched):
+    path, handler, watcher = watched
+
+    write_keywords(path, "{not json", 2_000_000_000)
+    assert not watcher.check()
+    assert not watcher.check()
+
+    write_keywords(path, ["solana"], 3_000_000_000)
+    assert watcher.check()
+    assert handler.keywords == ["solana"]
@@ -0,0 +1,108 @@
+""" Tests for the background Discord sender, against the local fake_discord stand-in. """
+
+import os
+import time
+
+import pytest
+
+from fake_discord import FakeDiscord
+from log import DISCORD_MESSAGE_LIMIT, LOG_PRIORITY, TWEET_PRIORITY, DiscordSender, get_sender
+
+
+@pytest.fixture
+def discord():
+    """ Running fake Discord webhook server. """
+    fake = FakeDiscord(retry_after=0.05)
+    fake.start()
+    yield fake
+    fake.stop()
+
+
+def wait_for_messages(discord, count, timeout=5):
+    """ Waits for the fake server to receive a number of messages. """
+    deadline = time.monotonic() + timeout
+    while len(discord.messages) < count and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return [message["content"] for message in discord.messages]
+
+
+def test_messages_are_posted_to_the_webhook(discord):
+    sender = DiscordSender(f"{discord.url}/tweets", flush_window=0.05)
+
+    sender.send("Matched crypto related tweet", TWEET_PRIORITY)
+
+    assert wait_for_messages(discord, 1) == ["Matched crypto related tweet"]
+    assert discord.messages[0]["channel"] == "/tweets"
+
+
+def test_alerts_are_sent_ahead_of_log_lines(discord):
+    sender = DiscordSender(f"{discord.url}/logs", flush_window=0.3)
+
+    sender.send("first log line", LOG_PRIORITY)
+    sender.send("second log line", LOG_PRIORITY)
+    sender.send("alert", TWEET_PRIORITY)
+
+    assert wait_for_messages(discord, 2) == ["alert", "first log line\nsecond log line"]
+
+
+def test_log_lines_are_merged_within_the_message_limit(discord):
+    sender = DiscordSender(f"{discord.url}/logs", flush_window=0.2)
+    lines = [f"{index:04d}" + "x" * 495 for index in range(10)]
+
+    for line in lines:
+        sender.send(line)
+    sender.flush()
+
+    messages = wait_for_messages(discord, 3)
+    assert len(messages) == 3
+    assert all(len(message) <= DISCORD_MESSAGE_LIMIT for message in messages)
+    assert "\n".join(messages).split("\n") == lines
+
+
+def test_overlong_lines_are_cut_to_the_message_limit():
+    sender = DiscordSender("http://127.0.0.1:9/unused")
+
+    assert sender._merge(["x" * 5000]) == ["x" * DISCORD_MESSAGE_LIMIT]
+
+
+def test_rate_limits_are_waited_out(discord):
+    discord.rate_limit_every = 2
+    sender = DiscordSender(f"{discord.url}/tweets", flush_window=0.05)
+
+    for index in range(3):
+        sender.send(f"alert {index}", TWEET_PRIORITY)
+
+    assert wait_for_messages(discord, 3) == ["alert 0", "alert 1", "alert 2"]
+    assert discord.rate_limited >= 1
+
+
+def test_rate_limit_waits_are_capped(discord):
+    discord.rate_limit_every = 1
+    sender = DiscordSender(f"{discord.url}/tweets", max_rate_limit_wait=0.2)
+
+    start = time.monotonic()
+    sender._post("never delivered")
+
+    assert time.monotonic() - start < 1
+    assert discord.messages == []
+    assert discord.rate_limited >= 2
+
+
+def test_forked_child_sends_its_own_messages(discord):
+    url = f"{discord.url}/logs"
+    sender = get_sender(url)
+    sender.flush_window = 0.05
+    sender.send("from parent")
+    assert wait_for_messages(discord, 1) == ["from parent"]
+
+    pid = os.fork()
+    if pid == 0:
+        # The child's handlers hold the same sender object, which must send from a thread of its own
+        try:
+            sender.send("from child")
+            sender.flush()
+        finally:
+            os._exit(0)
+    os.waitpid(pid, 0)
+
+    assert wait_for_messages(discord, 2) == ["from parent", "from child"]
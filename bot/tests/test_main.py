@@ -0,0 +1,151 @@
+""" Tests for the stream listener and the stream shards. """
+
+import logging
+import multiprocessing
+import time
+
+import pytest
+
+import brain
+import main
+from config import config, tweet_logger
+from log import forward_logs, listen_for_logs
+
+USER_ID = 44196397
+
+
+class DirectQueue:
+    """ Stand-in for TweetQueue, processing each tweet as soon as it is put. """
+
+    def __init__(self, handler):
+        self.handler = handler
+        self.tweets = []
+
+    def put(self, tweet):
+        self.tweets.append(tweet)
+        self.handler.process_tweet(tweet)
+
+
+@pytest.fixture
+def listener(monkeypatch, alerts):
+    """ Listener following one user, with a tweet handler answering photos from fixtures. """
+    monkeypatch.setitem(config, "image_backend", "fixture")
+    handler = brain.TweetHandler()
+    return main.CryptoTweetListener(None, handler, [str(USER_ID)], DirectQueue(handler))
+
+
+class RecordingHandler(logging.Handler):
+    """ Logging handler recording the message of every record. """
+
+    def __init__(self):
+        super().__init__()
+        self.messages = []
+
+    def emit(self, record):
+        self.messages.append(record.getMessage())
+
+
+def log_from_shard(log_queue, message):
+    """ Logs an alert from a spawned process, as a stream shard does. """
+    forward_logs(log_queue, tweet_logger)
+    tweet_logger.info(message)
+
+
+def wait_until(condition, timeout=30):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.05)
+
+
+def test_tweets_with_the_same_text_are_all_alerted(listener, alerts, make_tweet):
+    listener.on_status(make_tweet("Doge", tweet_id=1))
+    listener.on_status(make_tweet("Doge", tweet_id=2))
+
+    assert [tweet.id for tweet in listener.tweet_queue.tweets] == [1, 2]
+    assert len(alerts["tweets"].messages) == 2
+
+
+def test_tweet_delivered_again_is_skipped(listener, make_tweet):
+    listener.on_status(make_tweet("Doge", tweet_id=1))
+    listener.on_status(make_tweet("Doge", tweet_id=1))
+
+    assert [tweet.id for tweet in listener.tweet_queue.tweets] == [1]
+
+
+def test_retweet_is_only_skipped_once_the_original_is_processed(listener, make_tweet):
+    original = make_tweet("Doge", tweet_id=1)
+    first_retweet = make_tweet("RT @ghost: Doge", tweet_id=2)
+    first_retweet.retweeted_status = original
+    listener.on_status(first_retweet)
+
+    listener.on_status(original)
+    second_retweet = make_tweet("RT @ghost: Doge", tweet_id=3)
+    second_retweet.retweeted_status = original
+    listener.on_status(second_retweet)
+
+    assert [tweet.id for tweet in listener.tweet_queue.tweets] == [2, 1]
+
+
+def test_quote_of_a_processed_tweet_is_processed(listener, make_tweet):
+    original = make_tweet("Doge", tweet_id=1)
+    quote = make_tweet("Still buying", tweet_id=2)
+    quote.quoted_status = original
+    listener.on_status(original)
+    listener.on_status(quote)
+
+    assert [tweet.id for tweet in listener.tweet_queue.tweets] == [1, 2]
+
+
+def test_tweets_processed_by_worker_processes_are_skipped_when_delivered_again(monkeypatch, alerts, make_tweet):
+    monkeypatch.setitem(config, "worker_mode", "process")
+    monkeypatch.setitem(config, "tweet_workers", 1)
+    handler = brain.TweetHandler()
+    listener = main.CryptoTweetListener(None, handler, [str(USER_ID)])
+    duplicates = main.DUPLICATE_TWEETS.value("id")
+
+    tweet = make_tweet("I like BITCOIN")
+    listener.on_status(tweet)
+    wait_until(lambda: handler.seen_store.seen_tweet(tweet.id))
+    listener.on_status(make_tweet("I like BITCOIN", tweet_id=tweet.id))
+
+    assert main.DUPLICATE_TWEETS.value("id") == duplicates + 1
+
+
+def test_following_ids_are_split_evenly():
+    assert main.split_following_ids(["1", "2", "3", "4", "5", "6"], 3) == [["1", "4"], ["2", "5"], ["3", "6"]]
+
+
+def test_uneven_split_differs_by_at_most_one_id():
+    shards = main.split_following_ids([str(user_id) for user_id in range(7)], 3)
+
+    assert [len(shard) for shard in shards] == [3, 2, 2]
+    assert sorted(user_id for shard in shards for user_id in shard) == [str(user_id) for user_id in range(7)]
+
+
+def test_there_are_no_more_shards_than_ids():
+    assert main.split_following_ids(["1", "2"], 5) == [["1"], ["2"]]
+
+
+@pytest.mark.parametrize("shards", [0, 1])
+def test_one_shard_follows_every_id(shards):
+    assert main.split_following_ids(["1", "2", "3"], shards) == [["1", "2", "3"]]
+
+
+def test_alerts_from_a_shard_process_are_logged_by_the_parent():
+    context = multiprocessing.get_context("spawn")
+    log_queue = context.Queue()
+    handler = RecordingHandler()
+    tweet_logger.logger.addHandler(handler)
+    listener = listen_for_logs(log_queue)
+    try:
+        process = context.Process(target=log_from_shard, args=(log_queue, "alert from shard"))
+        process.start()
+        process.join(30)
+        wait_until(lambda: handler.messages)
+    finally:
+        listener.stop()
+        tweet_logger.logger.removeHandler(handler)
+
+    assert process.exitcode == 0
+    assert handler.messages == ["alert from shard"]
@@ -0,0 +1,134 @@
+""" Tests for the compiled keyword matcher. """
+
+import re
+
+import pytest
+from fuzzysearch.common import Match
+
+from benchmark import random_matches
+from matcher import KeywordMatcher, KeywordState, max_l_dist, resolve_overlaps, trie_pattern
+
+
+def found(matcher, text):
+    """ Scans a text, returning the keyword and matched text of each match. """
+    return [(matcher.keywords[index], match.matched) for index, match in matcher.scan(text)]
+
+
+def test_short_keywords_must_match_exactly():
+    matcher = KeywordMatcher(["eth", "doge"])
+
+    assert found(matcher, "eth and doge") == [("eth", "eth"), ("doge", "doge")]
+    assert found(matcher, "etc and dage") == []
+
+
+@pytest.mark.parametrize("text, matched", [
+    ("bitcoin", "bitcoin"),
+    ("bitcoyn", "bitcoyn"),
+    ("bitcon", "bitcon"),
+    ("bittcoin", "bittcoin"),
+])
+def test_long_keywords_match_within_one_edit(text, matched):
+    matcher = KeywordMatcher(["bitcoin"])
+
+    assert found(matcher, f"buy {text} now") == [("bitcoin", matched)]
+
+
+def test_long_keywords_do_not_match_two_edits_away():
+    matcher = KeywordMatcher(["bitcoin"])
+
+    assert found(matcher, "bitcion") == []
+    assert found(matcher, "bytcoyn") == []
+
+
+def test_every_occurrence_is_found_in_order():
+    matcher = KeywordMatcher(["bitcoin", "eth"])
+
+    matches = matcher.scan("eth, bitcoin, then bitcoin again")
+
+    assert [(index, match.start, match.end) for index, match in matches] == [(1, 0, 3), (0, 5, 12), (0, 19, 26)]
+
+
+def test_overlapping_keywords_are_all_reported():
+    matcher = KeywordMatcher(["crypto", "cryptocurrency"])
+
+    assert found(matcher, "i like cryptocurrency") == [("crypto", "crypto"), ("cryptocurrency", "cryptocurrency")]
+
+
+def test_prefilter_rejects_texts_without_any_seed():
+    matcher = KeywordMatcher(["bitcoin", "doge"])
+
+    assert not matcher.might_match("nothing to see here")
+    assert matcher.might_match("a coin")
+    assert matcher.scan("nothing to see here") == []
+
+
+def test_empty_keyword_list_never_matches():
+    matcher = KeywordMatcher([])
+
+    assert not matcher.might_match("bitcoin")
+    assert matcher.scan("bitcoin") == []
+
+
+def test_max_l_dist():
+    assert max_l_dist("doge") == 0
+    assert max_l_dist("bitcoin") == 1
+
+
+def test_trie_pattern_shares_prefixes():
+    pattern = trie_pattern(["bitcoin", "bitcoins", "bit"])
+
+    assert pattern == "bit(?:coins?)?"
+    assert [re.fullmatch(pattern, text) is not None for text in ("bit", "bitcoin", "bitcoins", "bitc")] == [
+        True, True, True, False
+    ]
+
+
+def test_trie_pattern_never_matches_without_patterns():
+    assert re.search(trie_pattern([]), "anything") is None
+
+
+def test_keyword_state_keeps_lists_and_matchers_in_order():
+    state = KeywordState(["bitcoin"], ["moon"], ["dog"])
+
+    assert state.lists == (["bitcoin"], ["moon"], ["dog"])
+    assert [matcher.name for matcher in state.matchers] == ["keywords", "possible_keywords", "possible_objects"]
+
+
+def span(start, end):
+    """ Builds a Match covering a span. """
+    return Match(start, end, 0, "x" * (end - start))
+
+
+def test_resolve_overlaps_keeps_the_longest_match():
+    assert resolve_overlaps([span(7, 13), span(7, 21)]) == [span(7, 21)]
+    assert resolve_overlaps([span(10, 14), span(7, 14)]) == [span(7, 14)]
+
+
+def test_resolve_overlaps_keeps_every_separate_occurrence_in_order():
+    matches = [span(20, 27), span(0, 7), span(10, 17), span(10, 17)]
+
+    assert resolve_overlaps(matches) == [span(0, 7), span(10, 17), span(20, 27)]
+
+
+def test_resolve_overlaps_keeps_the_first_of_equal_length_matches():
+    assert resolve_overlaps([span(3, 8), span(0, 5)]) == [span(0, 5)]
+
+
+def test_resolve_overlaps_touching_matches_do_not_overlap():
+    assert resolve_overlaps([span(0, 5), span(5, 9)]) == [span(0, 5), span(5, 9)]
+
+
+def test_resolve_overlaps_on_random_matches():
+    matches = random_matches(500, 2000, seed=1)
+
+    resolved = resolve_overlaps(list(matches))
+
+    assert all(first.end <= second.start for first, second in zip(resolved, resolved[1:]))
+    assert set(resolved) <= set(matches)
+    assert resolve_overlaps(list(resolved)) == resolved
+    # Every match dropped lost out to an overlapping match at least as long
+    for match in set(matches) - set(resolved):
+        assert any(
+            other.start < match.end and match.start < other.end and other.end - other.start >= match.end - match.start
+            for other in matches if other is not match
+        )
@@ -0,0 +1,72 @@
+""" Tests for the lightweight metrics. """
+
+import threading
+
+import pytest
+
+from metrics import counter, gauge, histogram, render, timed
+
+
+def test_counter_is_shared_by_name():
+    first = counter("test_shared_total", "Shared counter", ["kind"])
+    second = counter("test_shared_total", "Shared counter", ["kind"])
+
+    first.inc("a")
+    second.inc("a", amount=2)
+
+    assert first is second
+    assert first.value("a") == 3
+    assert first.value("b") == 0
+
+
+def test_counter_checks_its_labels():
+    with pytest.raises(ValueError):
+        counter("test_labels_total", "Labelled counter", ["kind"]).inc()
+
+
+def test_gauge_reads_from_the_latest_function():
+    gauge("test_depth", "Depth of the first queue", lambda: 1)
+    registered = gauge("test_depth", "Depth of the second queue", lambda: 2)
+
+    assert "test_depth 2" in render().splitlines()
+    assert registered.summary() == "test_depth: total=2"
+
+
+def test_histogram_buckets_and_quantiles():
+    latency = histogram("test_latency_seconds", "Latency", buckets=(0.1, 1))
+
+    for value in (0.05, 0.05, 0.5, 5):
+        latency.observe(value)
+
+    lines = render().splitlines()
+    assert 'test_latency_seconds_bucket{le="0.1"} 2' in lines
+    assert 'test_latency_seconds_bucket{le="1"} 3' in lines
+    assert 'test_latency_seconds_bucket{le="+Inf"} 4' in lines
+    assert "test_latency_seconds_count 4" in lines
+    assert latency.quantile(0.5) == 0.1
+    assert latency.quantile(0.99) == float("inf")
+
+
+def test_timed_records_every_call():
+    calls = histogram("test_calls_seconds", "Calls", ["name"])
+
+    @timed(calls, "double")
+    def double(value):
+        return value * 2
+
+    assert double(2) == 4
+    assert double(3) == 6
+    assert 'test_calls_seconds_count{name="double"} 2' in render().splitlines()
+
+
+def test_gauge_writes_its_value_under_the_lock():
+    registered = gauge("test_locked", "Gauge read while locked", lambda: 3)
+    lines = []
+    with registered._lock:
+        reader = threading.Thread(target=lambda: lines.extend(registered.render()))
+        reader.start()
+        reader.join(0.1)
+        # The reader waits for the lock rather than writing the value underneath it
+        assert reader.is_alive()
+    reader.join(5)
+    assert lines[-1] == "test_locked 3"
@@ -0,0 +1,96 @@
+""" Tests for text normalization and the map back to the original text. """
+
+import random
+
+import pytest
+from fuzzysearch.common import Match
+
+from normalize import normalize
+
+
+def original_of(normalized, substring):
+    """ Gets the original text a substring of the normalized text came from. """
+    start = normalized.text.index(substring)
+    original_start, original_end = normalized.original_span(start, start + len(substring))
+    return normalized.original[original_start:original_end]
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("Buy BITCOIN now", "buy bitcoin now"),
+    ("bіtcoin", "bitcoin"),
+    ("ＢＩＴＣＯＩＮ", "bitcoin"),
+    ("ᗷitcoin", "bitcoin"),
+    ("bitc0in", "bitcoin"),
+    ("Bitcoïn", "bitcoin"),
+    ("doge &amp; bitcoin", "doge & bitcoin"),
+    ("bitcoin🚀🚀", "bitcoin  "),
+])
+def test_normalize_folds_look_alikes(text, expected):
+    assert normalize(text).text == expected
+
+
+def test_numbers_are_not_folded():
+    assert normalize("up 10x in 2021, 1 coin").text == "up 10x in 2021, 1 coin"
+
+
+def test_handles_and_links_are_blanked():
+    normalized = normalize("@bitcoin says https://t.co/bitcoin doge")
+    assert "bitcoin" not in normalized.text
+    assert original_of(normalized, "doge") == "doge"
+
+
+def test_plain_text_offsets_are_unchanged():
+    normalized = normalize("Buy Bitcoin now")
+    assert normalized.original_span(4, 11) == (4, 11)
+
+
+@pytest.mark.parametrize("text, keyword, expected", [
+    ("gm @elonmusk bіtcoin", "bitcoin", "bіtcoin"),
+    ("we ❤ ＢＴＣ!", "btc", "ＢＴＣ"),
+    ("see https://t.co/x Bitcoïn", "bitcoin", "Bitcoïn"),
+    ("doge &amp; shib", "doge & shib", "doge &amp; shib"),
+    ("moon 🚀 bitc0in 🚀", "bitcoin", "bitc0in"),
+])
+def test_spans_map_back_to_the_original(text, keyword, expected):
+    assert original_of(normalize(text), keyword) == expected
+
+
+def test_expanded_characters_map_back_to_the_whole_character():
+    normalized = normalize("straße")
+    assert normalized.text == "strasse"
+    # Either half of "ss" maps back to the one "ß" it came from
+    assert normalized.original_span(4, 5) == (4, 5)
+    assert normalized.original_span(4, 6) == (4, 5)
+    assert normalized.original_span(5, 7) == (4, 6)
+
+
+def test_decomposed_accents_map_back_with_the_letter():
+    normalized = normalize("Bitcoi\u0301n")
+    assert normalized.text == "bitcoin"
+    assert normalized.original_span(0, 7) == (0, 8)
+    assert normalized.original_span(5, 6) == (5, 6)
+
+
+def test_to_original_moves_matches_and_their_text():
+    normalized = normalize("@x BІTC0IN &amp; doge")
+    start = normalized.text.index("bitcoin")
+    moved, = normalized.to_original([Match(start, start + 7, 1, "bitcoin")])
+
+    assert normalized.original[moved.start:moved.end] == "BІTC0IN"
+    assert moved.matched == "BІTC0IN"
+    assert moved.dist == 1
+
+
+def test_every_span_maps_inside_the_original():
+    alphabet = "abc 01@:/&;ＢіßÉ́🚀#x.htps"
+    rng = random.Random(19)
+    for _ in range(500):
+        text = "".join(rng.choice(alphabet) for _ in range(rng.randint(1, 30)))
+        normalized = normalize(text)
+        previous = (0, 0)
+        for index in range(len(normalized.text)):
+            start, end = normalized.original_span(index, index + 1)
+            assert 0 <= start < end <= len(text)
+            # Spans never move backwards through the original text
+            assert start >= previous[0] and end >= previous[1]
+            previous = (start, end)
@@ -0,0 +1,118 @@
+""" Tests for the on-demand profiler. """
+
+import os
+import pstats
+import threading
+import time
+
+import pytest
+
+import profiler
+from config import config
+from profiler import CallTracer, SamplingProfiler, profile_for, traced
+
+
+@traced
+def fast():
+    return "fast"
+
+
+@traced
+def slow():
+    time.sleep(0.05)
+    return "slow"
+
+
+@traced
+def outer():
+    return inner()
+
+
+@traced
+def inner():
+    time.sleep(0.05)
+    return "inner"
+
+
+@pytest.fixture
+def tracer(monkeypatch):
+    """ Tracer keeping calls of 20ms or more, installed as if a trace were running. """
+    tracer = CallTracer(threshold=0.02)
+    monkeypatch.setattr(profiler, "_tracer", tracer)
+    return tracer
+
+
+def profiled_functions(tracer, path):
+    """ Gets the names of the functions in the profiles written by a tracer. """
+    assert tracer.dump(path)
+    return {name for _, _, name in pstats.Stats(path).stats}
+
+
+def test_traced_function_is_called_directly_without_a_trace():
+    assert profiler._tracer is None
+    assert fast() == "fast"
+
+
+def test_only_calls_above_the_threshold_are_kept(tracer, tmp_path):
+    assert fast() == "fast"
+    assert not tracer.dump(str(tmp_path / "none.pstats"))
+
+    assert slow() == "slow"
+    assert tracer.calls == 2
+    assert tracer.slow_calls == 1
+    functions = profiled_functions(tracer, str(tmp_path / "trace.pstats"))
+    assert "slow" in functions
+    assert "fast" not in functions
+
+
+def test_nested_traced_calls_are_profiled_once(tracer, tmp_path):
+    assert outer() == "inner"
+
+    assert tracer.calls == 1
+    assert tracer.slow_calls == 1
+    assert {"outer", "inner"} <= profiled_functions(tracer, str(tmp_path / "trace.pstats"))
+
+
+def busy(stop):
+    while not stop.is_set():
+        sum(range(1000))
+
+
+@pytest.fixture
+def busy_thread():
+    """ Thread running busy() until the test ends. """
+    stop = threading.Event()
+    thread = threading.Thread(target=busy, args=(stop,), name="image-worker-3")
+    thread.start()
+    yield thread
+    stop.set()
+    thread.join()
+
+
+def test_sampler_records_the_stacks_of_other_threads(busy_thread, tmp_path):
+    sampler = SamplingProfiler(interval=0.005)
+    sampler.run(0.1)
+
+    assert sampler.sample_count > 1
+    stacks = [stack for stack in sampler.samples if stack.startswith("image-worker;")]
+    assert stacks and all("busy (test_profiler.py" in stack for stack in stacks)
+    assert not any(stack.startswith("MainThread;") for stack in sampler.samples)
+
+    path = str(tmp_path / "profile.collapsed")
+    sampler.dump(path)
+    with open(path) as file:
+        lines = file.read().splitlines()
+    assert len(lines) == len(sampler.samples)
+    assert all(int(line.rsplit(" ", 1)[1]) > 0 for line in lines)
+
+
+def test_profile_writes_the_samples_to_the_profile_dir(monkeypatch, busy_thread, tmp_path):
+    monkeypatch.setitem(config, "profile_dir", str(tmp_path))
+
+    path = profile_for(0.05, interval=0.005)
+
+    assert os.path.dirname(path) == str(tmp_path)
+    with open(path) as file:
+        assert "image-worker;" in file.read()
+    # The session is free again once the profile is written
+    assert profile_for(0.01, interval=0.005) is not None
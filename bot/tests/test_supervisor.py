@@ -0,0 +1,127 @@
+""" Tests for the stream supervisor and its backoff. """
+
+from types import SimpleNamespace
+
+import pytest
+
+from supervisor import Backoff, StreamSupervisor
+
+
+class Stop(Exception):
+    """ Raised by the fake sleep to end StreamSupervisor.run(). """
+
+
+class FakeClock:
+    """ Clock which only moves when told to. """
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class FakeStream:
+    """ Stand-in for the tweepy stream, each filter() call plays the next scripted connection.
+
+    Each connection is (seconds connected or None if it never connects, error recorded by the listener or raised).
+    """
+
+    def __init__(self, supervisor, clock, connections):
+        self.supervisor = supervisor
+        self.clock = clock
+        self.connections = list(connections)
+
+    def filter(self, follow):
+        uptime, error = self.connections.pop(0)
+        if uptime is not None:
+            self.supervisor.connected()
+            self.clock.now += uptime
+        if isinstance(error, Exception):
+            raise error
+        self.supervisor.listener.last_error = error
+
+
+def supervise(connections, stable_after=60, downtime=0):
+    """ Runs a supervisor through scripted connections, without waiting.
+
+    Args:
+        connections (list of (float, error)): Connections played by the fake stream.
+        stable_after (float): Seconds a connection has to stay up before the backoff is reset.
+        downtime (float): Seconds the clock moves on while sleeping before each reconnect.
+
+    Returns:
+        (StreamSupervisor, list of float): Supervisor and the delays it slept for.
+    """
+    clock = FakeClock()
+    delays = []
+
+    def sleep(delay):
+        delays.append(delay)
+        clock.now += downtime
+        if not stream.connections:
+            raise Stop
+
+    supervisor = StreamSupervisor(
+        SimpleNamespace(auth=None), SimpleNamespace(last_error=None), ["1"], stable_after, clock=clock, sleep=sleep
+    )
+    stream = supervisor.stream = FakeStream(supervisor, clock, connections)
+    with pytest.raises(Stop):
+        supervisor.run()
+    return supervisor, delays
+
+
+def test_backoff_doubles_up_to_the_cap():
+    backoff = Backoff(60, 15 * 60, jitter=0)
+    assert [backoff.next() for _ in range(6)] == [60, 120, 240, 480, 900, 900]
+
+    backoff.reset()
+    assert backoff.next() == 60
+
+
+def test_backoff_jitter_stays_within_the_fraction():
+    backoff = Backoff(5, 320, jitter=0.1)
+    for expected in (5, 10, 20, 40, 80, 160, 320, 320):
+        assert expected <= backoff.next() <= expected * 1.1
+
+
+@pytest.mark.parametrize("error, reason", [
+    (420, "rate_limit"),
+    (401, "http"),
+    (503, "http"),
+    (ConnectionError("reset"), "network"),
+    (None, "network"),
+])
+def test_disconnect_reasons_are_classified(error, reason):
+    supervisor, delays = supervise([(1, error)])
+
+    assert supervisor.stats()[reason] == 1
+    start = {"network": 0.25, "http": 5, "rate_limit": 60}[reason]
+    assert start <= delays[0] <= start * 1.1
+
+
+def test_rate_limit_backoff_is_capped_at_15_minutes():
+    _, delays = supervise([(None, 420)] * 7)
+
+    for expected, delay in zip([60, 120, 240, 480, 900, 900, 900], delays):
+        assert expected <= delay <= expected * 1.1
+
+
+def test_backoff_resets_after_a_stable_connection():
+    # Two quick failures, a connection which stays up, then another failure
+    _, delays = supervise([(1, 503), (1, 503), (120, 503), (1, 503)], stable_after=60)
+
+    for expected, delay in zip([5, 10, 5, 10], delays):
+        assert expected <= delay <= expected * 1.1
+
+
+def test_reconnect_stats():
+    supervisor, _ = supervise([(10, ConnectionError("reset")), (10, 420), (10, 503)], downtime=2)
+
+    stats = supervisor.stats()
+    assert stats["connects"] == 3
+    assert stats["reconnects"] == 2
+    assert (stats["network"], stats["rate_limit"], stats["http"]) == (1, 1, 1)
+    assert stats["last_reconnect_seconds"] == 2
+    assert stats["max_reconnect_seconds"] == 2
+    assert stats["mean_reconnect_seconds"] == 2
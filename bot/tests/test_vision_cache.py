@@ -0,0 +1,36 @@
+""" Tests for the cache of image analysis results. """
+
+from vision_cache import VisionCache
+
+PHOTO = "https://pbs.twimg.com/media/photo.jpg"
+
+
+def test_keys_only_hash_content_they_are_given():
+    cache = VisionCache(hash_content=True)
+
+    assert cache.keys(PHOTO) == [f"url:{PHOTO}"]
+    keys = cache.keys(PHOTO, b"image")
+    assert keys[0] == f"url:{PHOTO}"
+    assert keys[1].startswith("sha256:")
+    assert VisionCache().keys(PHOTO, b"image") == [f"url:{PHOTO}"]
+
+
+def test_results_are_found_by_any_key(tmp_path):
+    cache = VisionCache(path=str(tmp_path / "cache.sqlite3"), hash_content=True)
+    cache.set("text", cache.keys(PHOTO, b"image"), " bitcoin")
+
+    assert cache.get("text", cache.keys(PHOTO)) == " bitcoin"
+    assert cache.get("text", cache.keys("https://example.com/copy.jpg", b"image")) == " bitcoin"
+    assert cache.get("objects", cache.keys(PHOTO)) is None
+
+    reopened = VisionCache(path=str(tmp_path / "cache.sqlite3"), hash_content=True)
+    assert reopened.get("text", reopened.keys(PHOTO)) == " bitcoin"
+    assert reopened.stats()["disk_hits"] == 1
+
+
+def test_misses_can_be_left_uncounted():
+    cache = VisionCache()
+    cache.get("text", cache.keys(PHOTO), count_miss=False)
+    assert cache.stats()["misses"] == 0
+    cache.get("text", cache.keys(PHOTO))
+    assert cache.stats()["misses"] == 1
@@ -0,0 +1,173 @@
+""" Tests for the tweet worker queue. """
+
+import os
+import threading
+import time
+from collections import namedtuple
+
+import pytest
+
+from workers import TweetQueue
+
+Tweet = namedtuple("Tweet", ["id"])
+
+
+def spill_queue(path, process, size=2, workers=0):
+    """ Builds a queue using the spill overflow policy, with tweets spilled as their id. """
+    return TweetQueue(
+        process, size=size, workers=workers, overflow="spill", spill_path=str(path),
+        serialize=lambda tweet: tweet.id, deserialize=Tweet, report_interval=0
+    )
+
+
+def drain(tweet_queue):
+    """ Takes every tweet waiting on a queue which has no workers. """
+    tweets = []
+    while not tweet_queue._queue.empty():
+        tweets.append(tweet_queue._queue.get_nowait())
+    return tweets
+
+
+def wait_for(condition, timeout=5):
+    """ Waits for a condition to become true. """
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "Timed out"
+        time.sleep(0.01)
+
+
+def test_unknown_overflow_policy_is_rejected():
+    with pytest.raises(ValueError):
+        TweetQueue(print, overflow="lose_everything")
+
+
+def test_spill_needs_a_path_and_serializers():
+    with pytest.raises(ValueError):
+        TweetQueue(print, overflow="spill")
+
+
+def test_workers_process_every_tweet():
+    processed = []
+    tweet_queue = TweetQueue(
+        lambda tweet: processed.append(tweet.id), size=10, workers=2, overflow="block", report_interval=0
+    )
+    tweet_queue.start()
+
+    for tweet_id in range(20):
+        tweet_queue.put(Tweet(tweet_id))
+    tweet_queue.stop()
+    for worker in tweet_queue._workers:
+        worker.join(5)
+
+    assert sorted(processed) == list(range(20))
+    assert tweet_queue.stats()["processed"] == 20
+
+
+def test_failed_tweets_are_counted_and_workers_carry_on():
+    processed = []
+
+    def process(tweet):
+        if tweet.id == 1:
+            raise RuntimeError("bad tweet")
+        processed.append(tweet.id)
+
+    tweet_queue = TweetQueue(process, size=10, workers=1, report_interval=0)
+    tweet_queue.start()
+    for tweet_id in range(3):
+        tweet_queue.put(Tweet(tweet_id))
+    wait_for(lambda: tweet_queue.stats()["processed"] == 2)
+
+    assert processed == [0, 2]
+    assert tweet_queue.stats()["failed"] == 1
+
+
+def test_drop_oldest_makes_room_for_new_tweets():
+    tweet_queue = TweetQueue(print, size=2, workers=0, report_interval=0)
+
+    for tweet_id in range(4):
+        tweet_queue.put(Tweet(tweet_id))
+
+    assert drain(tweet_queue) == [Tweet(2), Tweet(3)]
+    assert tweet_queue.stats()["dropped"] == 2
+
+
+def test_block_drops_the_new_tweet_after_the_timeout():
+    tweet_queue = TweetQueue(print, size=1, workers=0, overflow="block", block_timeout=0.05, report_interval=0)
+
+    tweet_queue.put(Tweet(0))
+    start = time.monotonic()
+    tweet_queue.put(Tweet(1))
+
+    assert time.monotonic() - start >= 0.05
+    assert drain(tweet_queue) == [Tweet(0)]
+    assert tweet_queue.stats()["dropped"] == 1
+
+
+def test_block_waits_for_a_worker_to_make_room():
+    release = threading.Event()
+    tweet_queue = TweetQueue(lambda tweet: release.wait(5), size=1, workers=1, overflow="block", report_interval=0)
+    tweet_queue.start()
+
+    tweet_queue.put(Tweet(0))
+    wait_for(lambda: tweet_queue.stats()["depth"] == 0)
+    tweet_queue.put(Tweet(1))
+    threading.Timer(0.05, release.set).start()
+    tweet_queue.put(Tweet(2))
+
+    assert tweet_queue.stats()["dropped"] == 0
+
+
+def test_spilled_tweets_are_processed_in_order(tmp_path):
+    path = tmp_path / "spill.jsonl"
+    tweet_queue = spill_queue(path, print)
+
+    for tweet_id in range(6):
+        tweet_queue.put(Tweet(tweet_id))
+    assert tweet_queue.stats()["spill_backlog"] == 4
+
+    taken = drain(tweet_queue)
+    tweet_queue._unspill()
+    # New tweets wait behind the backlog
+    tweet_queue.put(Tweet(6))
+    taken += drain(tweet_queue)
+    tweet_queue._unspill()
+    taken += drain(tweet_queue)
+    tweet_queue._unspill()
+    taken += drain(tweet_queue)
+
+    assert [tweet.id for tweet in taken] == list(range(7))
+    assert tweet_queue.stats()["spill_backlog"] == 0
+    assert not os.path.exists(path)
+
+
+def test_spill_file_is_read_from_where_it_stopped(tmp_path):
+    path = tmp_path / "spill.jsonl"
+    tweet_queue = spill_queue(path, print)
+    for tweet_id in range(12):
+        tweet_queue.put(Tweet(tweet_id))
+    size = os.path.getsize(path)
+
+    drain(tweet_queue)
+    tweet_queue._unspill()
+
+    # The file is not rewritten as it is read
+    assert os.path.getsize(path) == size
+    assert tweet_queue._spill_offset > 0
+    assert drain(tweet_queue) == [Tweet(2), Tweet(3)]
+
+
+def test_spilled_tweets_are_picked_up_after_a_restart(tmp_path):
+    path = tmp_path / "spill.jsonl"
+    before = spill_queue(path, print, size=1)
+    for tweet_id in range(3):
+        before.put(Tweet(tweet_id))
+    assert before.stats()["spill_backlog"] == 2
+
+    processed = []
+    after = spill_queue(path, lambda tweet: processed.append(tweet.id), size=1, workers=1)
+    assert after.stats()["spill_backlog"] == 2
+    after.start()
+    wait_for(lambda: len(processed) == 2)
+
+    assert processed == [1, 2]
+    wait_for(lambda: not os.path.exists(path))
@@ -0,0 +1,174 @@
+""" Cache for Google Vision API results.
+
+The same image often turns up more than once, e.g. in retweets, quote tweets and reposted memes. Caching the results
+saves paying for, and waiting on, the same Vision API call again.
+
+Results are cached by image URL and, optionally, by a hash of the image content, so the same image posted under a
+different URL is also found. The cache never downloads images itself, content is hashed when the caller has
+downloaded it. There are two tiers:
+
+    * Memory: A least recently used cache of a fixed number of entries.
+    * Disk (optional): A SQLite database, so results survive restarts. Entries expire after a time to live and the
+      oldest entries are evicted once the database holds too many.
+
+"""
+
+import hashlib
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+
+class VisionCache:
+    """ Two tier cache for Vision API results.
+
+    Values are stored per feature, e.g. "text" or "objects", so each analysis can be cached separately.
+
+    Attributes:
+        max_entries (int): Maximum number of entries held in memory.
+        ttl (float): Seconds before an entry expires.
+        max_rows (int): Maximum number of entries held on disk.
+        hash_content (bool): Also key entries by a hash of the downloaded image.
+    """
+
+    def __init__(self, max_entries=1024, path=None, ttl=7 * 24 * 60 * 60, max_rows=100000, hash_content=False):
+        """ Initialises the cache.
+
+        Args:
+            max_entries (int): Maximum number of entries held in memory.
+            path (str): Path of the SQLite database, None disables the disk tier.
+            ttl (float): Seconds before an entry expires.
+            max_rows (int): Maximum number of entries held on disk.
+            hash_content (bool): Also key entries by a hash of the downloaded image.
+        """
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.max_rows = max_rows
+        self.hash_content = hash_content
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "memory_hits": 0, "disk_hits": 0, "evictions": 0}
+
+        self._db = None
+        if path:
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS vision_cache (key TEXT PRIMARY KEY, value TEXT NOT NULL, created REAL NOT NULL)"
+            )
+            self._db.execute("CREATE INDEX IF NOT EXISTS vision_cache_created ON vision_cache (created)")
+            self._db.commit()
+
+    def stats(self):
+        """ Gets cache statistics.
+
+        Returns:
+            dict: Counts of hits (split into memory and disk hits), misses and disk evictions.
+        """
+        with self._lock:
+            return dict(self._stats)
+
+    def keys(self, image_url, content=None):
+        """ Gets the cache keys for an image.
+
+        The URL key always comes first, so a lookup can be made by URL before the image is downloaded.
+
+        Args:
+            image_url (str): URL of the image.
+            content (bytes): Downloaded image content, None if it has not been downloaded.
+
+        Returns:
+            list of str: Keys for the image, by URL and, if content hashing is enabled and there is content, by
+                content hash.
+        """
+        keys = [f"url:{image_url}"]
+        if self.hash_content and content is not None:
+            keys.append(f"sha256:{hashlib.sha256(content).hexdigest()}")
+        return keys
+
+    def get(self, feature, keys, count_miss=True):
+        """ Looks up a result.
+
+        Args:
+            feature (str): Name of the analysis, e.g. "text" or "objects".
+            keys (list of str): Keys for the image, from keys().
+            count_miss (bool): Count a miss in the statistics, False when the image will be looked up again by its
+                content hash.
+
+        Returns:
+            str: Cached result, or None if there is no result for any of the keys.
+        """
+        now = time.time()
+        with self._lock:
+            for key in keys:
+                entry = self._memory.get((feature, key))
+                if entry is not None and now - entry[1] < self.ttl:
+                    self._memory.move_to_end((feature, key))
+                    self._stats["hits"] += 1
+                    self._stats["memory_hits"] += 1
+                    return entry[0]
+
+            if self._db is not None:
+                for key in keys:
+                    row = self._db.execute(
+                        "SELECT value, created FROM vision_cache WHERE key = ? AND created > ?",
+                        (f"{feature}:{key}", now - self.ttl)
+                    ).fetchone()
+                    if row is not None:
+                        self._remember((feature, key), row[0], row[1])
+                        self._stats["hits"] += 1
+                        self._stats["disk_hits"] += 1
+                        return row[0]
+
+            if count_miss:
+                self._stats["misses"] += 1
+            return None
+
+    def set(self, feature, keys, value):
+        """ Stores a result under every key for the image.
+
+        Args:
+            feature (str): Name of the analysis, e.g. "text" or "objects".
+            keys (list of str): Keys for the image, from keys().
+            value (str): Result to store.
+        """
+        now = time.time()
+        with self._lock:
+            for key in keys:
+                self._remember((feature, key), value, now)
+
+            if self._db is not None:
+                self._db.executemany(
+                    "INSERT OR REPLACE INTO vision_cache (key, value, created) VALUES (?, ?, ?)",
+                    [(f"{feature}:{key}", value, now) for key in keys]
+                )
+                self._evict(now)
+                self._db.commit()
+
+    def _remember(self, key, value, created):
+        """ Adds an entry to the memory tier, removing the least recently used entry if it is full.
+
+        Args:
+            key (tuple of str): Feature and key.
+            value (str): Result to store.
+            created (float): Time the result was created.
+        """
+        self._memory[key] = (value, created)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def _evict(self, now):
+        """ Removes expired entries from the disk tier, then the oldest entries if it holds too many.
+
+        Args:
+            now (float): Current time.
+        """
+        removed = self._db.execute("DELETE FROM vision_cache WHERE created <= ?", (now - self.ttl,)).rowcount
+        rows = self._db.execute("SELECT COUNT(*) FROM vision_cache").fetchone()[0]
+        if rows > self.max_rows:
+            removed += self._db.execute(
+                "DELETE FROM vision_cache WHERE key IN (SELECT key FROM vision_cache ORDER BY created LIMIT ?)",
+                (rows - self.max_rows,)
+            ).rowcount
+        self._stats["evictions"] += removed
@@ -0,0 +1,253 @@
+""" Worker queue for processing tweets off the stream thread.
+
+The Twitter stream only has to put each tweet on a bounded queue, which is drained by a pool of worker threads. This
+keeps the socket being read while tweets are analysed, so a burst of tweets cannot back up the stream and cause a
+disconnect.
+
+When the queue is full, one of the overflow policies is applied:
+
+    * drop_oldest: The oldest waiting tweet is dropped to make room.
+    * block: The stream waits for room, up to a timeout, after which the new tweet is dropped.
+    * spill: The tweet is written to a file on disk and read back once the queue has room. While there are tweets on
+      disk, new tweets are written after them, so tweets are still processed in the order they arrived. The file is
+      read from where the last read stopped, in batches of up to half the queue, and removed once it has been read.
+
+"""
+
+import json
+import os
+import queue
+import threading
+
+from config import logger
+
+OVERFLOW_POLICIES = ("drop_oldest", "block", "spill")
+
+# Placed on the queue to stop a worker
+_STOP = object()
+
+
+class TweetQueue:
+    """ Bounded queue drained by a pool of worker threads.
+
+    Attributes:
+        process (callable): Function called with each tweet taken from the queue.
+        overflow (str): Policy applied when the queue is full, one of OVERFLOW_POLICIES.
+        block_timeout (float): Seconds to wait for room when the overflow policy is "block".
+        spill_path (str): File used to hold tweets when the overflow policy is "spill".
+        report_interval (float): Seconds between queue depth reports, 0 disables reporting.
+    """
+
+    def __init__(self, process, size=100, workers=2, overflow="drop_oldest", block_timeout=5, spill_path=None,
+                 serialize=None, deserialize=None, report_interval=60):
+        """ Initialises the queue, workers are not started until start() is called.
+
+        Args:
+            process (callable): Function called with each tweet taken from the queue.
+            size (int): Maximum number of tweets waiting on the queue.
+            workers (int): Number of worker threads.
+            overflow (str): Policy applied when the queue is full, one of OVERFLOW_POLICIES.
+            block_timeout (float): Seconds to wait for room when the overflow policy is "block".
+            spill_path (str): File used to hold tweets when the overflow policy is "spill".
+            serialize (callable): Converts a tweet to a JSON serialisable object for spilling.
+            deserialize (callable): Converts a spilled object back to a tweet.
+            report_interval (float): Seconds between queue depth reports, 0 disables reporting.
+        """
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError(f"Unknown overflow policy {overflow}, expected one of {', '.join(OVERFLOW_POLICIES)}")
+        if overflow == "spill" and not (spill_path and serialize and deserialize):
+            raise ValueError("The spill overflow policy needs a spill path, serialize and deserialize")
+
+        self.process = process
+        self.overflow = overflow
+        self.block_timeout = block_timeout
+        self.spill_path = spill_path
+        self.report_interval = report_interval
+        self._serialize = serialize
+        self._deserialize = deserialize
+
+        self._queue = queue.Queue(maxsize=size)
+        self._workers = [
+            threading.Thread(target=self._work, name=f"tweet-worker-{i}", daemon=True) for i in range(workers)
+        ]
+        self._spill_lock = threading.Lock()
+        self._spilled = 0
+        # Position in the spill file of the first tweet not yet read back
+        self._spill_offset = 0
+        if spill_path and os.path.exists(spill_path):
+            # Tweets spilled before a restart are picked up again
+            with open(spill_path, "rb") as file:
+                self._spilled = sum(1 for _ in file)
+        self._stats_lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._stats = {
+            "enqueued": 0,
+            "processed": 0,
+            "failed": 0,
+            "dropped": 0,
+            "spilled": 0,
+            "max_depth": 0
+        }
+
+    def start(self):
+        """ Starts the worker threads and the queue depth reporter. """
+        for worker in self._workers:
+            worker.start()
+        if self.report_interval:
+            threading.Thread(target=self._report, name="tweet-queue-report", daemon=True).start()
+
+    def stop(self):
+        """ Stops the workers once every tweet already on the queue has been processed. """
+        self._stopped.set()
+        for _ in self._workers:
+            self._queue.put(_STOP)
+
+    def _count(self, name, amount=1):
+        """ Increments a statistics counter.
+
+        Args:
+            name (str): Name of the counter.
+            amount (int): Amount to add.
+        """
+        with self._stats_lock:
+            self._stats[name] += amount
+
+    def stats(self):
+        """ Gets queue statistics.
+
+        Returns:
+            dict: Current depth and spilled backlog, along with counts of enqueued, processed, failed, dropped and
+                spilled tweets and the maximum depth seen.
+        """
+        with self._stats_lock:
+            stats = dict(self._stats)
+        stats["depth"] = self._queue.qsize()
+        stats["spill_backlog"] = self._spilled
+        return stats
+
+    def put(self, tweet):
+        """ Adds a tweet to the queue, applying the overflow policy if the queue is full.
+
+        Called from the stream thread, this only blocks when the overflow policy is "block".
+
+        Args:
+            tweet (tweet): Tweet object.
+        """
+        if self._spilled:
+            # Older tweets are waiting on disk, this one goes after them
+            self._spill(tweet)
+            return
+        try:
+            self._queue.put_nowait(tweet)
+        except queue.Full:
+            self._overflow(tweet)
+        else:
+            self._count("enqueued")
+
+        depth = self._queue.qsize()
+        with self._stats_lock:
+            self._stats["max_depth"] = max(self._stats["max_depth"], depth)
+
+    def _overflow(self, tweet):
+        """ Applies the overflow policy for a tweet which did not fit on the queue.
+
+        Args:
+            tweet (tweet): Tweet object.
+        """
+        if self.overflow == "spill":
+            self._spill(tweet)
+            return
+
+        if self.overflow == "block":
+            try:
+                self._queue.put(tweet, timeout=self.block_timeout)
+                self._count("enqueued")
+                return
+            except queue.Full:
+                dropped = tweet
+        else:
+            # Make room by dropping the oldest tweet, the workers may have already made room in the meantime
+            try:
+                dropped = self._queue.get_nowait()
+            except queue.Empty:
+                dropped = None
+            try:
+                self._queue.put_nowait(tweet)
+                self._count("enqueued")
+            except queue.Full:
+                dropped = tweet
+
+        if dropped is not None:
+            self._count("dropped")
+            logger.warning(f"Tweet queue full, dropped tweet id {dropped.id}")
+
+    def _spill(self, tweet):
+        """ Writes a tweet to the spill file.
+
+        Args:
+            tweet (tweet): Tweet object.
+        """
+        with self._spill_lock:
+            with open(self.spill_path, "a") as file:
+                file.write(json.dumps(self._serialize(tweet)) + "\n")
+            self._spilled += 1
+        self._count("spilled")
+
+    def _unspill(self):
+        """ Moves spilled tweets back onto the queue while there is room.
+
+        Reading carries on from where the last read stopped, and the file is removed once every tweet has been read.
+        """
+        with self._spill_lock:
+            if not self._spilled:
+                return
+            with open(self.spill_path, "rb") as file:
+                file.seek(self._spill_offset)
+                while self._spilled and not self._queue.full():
+                    line = file.readline()
+                    if not line:
+                        # The file is shorter than expected, e.g. it was truncated by a crash
+                        self._spilled = 0
+                        break
+                    try:
+                        self._queue.put_nowait(self._deserialize(json.loads(line)))
+                    except queue.Full:
+                        # Filled by another stream in the meantime, this tweet is read again next time
+                        break
+                    self._count("enqueued")
+                    self._spill_offset = file.tell()
+                    self._spilled -= 1
+            if not self._spilled:
+                os.remove(self.spill_path)
+                self._spill_offset = 0
+
+    def _work(self):
+        """ Worker loop, processes tweets until stopped. """
+        while True:
+            try:
+                tweet = self._queue.get(timeout=1)
+            except queue.Empty:
+                self._unspill()
+                continue
+            if tweet is _STOP:
+                return
+            try:
+                self.process(tweet)
+                self._count("processed")
+            except Exception as e:
+                self._count("failed")
+                logger.error(f"Error processing tweet id {tweet.id}: {e!r}")
+            if self._spilled and self._queue.qsize() <= self._queue.maxsize // 2:
+                self._unspill()
+
+    def _report(self):
+        """ Periodically logs the queue statistics, warning if tweets were dropped since the last report. """
+        dropped = 0
+        while not self._stopped.wait(self.report_interval):
+            stats = self.stats()
+            message = "Tweet queue: " + ", ".join(f"{name}={value}" for name, value in sorted(stats.items()))
+            if stats["dropped"] > dropped:
+                logger.warning(message)
+            else:
+                logger.debug(message)
+            dropped = stats["dropped"]